@@ -9,6 +9,8 @@ Qualtrics.SurveyEngine.addOnload(function () {
 	var userID = Qualtrics.SurveyEngine.getEmbeddedData('user_id');
 	var interviewID = Qualtrics.SurveyEngine.getEmbeddedData('interview_id');
     var endpoint = Qualtrics.SurveyEngine.getEmbeddedData('interview_endpoint');
+	// Optional: Stream questions as they are generated (only if deployed as Flask app, e.g. 'http://<HOST>/next/stream')
+    var streamEndpoint = Qualtrics.SurveyEngine.getEmbeddedData('interview_stream_endpoint');
 
 	////////////////////////////////
     // Key input and output elements
@@ -20,24 +22,68 @@ Qualtrics.SurveyEngine.addOnload(function () {
 	////////////////////////////////
 	//// START AUDIO INPUT CODE ////
 	////////////////////////////////	
+	// Recordings are sent in segments of this many seconds while recording, each transcribed as it arrives,
+	// such that only the last segment is left to transcribe when the recording is stopped.
+	// Each segment is recorded by its own MediaRecorder, as only the first chunk of a recording has its header.
+	const segmentSeconds = 10;
 	let mediaRecorder;
-	let audioChunks = []; 
 	let stream;
+	let segmentTimer;
+	let segmentTexts = []; // transcription of each segment, in order
+	let segmentRequests = []; // pending transcriptions of segments
 	const recordButton = document.getElementById("recordButton"); // The record button
 
+	// Send segment itself (rather than base64 in JSON) to the transcribe API endpoint
+	function transcribeSegment(audioBlob, index) {
+		// Continue the transcription of the preceding segment, if already transcribed
+		var prompt = index > 0 ? segmentTexts[index - 1] : "";
+		var url = endpoint + (endpoint.includes("?") ? "&" : "?") + "route=transcribe";
+		if (prompt) url += "&prompt=" + encodeURIComponent(prompt.slice(-800));
+		return new Promise(function (resolve, reject) {
+			jQuery.ajax({
+				url: url,
+				type: "POST",
+				timeout: 60000,
+				data: audioBlob,
+				processData: false,
+				contentType: "audio/webm",
+				dataType: "json",
+				success: function (data) {
+					segmentTexts[index] = (data.transcription || "").trim();
+					resolve();
+				},
+				error: function (jqXHR, textStatus, errorThrown) {
+					reject(errorThrown || textStatus);
+				}
+			});
+		});
+	}
+
+	function recordSegment() {
+		var index = segmentTexts.length;
+		segmentTexts.push("");
+		mediaRecorder = new MediaRecorder(stream);
+		mediaRecorder.ondataavailable = (event) => {
+			if (event.data.size > 0) segmentRequests.push(transcribeSegment(event.data, index));
+		};
+		mediaRecorder.start();
+	}
+
 	recordButton.addEventListener("click", async () => {
 		if (recordButton.textContent === "Record response") {
 			// Start recording
 			try {
 				stream = await navigator.mediaDevices.getUserMedia({ audio: true });
-				mediaRecorder = new MediaRecorder(stream);
-				audioChunks = []; // Reset the audio chunks
+				segmentTexts = []; // Reset the segments
+				segmentRequests = [];
 				recordButton.textContent = "Stop recording";
                 submitButton.disabled = true;
-				mediaRecorder.start();
-				mediaRecorder.ondataavailable = (event) => {
-					audioChunks.push(event.data);
-				};
+				recordSegment();
+				segmentTimer = setInterval(() => {
+					// Send the segment so far and continue recording the next one
+					mediaRecorder.stop();
+					recordSegment();
+				}, segmentSeconds * 1000);
 			} catch (err) {
 				alert("Error accessing microphone: " + err.message);
                 submitButton.disabled = false;
@@ -46,52 +92,27 @@ Qualtrics.SurveyEngine.addOnload(function () {
 			// Stop recording
 			recordButton.textContent = "Transcribing audio...";
 			recordButton.disabled = true;
-			mediaRecorder.stop();
+			clearInterval(segmentTimer);
 			mediaRecorder.onstop = async () => {
-				// Create audio blob in base64 format
-				const audioBlob = new Blob(audioChunks, { type: "audio/webm" });
-				const reader = new FileReader();
-				reader.onloadend = async () => {
-					const audioBase64 = reader.result.split(",")[1]; // Remove the "data:..." prefix
-					const payload = {route: "transcribe", payload: {audio: audioBase64}};
-					// Send audio to the transcribe API endpoint
-					try {
-						jQuery.ajax({
-							url: endpoint,
-							type: "POST",
-							timeout: 60000,
-							data: JSON.stringify(payload),
-							contentType: "application/json",
-							dataType: "json",
-							success: function (data) {
-								const transcript = data.transcription || "Transcription failed. Please try again.";
-								inputField.value = transcript;
-								recordButton.textContent = "Record response";
-                                submitButton.disabled = false;
-							},
-							error: function (jqXHR, textStatus, errorThrown) {
-								console.error("Error:", errorThrown);
-								alert("Something went wrong with the transcription. Please try again.");
-								recordButton.textContent = "Record response";
-                                submitButton.disabled = false;
-							}
-						});
-					} catch (error) {
-						console.error("Communication Error:", error);
-						alert("Error communicating with the API: " + error.message);
-						recordButton.textContent = "Record response";
-					} finally {
-						// Clean up
-						audioChunks = [];
-						recordButton.disabled = false;
-                        submitButton.disabled = false;
-					}
-				};
-
-				reader.readAsDataURL(audioBlob); // Trigger the Base64 encoding
 				stream.getTracks().forEach(track => track.stop()); // Stop microphone access
+				try {
+					// Wait for the last segment (earlier ones have mostly been transcribed already)
+					await Promise.all(segmentRequests);
+					const transcript = segmentTexts.filter(text => text).join(" ");
+					inputField.value = transcript || "Transcription failed. Please try again.";
+				} catch (error) {
+					console.error("Error:", error);
+					alert("Something went wrong with the transcription. Please try again.");
+				} finally {
+					// Clean up
+					segmentTexts = [];
+					segmentRequests = [];
+					recordButton.textContent = "Record response";
+					recordButton.disabled = false;
+					submitButton.disabled = false;
+				}
 			};
-
+			mediaRecorder.stop();
 		}
 	});
 	////////////////////////////////
@@ -120,6 +141,14 @@ Qualtrics.SurveyEngine.addOnload(function () {
             <span class="dot" style="display:inline-block; width:12px; height:6px; border-radius:50%; margin-right:3px; background:#303131; animation: wave 1.3s linear infinite; animation-delay: -0.9s;"></span>
             </div><style>@keyframes wave {0%, 60%, 100% {transform: initial;} 30% {transform: translateY(-7px);}}</style></div>`;
             messageContent.id = "dancingDots"; 
+        } else if (status === "partial") {
+            // Show partial (streamed) message in place of the dancing dots
+            var existingDots = document.getElementById("dancingDots");
+            if (existingDots) {
+                existingDots.innerText = message.trim();
+                chatArea.scrollTop = chatArea.scrollHeight;
+            }
+            return;
         } else if (status === "response") {
             var existingDots = document.getElementById("dancingDots");
             if (existingDots) {
@@ -135,6 +164,44 @@ Qualtrics.SurveyEngine.addOnload(function () {
         chatArea.scrollTop = chatArea.scrollHeight;
     }
 
+
+	////////////////////////////////////////////////////////////
+	// STREAM THE NEXT QUESTION WITH SERVER-SENT EVENTS ////////
+	////////////////////////////////////////////////////////////
+    function streamNextQuestion(url, payload, onToken, onMessage, onError) {
+        fetch(url, {
+            method: "POST",
+            headers: {"Content-Type": "application/json"},
+            body: JSON.stringify(payload)
+        }).then(async (response) => {
+            if (!response.ok) throw new Error(response.statusText);
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+            let received = false;  // whether the final message event arrived
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                // Events are separated by an empty line
+                let boundary;
+                while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+                    let event = "message", data = "";
+                    buffer.slice(0, boundary).split("\n").forEach(line => {
+                        if (line.startsWith("event: ")) event = line.slice(7);
+                        if (line.startsWith("data: ")) data += line.slice(6);
+                    });
+                    buffer = buffer.slice(boundary + 2);
+                    data = JSON.parse(data);
+                    if (event === "token") onToken(data);
+                    if (event === "message") { received = true; onMessage(data); }
+                    if (event === "error") throw new Error(data.message);
+                }
+            }
+            // The stream may close (e.g. by a proxy) without the final message event
+            if (!received) throw new Error("Stream closed before the next question was received");
+        }).catch(onError);
+    }
 	
 	////////////////////////////////////////////
     // GET THE FIRST QUESTION FROM THE SERVER //
@@ -206,55 +273,71 @@ Qualtrics.SurveyEngine.addOnload(function () {
             // Add dancing dots
             appendChatbotMessage("", chatArea, "waiting");
 
-            // API CALL: GENERATE THE NEXT QUESTION
-            jQuery.ajax({
-                url: endpoint,
-                timeout: 60000,
-                type: "POST",
-                data: JSON.stringify({
-					route: "next",
-					payload: {
-						user_message: userMessage,
-						session_id: userID,
-						interview_id: interviewID
-					}
-                }),
-                contentType: "application/json",
-                dataType: "json",
-                success: function (data) {
-                    var next_question = data.message.trim();
+            // Handle reply of the AI interviewer
+            function onNextQuestion(data) {
+                var next_question = data.message.trim();
 
-                    // Check if this is the last message of the interview
-                    var endInterviewIndex = next_question.indexOf("---END---");
-                    if (endInterviewIndex !== -1) {
-                        // End of interview
-                        next_question = next_question.replace("---END---", "");
-                        next_question = next_question.trim();
-                        submitButton.disabled = true;
-                        submitButton.innerText = "End of interview";
-                        // Also disable the audio record button.
-                        recordButton.disabled = true;
-                    } else {
-                        // Interview continues
-                        submitButton.disabled = false;
-                        submitButton.innerText = "Submit response";
-                        submitButton.style.backgroundColor = '#007BFF';
-                        // Re-enable audio record button.
-                        recordButton.disabled = false;
-                    }
-                    appendChatbotMessage(next_question, chatArea, "response");
-                },
-                // REQUEST UNSUCCESSFUL
-                error: function (jqXHR, textStatus, errorThrown) {
-                    console.error("Error:", errorThrown);
-                    appendChatbotMessage("There was a technical error. Please try again.", chatArea, "response");
+                // Check if this is the last message of the interview
+                var endInterviewIndex = next_question.indexOf("---END---");
+                if (endInterviewIndex !== -1) {
+                    // End of interview
+                    next_question = next_question.replace("---END---", "");
+                    next_question = next_question.trim();
+                    submitButton.disabled = true;
+                    submitButton.innerText = "End of interview";
+                    // Also disable the audio record button.
+                    recordButton.disabled = true;
+                } else {
+                    // Interview continues
                     submitButton.disabled = false;
-                    submitButton.style.backgroundColor = '#007BFF';
                     submitButton.innerText = "Submit response";
-                    // Also disable the audio record button.
+                    submitButton.style.backgroundColor = '#007BFF';
+                    // Re-enable audio record button.
                     recordButton.disabled = false;
                 }
-            });
+                appendChatbotMessage(next_question, chatArea, "response");
+            }
+            // REQUEST UNSUCCESSFUL
+            function onError(errorThrown) {
+                console.error("Error:", errorThrown);
+                appendChatbotMessage("There was a technical error. Please try again.", chatArea, "response");
+                submitButton.disabled = false;
+                submitButton.style.backgroundColor = '#007BFF';
+                submitButton.innerText = "Submit response";
+                // Also disable the audio record button.
+                recordButton.disabled = false;
+            }
+
+            // API CALL: GENERATE THE NEXT QUESTION
+            var payload = {
+                user_message: userMessage,
+                session_id: userID,
+                interview_id: interviewID
+            };
+            if (streamEndpoint) {
+                // Show next question while it is being generated
+                var partialQuestion = "";
+                streamNextQuestion(streamEndpoint, payload, function (token) {
+                    partialQuestion += token;
+                    appendChatbotMessage(partialQuestion, chatArea, "partial");
+                }, onNextQuestion, onError);
+            } else {
+                jQuery.ajax({
+                    url: endpoint,
+                    timeout: 60000,
+                    type: "POST",
+                    data: JSON.stringify({
+                        route: "next",
+                        payload: payload
+                    }),
+                    contentType: "application/json",
+                    dataType: "json",
+                    success: onNextQuestion,
+                    error: function (jqXHR, textStatus, errorThrown) {
+                        onError(errorThrown);
+                    }
+                });
+            }
         }
     });
     
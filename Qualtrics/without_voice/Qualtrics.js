@@ -9,6 +9,8 @@ Qualtrics.SurveyEngine.addOnload(function () {
 	var userID = Qualtrics.SurveyEngine.getEmbeddedData('user_id');
 	var interviewID = Qualtrics.SurveyEngine.getEmbeddedData('interview_id');
     var endpoint = Qualtrics.SurveyEngine.getEmbeddedData('interview_endpoint');
+	// Optional: Stream questions as they are generated (only if deployed as Flask app, e.g. 'http://<HOST>/next/stream')
+    var streamEndpoint = Qualtrics.SurveyEngine.getEmbeddedData('interview_stream_endpoint');
 
 	////////////////////////////////
     // Key input and output elements
@@ -36,6 +38,14 @@ Qualtrics.SurveyEngine.addOnload(function () {
             <span class="dot" style="display:inline-block; width:12px; height:6px; border-radius:50%; margin-right:3px; background:#303131; animation: wave 1.3s linear infinite; animation-delay: -0.9s;"></span>
             </div><style>@keyframes wave {0%, 60%, 100% {transform: initial;} 30% {transform: translateY(-7px);}}</style></div>`;
             messageContent.id = "dancingDots"; 
+        } else if (status === "partial") {
+            // Show partial (streamed) message in place of the dancing dots
+            var existingDots = document.getElementById("dancingDots");
+            if (existingDots) {
+                existingDots.innerText = message.trim();
+                chatArea.scrollTop = chatArea.scrollHeight;
+            }
+            return;
         } else if (status === "response") {
             var existingDots = document.getElementById("dancingDots");
             if (existingDots) {
@@ -51,6 +61,44 @@ Qualtrics.SurveyEngine.addOnload(function () {
         chatArea.scrollTop = chatArea.scrollHeight;
     }
 
+
+	////////////////////////////////////////////////////////////
+	// STREAM THE NEXT QUESTION WITH SERVER-SENT EVENTS ////////
+	////////////////////////////////////////////////////////////
+    function streamNextQuestion(url, payload, onToken, onMessage, onError) {
+        fetch(url, {
+            method: "POST",
+            headers: {"Content-Type": "application/json"},
+            body: JSON.stringify(payload)
+        }).then(async (response) => {
+            if (!response.ok) throw new Error(response.statusText);
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+            let received = false;  // whether the final message event arrived
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                // Events are separated by an empty line
+                let boundary;
+                while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+                    let event = "message", data = "";
+                    buffer.slice(0, boundary).split("\n").forEach(line => {
+                        if (line.startsWith("event: ")) event = line.slice(7);
+                        if (line.startsWith("data: ")) data += line.slice(6);
+                    });
+                    buffer = buffer.slice(boundary + 2);
+                    data = JSON.parse(data);
+                    if (event === "token") onToken(data);
+                    if (event === "message") { received = true; onMessage(data); }
+                    if (event === "error") throw new Error(data.message);
+                }
+            }
+            // The stream may close (e.g. by a proxy) without the final message event
+            if (!received) throw new Error("Stream closed before the next question was received");
+        }).catch(onError);
+    }
 	
 	////////////////////////////////////////////
     // GET THE FIRST QUESTION FROM THE SERVER //
@@ -120,49 +168,65 @@ Qualtrics.SurveyEngine.addOnload(function () {
             // Add dancing dots
             appendChatbotMessage("", chatArea, "waiting");
 
-            // API CALL: GENERATE THE NEXT QUESTION
-            jQuery.ajax({
-                url: endpoint,
-                timeout: 60000,
-                type: "POST",
-                data: JSON.stringify({
-					route: "next",
-					payload: {
-						user_message: userMessage,
-						session_id: userID,
-						interview_id: interviewID
-					}
-                }),
-                contentType: "application/json",
-                dataType: "json",
-                success: function (data) {
-                    var next_question = data.message.trim();
-
-                    // Check if this is the last message of the interview
-                    var endInterviewIndex = next_question.indexOf("---END---");
-                    if (endInterviewIndex !== -1) {
-                        // End of interview
-                        next_question = next_question.replace("---END---", "");
-                        next_question = next_question.trim();
-                        submitButton.disabled = true;
-                        submitButton.innerText = "End of interview";
-                    } else {
-                        // Interview continues
-                        submitButton.disabled = false;
-                        submitButton.innerText = "Submit response";
-                        submitButton.style.backgroundColor = '#007BFF';
-                    }
-                    appendChatbotMessage(next_question, chatArea, "response");
-                },
-                // REQUEST UNSUCCESSFUL
-                error: function (jqXHR, textStatus, errorThrown) {
-                    console.error("Error:", errorThrown);
-                    appendChatbotMessage("There was a technical error. Please try again.", chatArea, "response");
+            // Handle reply of the AI interviewer
+            function onNextQuestion(data) {
+                var next_question = data.message.trim();
+
+                // Check if this is the last message of the interview
+                var endInterviewIndex = next_question.indexOf("---END---");
+                if (endInterviewIndex !== -1) {
+                    // End of interview
+                    next_question = next_question.replace("---END---", "");
+                    next_question = next_question.trim();
+                    submitButton.disabled = true;
+                    submitButton.innerText = "End of interview";
+                } else {
+                    // Interview continues
                     submitButton.disabled = false;
-                    submitButton.style.backgroundColor = '#007BFF';
                     submitButton.innerText = "Submit response";
+                    submitButton.style.backgroundColor = '#007BFF';
                 }
-            });
+                appendChatbotMessage(next_question, chatArea, "response");
+            }
+            // REQUEST UNSUCCESSFUL
+            function onError(errorThrown) {
+                console.error("Error:", errorThrown);
+                appendChatbotMessage("There was a technical error. Please try again.", chatArea, "response");
+                submitButton.disabled = false;
+                submitButton.style.backgroundColor = '#007BFF';
+                submitButton.innerText = "Submit response";
+            }
+
+            // API CALL: GENERATE THE NEXT QUESTION
+            var payload = {
+                user_message: userMessage,
+                session_id: userID,
+                interview_id: interviewID
+            };
+            if (streamEndpoint) {
+                // Show next question while it is being generated
+                var partialQuestion = "";
+                streamNextQuestion(streamEndpoint, payload, function (token) {
+                    partialQuestion += token;
+                    appendChatbotMessage(partialQuestion, chatArea, "partial");
+                }, onNextQuestion, onError);
+            } else {
+                jQuery.ajax({
+                    url: endpoint,
+                    timeout: 60000,
+                    type: "POST",
+                    data: JSON.stringify({
+                        route: "next",
+                        payload: payload
+                    }),
+                    contentType: "application/json",
+                    dataType: "json",
+                    success: onNextQuestion,
+                    error: function (jqXHR, textStatus, errorThrown) {
+                        onError(errorThrown);
+                    }
+                });
+            }
         }
     });
     
@@ -2,12 +2,15 @@
 
 from flask import (
 	Flask, 
+	Response,
 	request,
 	jsonify, 
 	render_template, 
-	make_response
+	make_response,
+	stream_with_context
 )
-from core import decorators, logic
+import json
+from core import audio, decorators, logic
 
 app = Flask(__name__)
 app.error_handler_spec[None] = decorators.wrap_flask_errors()
@@ -76,6 +79,37 @@ def next():
 	response = logic.next_question(**payload)
 	return jsonify(response)
 
+@app.route('/next/stream', methods=['POST', 'OPTIONS'])
+@decorators.handle_500
+def next_stream():
+	"""Endpoint: /next/stream (POST)
+	----------------------------------
+	Description:
+		Streaming variant of /next. The next interview question is returned as Server-Sent Events while it is being generated:
+		'token' events (JSON string) contain the newly generated text, a final 'message' event contains the same response as /next,
+		and an 'error' event is sent if processing fails. Note that the interview is only stored once the full question is generated,
+		and that questions of interviews moderating them are sent in the final 'message' event only (once reviewed).
+		The endpoint may be called from other origins (CORS), answering the browser's preflight OPTIONS request.
+
+	Input Arguments:
+		- JSON payload containing the session_id (str), interview_id (str) and user_message (str).
+
+	Example Query:
+		Using the command line with curl:
+			```
+			curl -N -X POST -H "Content-Type: application/json" -d '{"session_id": "67890", "interview_id": "STOCK_MARKET", "user_message": "I do not like risky investments"}' http://127.0.0.1:8000/next/stream
+			```
+	"""
+	if request.method == 'OPTIONS':
+		return make_response('', 204, decorators.CORS_HEADERS)
+	payload = request.get_json(force=True)
+	events = decorators.server_sent_events(logic.next_question_stream(**payload))
+	return Response(
+		stream_with_context(events), 
+		mimetype='text/event-stream', 
+		headers={'Cache-Control':'no-cache', 'X-Accel-Buffering':'no', **decorators.CORS_HEADERS}
+	)
+
 @app.route('/transcribe', methods=['POST'])
 @decorators.handle_500
 def transcribe():
@@ -85,7 +119,11 @@ def transcribe():
 		This endpoint is called to transcribe an audio message recorded by the interviewee. It processes the audio input and returns the transcribed text.
 	
 	Input Arguments:
-		JSON payload containing the audio (str) to be transcribed.
+		The recording as the raw request body (e.g. Content-Type: audio/webm), as file 'audio' of a multipart form,
+		or a JSON payload containing the base64-encoded audio (str). Binary recordings are spooled to a temporary
+		file as they are received, rather than held in memory as a whole.
+		Optionally, the transcription of the preceding segment of the recording (prompt), if the recording is
+		transcribed in segments while it is recorded: in the query string, form or JSON payload, respectively.
 	
 	Example Query:
 		Using Python's requests package:
@@ -99,10 +137,18 @@ def transcribe():
 	Using the command line with curl:
 		```
 		curl -X POST -H "Content-Type: application/json" -d '{"audio": "base64_encoded_audio_string"}' http://127.0.0.1:8000/transcribe
+		curl -X POST -H "Content-Type: audio/webm" --data-binary @recording.webm http://127.0.0.1:8000/transcribe
+		curl -X POST -F "audio=@recording.webm" http://127.0.0.1:8000/transcribe
 		```
 	"""
-	payload = request.get_json(force=True)
-	response = logic.transcribe(**payload)
+	if request.mimetype.startswith('audio/'):
+		response = logic.transcribe(audio.spool(audio.read_chunks(request.stream)), prompt=request.args.get('prompt'))
+	elif request.mimetype == 'multipart/form-data':
+		upload = request.files['audio']
+		response = logic.transcribe(upload.stream, upload.filename, request.form.get('prompt'))
+	else:
+		payload = request.get_json(force=True)
+		response = logic.transcribe(**payload)
 	return jsonify(response)
 
 @app.route('/load/<session_id>', methods=['GET'])
@@ -155,29 +201,60 @@ def delete(session_id:str):
 	logic.delete_interview_session(session_id)
 	return make_response(f"Successfully deleted session '{session_id}'.")
 
-@app.route('/retrieve', methods=['GET'])
+@app.route('/retrieve', methods=['GET', 'POST'])
 @decorators.handle_500
 def retrieve():
-	""" Endpoint: /retrieve (GET)
+	""" Endpoint: /retrieve (GET or POST)
 	-------------------------
 	Description:
-		This endpoint retrieves all stored interview sessions from the database and returns them.
+		This endpoint retrieves stored interview sessions from the database and returns them.
+		Without further arguments, all sessions are returned at once. For large numbers of sessions, 
+		retrieve them page by page (passing the returned `cursor` to get the next page until it is null)
+		or stream them as newline-delimited JSON (one message per line).
 
-	Input Arguments:
-		None
+	Input Arguments (as query parameters or JSON payload, all optional):
+		- sessions (list): session IDs to retrieve (comma-separated as query parameter), defaults to all sessions.
+		- page_size (int): number of sessions per page (with the item-per-message DynamoDB layout,
+		  number of messages per page when retrieving all sessions).
+		- cursor (str): continuation token returned with the previous page (HTTP 400 if invalid).
+		- format (str): 'ndjson' to stream all (remaining) messages as newline-delimited JSON, or 'usage'
+		  to return the OpenAI tokens and latencies of the sessions per interview (totals and percentiles).
 
 	Example Query:
 		Using requests package:
 			```
 			response = requests.get('http://127.0.0.1:8000/retrieve')
+			page = requests.get('http://127.0.0.1:8000/retrieve', params={'page_size': 25}).json()
+			next_page = requests.get('http://127.0.0.1:8000/retrieve', params={'page_size': 25, 'cursor': page['cursor']}).json()
 			```
 
 		Using curl:
 			```
 			curl http://127.0.0.1:8000/retrieve
+			curl "http://127.0.0.1:8000/retrieve?sessions=session-id-1,session-id-2"
+			curl "http://127.0.0.1:8000/retrieve?format=ndjson" > chats.ndjson
+			curl "http://127.0.0.1:8000/retrieve?format=usage"
 			```
 	"""
-	response = logic.retrieve_sessions()
+	payload = request.get_json(force=True, silent=True) or {}
+	payload = payload.get('payload', payload)
+	args = {**payload, **request.args.to_dict()}
+	if isinstance(args.get('sessions'), str):
+		args['sessions'] = args['sessions'].split(',')
+	paging = {key: args[key] for key in ['sessions', 'page_size', 'cursor'] if args.get(key)}
+	decorators.check_cursor(paging.get('cursor'))
+
+	if args.get('format') == 'ndjson':
+		messages = logic.stream_sessions(**paging)
+		return Response(
+			stream_with_context(json.dumps(message) + "\n" for message in messages),
+			mimetype='application/x-ndjson'
+		)
+	if args.get('format') == 'usage':
+		return jsonify(logic.usage_report(paging.get('sessions')))
+	if paging.get('page_size') or paging.get('cursor'):
+		return jsonify(logic.retrieve_sessions_page(**paging))
+	response = logic.retrieve_sessions(paging.get('sessions'))
 	return jsonify(response)
 
 
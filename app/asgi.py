@@ -0,0 +1,110 @@
+"""This ASGI (Quart) application serves the same endpoints as the Flask application in app.py, see there for their documentation.
+OpenAI requests and database operations are awaited asynchronously, so that a single process can hold hundreds of concurrent interviews
+rather than one interview per (uWSGI) worker. Run it, for example, with Hypercorn from within the app directory:
+	hypercorn asgi:app --bind 0.0.0.0:8000
+"""
+
+from quart import (
+	Quart,
+	Response,
+	request,
+	jsonify,
+	render_template,
+	make_response
+)
+import json
+from core import audio, decorators, async_logic as logic
+
+app = Quart(__name__)
+app.add_url_rule('/healthcheck', 'healthcheck', lambda: ('', 200))
+
+@app.route('/', methods=['GET'])
+async def index():
+	"""For verifying that the app is running. Not needed in practice."""
+	return 'Running!'
+
+@app.route('/<interview_id>/<session_id>', methods=['GET'])
+@decorators.handle_500_async
+async def landing(interview_id:str, session_id:str):
+	"""Endpoint: /<interview_id>/<session_id> (GET), see app.py."""
+	response = await logic.begin_interview_session(session_id, interview_id)
+	return await render_template('chat.html', data=response)
+
+@app.route('/next', methods=['POST'])
+@decorators.handle_500_async
+async def next():
+	"""Endpoint: /next (POST), see app.py."""
+	payload = await request.get_json(force=True)
+	response = await logic.next_question(**payload)
+	return jsonify(response)
+
+@app.route('/next/stream', methods=['POST', 'OPTIONS'])
+@decorators.handle_500_async
+async def next_stream():
+	"""Endpoint: /next/stream (POST), see app.py."""
+	if request.method == 'OPTIONS':
+		return await make_response('', 204, decorators.CORS_HEADERS)
+	payload = await request.get_json(force=True)
+	events = decorators.server_sent_events_async(logic.next_question_stream(**payload))
+	return Response(
+		events,
+		mimetype='text/event-stream',
+		headers={'Cache-Control':'no-cache', 'X-Accel-Buffering':'no', **decorators.CORS_HEADERS}
+	)
+
+@app.route('/transcribe', methods=['POST'])
+@decorators.handle_500_async
+async def transcribe():
+	"""Endpoint: /transcribe (POST), see app.py."""
+	if request.mimetype.startswith('audio/'):
+		response = await logic.transcribe(await audio.spool_async(request.body), prompt=request.args.get('prompt'))
+	elif request.mimetype == 'multipart/form-data':
+		upload = (await request.files)['audio']
+		response = await logic.transcribe(upload.stream, upload.filename, (await request.form).get('prompt'))
+	else:
+		payload = await request.get_json(force=True)
+		response = await logic.transcribe(**payload)
+	return jsonify(response)
+
+@app.route('/load/<session_id>', methods=['GET'])
+@decorators.handle_500_async
+async def load(session_id:str):
+	"""Endpoint: /load/<session_id> (GET), see app.py."""
+	session = await logic.load_interview_session(session_id)
+	return jsonify(session)
+
+@app.route('/delete/<session_id>', methods=['GET'])
+@decorators.handle_500_async
+async def delete(session_id:str):
+	"""Endpoint: /delete/<session_id> (GET), see app.py."""
+	await logic.delete_interview_session(session_id)
+	return await make_response(f"Successfully deleted session '{session_id}'.")
+
+@app.route('/retrieve', methods=['GET', 'POST'])
+@decorators.handle_500_async
+async def retrieve():
+	"""Endpoint: /retrieve (GET or POST), see app.py."""
+	payload = await request.get_json(force=True, silent=True) or {}
+	payload = payload.get('payload', payload)
+	args = {**payload, **request.args.to_dict()}
+	if isinstance(args.get('sessions'), str):
+		args['sessions'] = args['sessions'].split(',')
+	paging = {key: args[key] for key in ['sessions', 'page_size', 'cursor'] if args.get(key)}
+	decorators.check_cursor(paging.get('cursor'))
+
+	if args.get('format') == 'ndjson':
+		async def lines():
+			async for message in logic.stream_sessions(**paging):
+				yield json.dumps(message) + "\n"
+		return Response(lines(), mimetype='application/x-ndjson')
+	if args.get('format') == 'usage':
+		return jsonify(await logic.usage_report(paging.get('sessions')))
+	if paging.get('page_size') or paging.get('cursor'):
+		return jsonify(await logic.retrieve_sessions_page(**paging))
+	response = await logic.retrieve_sessions(paging.get('sessions'))
+	return jsonify(response)
+
+
+if __name__ == "__main__":
+	# Only for debugging while developing!
+	app.run(host="127.0.0.1", port=8000, debug=True)
@@ -1,93 +1,219 @@
 import logging
+import time
+from concurrent.futures import CancelledError
 from core.auxiliary import (
     execute_queries, 
-    fill_prompt_with_interview, 
-    chat_to_string
+    clean_completion
 )
-from io import BytesIO
-from base64 import b64decode
-from openai import OpenAI
+from core.context import InterviewContext
+from core.templates import InterviewTemplate
+from core.batcher import MicroBatcher
+from core.deadline import BoundedClient, Deadline, DeadlineExceeded, bounded
+from core.usage import TurnUsage
+from core.audio import audio_upload, digest, PROMPT_LENGTH
+from core.result_cache import ResultCache, result_key, is_deterministic
+from core.cassette import Cassette, CassetteClient
+from openai import OpenAI, APITimeoutError
 
 
 class LLMAgent(object):
-    """ Class to manage LLM-based agents. """
-    def __init__(self, api_key, timeout:int=30, max_retries:int=3):
+    """ 
+    Class to manage LLM-based agents. The agent holds no interview state: 
+    interview guidelines (`template`) are passed with each call, such that
+    one agent (and its OpenAI client) can be shared by concurrent sessions.
+    Methods optionally take the `Deadline` of the request, bounding their OpenAI
+    requests by its remaining budget and raising `DeadlineExceeded` once it runs out,
+    and the `TurnUsage` of the request, recording their tokens and latencies.
+    Given a `Cassette`, requests are recorded to or replayed from it, and given a
+    `ResultCache`, results of deterministic requests are reused when they are repeated.
+    """
+    bounded_client = BoundedClient
+
+    def __init__(self, api_key, timeout:int=30, max_retries:int=3, moderation_window:float=0, cassette:Cassette=None, result_cache:ResultCache=None):
+        self.max_retries = max_retries
         self.client = OpenAI(api_key=api_key, timeout=timeout, max_retries=max_retries)
+        if cassette is not None:
+            # Optional: Record requests to or replay them from a cassette
+            self.client = CassetteClient(self.client, cassette)
+        # Optional: Serve results of repeated deterministic requests (e.g. retries) from cache
+        self.result_cache = result_cache
         logging.info("OpenAI client instantiated. Should happen only once!")
+        # Optional: Moderate questions of concurrent sessions in batches
+        self.moderation_batcher = MicroBatcher(self.moderate_batch, moderation_window) if moderation_window else None
 
-    def load_parameters(self, parameters:dict):
-        """ Load interview guidelines for prompt construction. """
-        self.parameters = parameters
+    def client_for(self, deadline:Deadline=None):
+        """ Return OpenAI client, with requests (and their retries) bounded by the remaining budget if given a deadline. """
+        if deadline is None:
+            return self.client
+        deadline.timeout() # raise right away if the budget has run out
+        return self.bounded_client(self.client, deadline, self.max_retries)
 
-    def transcribe(self, audio) -> str:
-        """ Transcribe audio file. """
-        audio_file = BytesIO(b64decode(audio))
-        audio_file.name = "audio.webm"
+    def cache_key(self, *request) -> str:
+        """ Return key of a deterministic request's result, if results are cached (see `core.result_cache`). """
+        return result_key(*request) if self.result_cache is not None else None
 
+    def transcribe(self, audio, filename:str=None, prompt:str=None) -> str:
+        """
+        Transcribe audio file: base64-encoded (str) or binary (bytes or file), see `core.audio.audio_upload`.
+        A segment of a longer recording is given the transcription of the preceding segment as `prompt`.
+        """
+        # Optional: Continue the transcription of the preceding segment (the model reads its end only)
+        options = {'prompt': prompt[-PROMPT_LENGTH:]} if prompt else {}
+        audio_file = audio_upload(audio, filename)
+        key = self.cache_key('transcription', "whisper-1", audio_file[0], digest(audio_file[1]), options)
+        transcription = self.result_cache.get(key) if key else None
+        if transcription is not None:
+            return transcription
         response = self.client.audio.transcriptions.create(
-          model="whisper-1", 
+          model="whisper-1",
           file=audio_file,
-          language="en" # English language input
+          language="en", # English language input
+          **options
         )
+        if key: self.result_cache.put(key, response.text)
         return response.text
 
-    def construct_query(self, tasks:list, history:list, user_message:str=None) -> dict:
+    def construct_query(self, template:InterviewTemplate, tasks:list, context:InterviewContext, user_message:str=None) -> dict:
         """ 
         Construct OpenAI API completions query, 
-        defaults to `gpt-4o-mini` model, 300 token answer limit, and temperature of 0. 
+        defaults to `gpt-4o-mini` model, 300 token answer limit, and temperature of 0
+        (see `core.templates.PromptTemplate`), with the static system message of
+        cache-friendly prompts first.
         For details see https://platform.openai.com/docs/api-reference/completions.
         """
         return {
             task: {
-                "messages": [{
+                "messages": ([{
+                    "role":"system",
+                    "content": template.prompts[task].system
+                }] if template.prompts[task].system else []) + [{
                     "role":"user", 
-                    "content": fill_prompt_with_interview(
-                        self.parameters[task]['prompt'], 
-                        self.parameters['interview_plan'],
-                        history,
-                        user_message=user_message
-                    )
+                    "content": template.render(task, context, user_message=user_message)
                 }],
-                "model": self.parameters[task].get('model', 'gpt-4o-mini'),
-                "max_tokens": self.parameters[task].get('max_tokens', 300),
-                "temperature": self.parameters[task].get('temperature', 0)
+                **template.prompts[task].settings
             } for task in tasks
         }
 
-    def review_answer(self, message:str, history:list) -> bool:
-        """ Moderate answers: Are they on topic? """
-        response = execute_queries(
-            self.client.chat.completions.create,
-            self.construct_query(['moderator'], history, message)
-        )
-        return "yes" in response["moderator"].lower()
+    @bounded
+    def review_answer(self, template:InterviewTemplate, message:str, context:InterviewContext, prefilter:bool=True, deadline:Deadline=None, usage:TurnUsage=None) -> bool:
+        """ Moderate answers: Are they on topic? Obvious cases are decided by the (optional) local prefilter. """
+        if prefilter and template.prefilter:
+            on_topic = template.prefilter.review(context.state['content'], template.current_topic(context), message)
+            if on_topic is not None:
+                logging.info(f"Prefilter decided answer is on topic: {on_topic}")
+                return on_topic
+        query = self.construct_query(template, ['moderator'], context, message)
+        key = self.cache_key('moderator', query['moderator']) if is_deterministic(query['moderator']) else None
+        verdict = self.result_cache.get(key) if key else None
+        if verdict is None:
+            response = execute_queries(
+                self.client_for(deadline).chat.completions.create,
+                query,
+                hedges=template.hedges(['moderator']),
+                usage=usage
+            )
+            verdict = response["moderator"]
+            if key: self.result_cache.put(key, verdict)
+        return "yes" in verdict.lower()
+
+    def moderate(self, inputs:list, deadline:Deadline=None) -> list:
+        """ Return whether each input is flagged by the moderation endpoint (in one request, for inputs not cached). """
+        keys = [self.cache_key('moderation', "omni-moderation-latest", text) for text in inputs]
+        flagged = [(self.result_cache.get(key) if key else None) for key in keys]
+        missing = [i for i, result in enumerate(flagged) if result is None]
+        if missing:
+            response = self.client_for(deadline).moderations.create(
+                model="omni-moderation-latest",
+                input=[inputs[i] for i in missing],
+            )
+            for i, result in zip(missing, response.to_dict()["results"]):
+                flagged[i] = result["flagged"]
+                if keys[i]: self.result_cache.put(keys[i], flagged[i])
+        return flagged
 
-    def review_question(self, next_question:str) -> bool:
+    def moderate_batch(self, inputs:list, timeout:float=None):
+        """ Moderate batch of inputs (see `moderate`, awaitable on the asynchronous agent) within the seconds left to its submitters, if bounded. """
+        return self.moderate(inputs, Deadline(timeout, reserve=0) if timeout is not None else None)
+
+    @bounded
+    def review_question(self, next_question:str, deadline:Deadline=None, usage:TurnUsage=None) -> bool:
         """ Moderate questions: Are they flagged by the moderation endpoint? """
-        response = self.client.moderations.create(
-            model="omni-moderation-latest",
-            input=next_question,
-        )
-        return response.to_dict()["results"][0]["flagged"]
+        start = time.monotonic()
+        try:
+            if self.moderation_batcher:
+                try:
+                    return self.moderation_batcher.submit(next_question, deadline.timeout() if deadline else None)
+                except TimeoutError as e:
+                    raise DeadlineExceeded("Moderation batch not processed within request budget") from e
+                except CancelledError as e:
+                    raise DeadlineExceeded("Moderation batch interrupted") from e
+            return self.moderate([next_question], deadline)[0]
+        finally:
+            if usage is not None:
+                usage.record_moderation(time.monotonic() - start)
         
-    def probe_within_topic(self, history:list) -> str:
+    @bounded
+    def probe_within_topic(self, template:InterviewTemplate, context:InterviewContext, deadline:Deadline=None, usage:TurnUsage=None) -> str:
         """ Return next 'within-topic' probing question. """
         response = execute_queries(
-            self.client.chat.completions.create,
-            self.construct_query(['probe'], history)
+            self.client_for(deadline).chat.completions.create,
+            self.construct_query(template, ['probe'], context),
+            hedges=template.hedges(['probe']),
+            usage=usage
         )
         return response['probe']
 
-    def transition_topic(self, history:list) -> tuple[str, str]:
+    @bounded
+    def transition_topic(self, template:InterviewTemplate, context:InterviewContext, deadline:Deadline=None, usage:TurnUsage=None) -> str:
         """ 
         Determine next interview question transition from one topic
-        cluster to the next. If have defined `summarize` model in parameters
-        will also get summarization of interview thus far.
+        cluster to the next. The summary of the finished topic is
+        not generated here, but afterwards (see `summarize`).
         """
-        summarize = self.parameters.get('summarize')
-        tasks = ['summary','transition'] if summarize else ['transition']
+        response = execute_queries(
+            self.client_for(deadline).chat.completions.create,
+            self.construct_query(template, ['transition'], context),
+            hedges=template.hedges(['transition']),
+            usage=usage
+        )
+        return response['transition']
+
+    def summarize(self, template:InterviewTemplate, context:InterviewContext) -> str:
+        """ Return summary of the current topic, i.e. of its messages only. """
         response = execute_queries(
             self.client.chat.completions.create,
-            self.construct_query(tasks, history)
+            self.construct_query(template, ['summary'], context),
+            hedges=template.hedges(['summary'])
         )
-        return response['transition'], response.get('summary', '')
+        return response['summary']
+
+    def stream_completion(self, template:InterviewTemplate, task:str, context:InterviewContext, deadline:Deadline=None, usage:TurnUsage=None):
+        """ 
+        Yield text of task's completion as it is generated (streamed),
+        finally returning the full (cleaned) completion text.
+        """
+        query = self.construct_query(template, [task], context)[task]
+        text = ""
+        start = time.monotonic()
+        try:
+            if usage is not None: usage.request(task, query['model'])
+            chunk = None
+            # Usage is sent with the last chunk (without choices)
+            for chunk in self.client_for(deadline).chat.completions.create(**query, stream=True, stream_options={"include_usage": True}):
+                if chunk.choices and chunk.choices[0].delta.content:
+                    text += chunk.choices[0].delta.content
+                    yield chunk.choices[0].delta.content
+        except APITimeoutError as e:
+            raise DeadlineExceeded(f"OpenAI request timed out streaming '{task}'") from e
+        if usage is not None:
+            usage.record(task, chunk, time.monotonic() - start)
+        logging.info(f"OpenAI streamed {task}: '{text}'")
+        return clean_completion(text)
+
+    def stream_probe_within_topic(self, template:InterviewTemplate, context:InterviewContext, deadline:Deadline=None, usage:TurnUsage=None):
+        """ Stream next 'within-topic' probing question, see `stream_completion`. """
+        return (yield from self.stream_completion(template, 'probe', context, deadline, usage))
+
+    def stream_transition_topic(self, template:InterviewTemplate, context:InterviewContext, deadline:Deadline=None, usage:TurnUsage=None):
+        """ Stream next interview question transitioning to the next topic cluster, see `stream_completion`. """
+        return (yield from self.stream_completion(template, 'transition', context, deadline, usage))
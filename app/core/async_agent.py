@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import time
+from core.agent import LLMAgent
+from core.auxiliary import execute_queries_async
+from core.context import InterviewContext
+from core.templates import InterviewTemplate
+from core.batcher import AsyncMicroBatcher
+from core.deadline import AsyncBoundedClient, Deadline, DeadlineExceeded, bounded
+from core.usage import TurnUsage
+from core.audio import audio_upload, digest, PROMPT_LENGTH
+from core.result_cache import ResultCache, is_deterministic
+from core.cassette import Cassette, CassetteClient
+from openai import AsyncOpenAI, APITimeoutError
+
+
+class AsyncLLMAgent(LLMAgent):
+    """
+    Class to manage LLM-based agents with asynchronous requests, such that
+    a single process can await many OpenAI requests concurrently.
+    Prompts are constructed exactly as by `LLMAgent`.
+    """
+    bounded_client = AsyncBoundedClient
+
+    def __init__(self, api_key, timeout:int=30, max_retries:int=3, moderation_window:float=0, cassette:Cassette=None, result_cache:ResultCache=None):
+        self.max_retries = max_retries
+        self.client = AsyncOpenAI(api_key=api_key, timeout=timeout, max_retries=max_retries)
+        if cassette is not None:
+            # Optional: Record requests to or replay them from a cassette
+            self.client = CassetteClient(self.client, cassette)
+        # Optional: Serve results of repeated deterministic requests (e.g. retries) from cache
+        self.result_cache = result_cache
+        logging.info("Async OpenAI client instantiated. Should happen only once!")
+        self.moderation_batcher = AsyncMicroBatcher(self.moderate_batch, moderation_window) if moderation_window else None
+
+    async def transcribe(self, audio, filename:str=None, prompt:str=None) -> str:
+        """
+        Transcribe audio file: base64-encoded (str) or binary (bytes or file), see `core.audio.audio_upload`.
+        A segment of a longer recording is given the transcription of the preceding segment as `prompt`.
+        """
+        # Optional: Continue the transcription of the preceding segment (the model reads its end only)
+        options = {'prompt': prompt[-PROMPT_LENGTH:]} if prompt else {}
+        audio_file = audio_upload(audio, filename)
+        key = self.cache_key('transcription', "whisper-1", audio_file[0], digest(audio_file[1]), options)
+        transcription = await self.result_cache.get_async(key) if key else None
+        if transcription is not None:
+            return transcription
+        response = await self.client.audio.transcriptions.create(
+          model="whisper-1",
+          file=audio_file,
+          language="en", # English language input
+          **options
+        )
+        if key: await self.result_cache.put_async(key, response.text)
+        return response.text
+
+    @bounded
+    async def review_answer(self, template:InterviewTemplate, message:str, context:InterviewContext, prefilter:bool=True, deadline:Deadline=None, usage:TurnUsage=None) -> bool:
+        """ Moderate answers: Are they on topic? Obvious cases are decided by the (optional) local prefilter. """
+        if prefilter and template.prefilter:
+            on_topic = template.prefilter.review(context.state['content'], template.current_topic(context), message)
+            if on_topic is not None:
+                logging.info(f"Prefilter decided answer is on topic: {on_topic}")
+                return on_topic
+        query = self.construct_query(template, ['moderator'], context, message)
+        key = self.cache_key('moderator', query['moderator']) if is_deterministic(query['moderator']) else None
+        verdict = await self.result_cache.get_async(key) if key else None
+        if verdict is None:
+            response = await execute_queries_async(
+                self.client_for(deadline).chat.completions.create,
+                query,
+                hedges=template.hedges(['moderator']),
+                usage=usage
+            )
+            verdict = response["moderator"]
+            if key: await self.result_cache.put_async(key, verdict)
+        return "yes" in verdict.lower()
+
+    async def moderate(self, inputs:list, deadline:Deadline=None) -> list:
+        """ Return whether each input is flagged by the moderation endpoint (in one request, for inputs not cached). """
+        keys = [self.cache_key('moderation', "omni-moderation-latest", text) for text in inputs]
+        flagged = [(await self.result_cache.get_async(key) if key else None) for key in keys]
+        missing = [i for i, result in enumerate(flagged) if result is None]
+        if missing:
+            response = await self.client_for(deadline).moderations.create(
+                model="omni-moderation-latest",
+                input=[inputs[i] for i in missing],
+            )
+            for i, result in zip(missing, response.to_dict()["results"]):
+                flagged[i] = result["flagged"]
+                if keys[i]: await self.result_cache.put_async(keys[i], flagged[i])
+        return flagged
+
+    @bounded
+    async def review_question(self, next_question:str, deadline:Deadline=None, usage:TurnUsage=None) -> bool:
+        """ Moderate questions: Are they flagged by the moderation endpoint? """
+        start = time.monotonic()
+        try:
+            if self.moderation_batcher:
+                try:
+                    return await self.moderation_batcher.submit(next_question, deadline.timeout() if deadline else None)
+                except TimeoutError as e:
+                    raise DeadlineExceeded("Moderation batch not processed within request budget") from e
+                except asyncio.CancelledError as e:
+                    if asyncio.current_task().cancelling(): # the request itself is cancelled
+                        raise
+                    raise DeadlineExceeded("Moderation batch cancelled") from e
+            return (await self.moderate([next_question], deadline))[0]
+        finally:
+            if usage is not None:
+                usage.record_moderation(time.monotonic() - start)
+
+    @bounded
+    async def probe_within_topic(self, template:InterviewTemplate, context:InterviewContext, deadline:Deadline=None, usage:TurnUsage=None) -> str:
+        """ Return next 'within-topic' probing question. """
+        response = await execute_queries_async(
+            self.client_for(deadline).chat.completions.create,
+            self.construct_query(template, ['probe'], context),
+            hedges=template.hedges(['probe']),
+            usage=usage
+        )
+        return response['probe']
+
+    @bounded
+    async def transition_topic(self, template:InterviewTemplate, context:InterviewContext, deadline:Deadline=None, usage:TurnUsage=None) -> str:
+        """
+        Determine next interview question transition from one topic
+        cluster to the next (the summary is generated afterwards, see `summarize`).
+        """
+        response = await execute_queries_async(
+            self.client_for(deadline).chat.completions.create,
+            self.construct_query(template, ['transition'], context),
+            hedges=template.hedges(['transition']),
+            usage=usage
+        )
+        return response['transition']
+
+    async def summarize(self, template:InterviewTemplate, context:InterviewContext) -> str:
+        """ Return summary of the current topic, i.e. of its messages only. """
+        response = await execute_queries_async(
+            self.client.chat.completions.create,
+            self.construct_query(template, ['summary'], context),
+            hedges=template.hedges(['summary'])
+        )
+        return response['summary']
+
+    async def stream_completion(self, template:InterviewTemplate, task:str, context:InterviewContext, deadline:Deadline=None, usage:TurnUsage=None):
+        """ Yield text of task's completion as it is generated (streamed). """
+        query = self.construct_query(template, [task], context)[task]
+        start = time.monotonic()
+        try:
+            if usage is not None: usage.request(task, query['model'])
+            chunk = None
+            # Usage is sent with the last chunk (without choices)
+            async for chunk in await self.client_for(deadline).chat.completions.create(**query, stream=True, stream_options={"include_usage": True}):
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except APITimeoutError as e:
+            raise DeadlineExceeded(f"OpenAI request timed out streaming '{task}'") from e
+        if usage is not None:
+            usage.record(task, chunk, time.monotonic() - start)
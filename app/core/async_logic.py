@@ -0,0 +1,272 @@
+"""
+Asynchronous counterpart of `core.logic` used by the ASGI app (`asgi.py`).
+The interview workflow is identical (its decisions are shared, see `core.workflow`), but OpenAI
+requests and database operations are awaited rather than blocking the (single) server process.
+"""
+import asyncio
+import os
+import logging
+from parameters import INTERVIEW_PARAMETERS, OPENAI_API_KEY
+from core.context import InterviewContext
+from core.templates import InterviewTemplate
+from core.manager import AsyncInterviewManager
+from core.async_agent import AsyncLLMAgent
+from core.auxiliary import clean_completion
+from core.deadline import Deadline, DeadlineExceeded
+from core.usage import TurnUsage, aggregate_usage
+from core.cassette import cassette_from_environment
+from core.result_cache import result_cache_from_environment
+from core import setup, workflow
+from database.async_adapter import AsyncDatabase
+from database.pagination import PAGE_SIZE
+from database.errors import SessionConflictError
+
+# Optional: Moderate questions of concurrent sessions in batches, waiting at most `MODERATION_BATCH_WINDOW` seconds,
+# record OpenAI requests to or replay them from the cassette `LLM_CASSETTE` (see `core.cassette`),
+# and cache results of deterministic requests, e.g. retried transcriptions (see `core.result_cache`)
+agent = AsyncLLMAgent(
+    OPENAI_API_KEY,
+    moderation_window=float(os.getenv("MODERATION_BATCH_WINDOW", 0)),
+    cassette=cassette_from_environment(),
+    result_cache=result_cache_from_environment()
+)
+db = AsyncDatabase(setup.connect_to_database())
+templates = setup.interview_templates() # fails for invalid parameters
+background = set() # tasks of summaries generated after responding, referenced until done
+
+async def load_interview_session(session_id:str) -> dict:
+    """ Return interview session history to user. """
+    return await db.load_remote_session(session_id)
+
+async def delete_interview_session(session_id:str):
+    """ Delete existing interview saved to database. """
+    await db.delete_remote_session(session_id)
+
+async def resume_interview_session(session_id:str, interview_id:str, user_message:str) -> AsyncInterviewManager:
+    """ Return AsyncInterviewManager object of existing session. """
+    interview = AsyncInterviewManager(db, session_id)
+    await interview.resume_session(INTERVIEW_PARAMETERS[interview_id])
+    logging.info("Generating next question for session '{}', user message '{}'".format(
+        session_id,
+        user_message
+    ))
+    return interview
+
+async def begin_interview_session(session_id:str, interview_id:str) -> dict:
+    """ Return response with starting question of new interview session. """
+    if not INTERVIEW_PARAMETERS.get(interview_id):
+        raise ValueError(f"Invalid interview parameters '{interview_id}' specified!")
+    parameters = INTERVIEW_PARAMETERS[interview_id]
+    interview = AsyncInterviewManager(db, session_id)
+    interview.begin_session(parameters, interview_id)
+    message = parameters['first_question']
+    await interview.add_chat_to_session(message, type='question')
+    logging.info("Beginning {} interview session '{}' with prompt '{}'".format(
+        interview_id,
+        session_id,
+        message
+    ))
+    return {'session_id':session_id, 'interview_id':interview_id, 'message':message}
+
+async def retrieve_sessions(sessions:list=None) -> dict:
+    """ Return specified or all existing interview sessions. """
+    return await db.retrieve_sessions(sessions)
+
+async def retrieve_sessions_page(sessions:list=None, page_size:int=PAGE_SIZE, cursor:str=None) -> dict:
+    """ Return one page of specified or all existing interview sessions and the cursor to the next page. """
+    messages, cursor = await db.retrieve_sessions_page(sessions, int(page_size or PAGE_SIZE), cursor)
+    logging.info(f"Retrieved page of {len(messages)} messages, next cursor '{cursor}'")
+    return {'messages':messages, 'cursor':cursor}
+
+async def stream_sessions(sessions:list=None, page_size:int=PAGE_SIZE, cursor:str=None):
+    """ Yield messages of specified or all existing interview sessions, one page at a time. """
+    while True:
+        messages, cursor = await db.retrieve_sessions_page(sessions, int(page_size or PAGE_SIZE), cursor)
+        for message in messages:
+            yield message
+        if not cursor: break
+
+async def usage_report(sessions:list=None) -> dict:
+    """ Return token usage and latencies of specified or all existing interview sessions per interview, see `core.usage`. """
+    return aggregate_usage([message async for message in stream_sessions(sessions)])
+
+async def transcribe(audio, filename:str=None, prompt:str=None) -> dict:
+    """
+    Return audio file transcription using OpenAI Whisper API, of base64-encoded (str) or binary audio (bytes or file).
+    Recordings may be transcribed in segments while they are recorded, each given the transcription
+    of the preceding segment (`prompt`), and their transcriptions joined by the client.
+    """
+    transcription = await agent.transcribe(audio, filename, prompt)
+    logging.info(f"Returning transcription text: '{transcription}'")
+    return {'transcription':transcription}
+
+async def generate_question(step:str, template:InterviewTemplate, context:InterviewContext, deadline:Deadline=None, usage:TurnUsage=None) -> str:
+    """ Return LLM-generated next question for workflow step. """
+    if step == 'transition':
+        # Transition to *next* topic...
+        return await agent.transition_topic(template, context, deadline=deadline, usage=usage)
+    # Proceed *within* topic...
+    return await agent.probe_within_topic(template, context, deadline=deadline, usage=usage)
+
+async def stream_question(step:str, template:InterviewTemplate, context:InterviewContext, deadline:Deadline=None, usage:TurnUsage=None):
+    """
+    Yield ('token', text) events of the streamed next question,
+    finally yielding ('question', question).
+    """
+    question = ""
+    async for token in agent.stream_completion(template, step, context, deadline=deadline, usage=usage):
+        question += token
+        yield 'token', token
+    yield 'question', clean_completion(question)
+
+async def summarize_session(session_id:str, interview_id:str, order:int):
+    """ Generate and store summary of the topic finished before the transition question at `order`, see `core.logic.summarize_session`. """
+    interview = AsyncInterviewManager(db, session_id)
+    await interview.resume_session(INTERVIEW_PARAMETERS[interview_id])
+    target = workflow.summary_context(interview, order)
+    if target:
+        topic_idx, context = target
+        await interview.store_summary(topic_idx, await agent.summarize(templates[interview_id], context))
+        logging.info(f"Stored summary of topic {topic_idx} of session '{session_id}'")
+
+def schedule_summary(session_id:str, interview_id:str, order:int):
+    """ Summarize the interview in a background task of the event loop, after responding. """
+    task = asyncio.create_task(summarize_session(session_id, interview_id, order))
+    background.add(task)
+    task.add_done_callback(background.discard)
+    task.add_done_callback(
+        lambda task: task.cancelled() or not task.exception() or logging.error(f"Summary of session '{session_id}' failed: {task.exception()!r}")
+    )
+
+async def process_message(session_id:str, interview_id:str, user_message:str=None, stream:bool=False, deadline:Deadline=None):
+    """
+    Process user message and generate response by the AI-interviewer, see `core.logic.process_message`.
+    Processed once more if the session has been changed elsewhere since it was loaded,
+    and within the time budget of the request (with the same fallbacks). Summaries
+    are generated in a background task of the event loop.
+
+    Args:
+        session_id: (str) unique interview session ID
+        user_message: (str) interviewee response
+        interview_id: (str) containing interview guidelines index
+        stream: (bool) whether to stream next question
+        deadline: (Deadline) time budget of the request (default: `REQUEST_BUDGET` seconds from now)
+    Yields:
+        event: (tuple) of event type and data, i.e. text of 'token' or response of 'message'
+    """
+    deadline = deadline or Deadline()
+    usage = TurnUsage()
+    streamed = False
+    try:
+        async for event in respond_to_message(session_id, interview_id, user_message, stream, deadline, usage):
+            streamed = True
+            yield event
+    except SessionConflictError:
+        if streamed: raise
+        logging.warning(f"Session '{session_id}' changed since loaded, processing message again...")
+        async for event in respond_to_message(session_id, interview_id, user_message, stream, deadline, usage):
+            yield event
+
+async def respond_to_message(session_id:str, interview_id:str, user_message:str=None, stream:bool=False, deadline:Deadline=None, usage:TurnUsage=None):
+    """ Process user message and generate response by the AI-interviewer, see `core.logic.respond_to_message`. """
+    usage = usage or TurnUsage()
+
+    # Resume if interview has started, otherwise begin (new) session
+    try:
+        interview = await resume_interview_session(session_id, interview_id, user_message)
+        template = templates[interview_id]
+    except AssertionError:
+        yield 'message', await begin_interview_session(session_id, interview_id)
+        return
+
+    # Exit condition: this interview has been previously ended
+    if interview.is_terminated():
+        yield 'message', workflow.response(interview, interview.parameters['termination_message'])
+        return
+
+    step = workflow.next_step(interview)
+    stream = workflow.streams_question(interview, stream)
+    speculation = None
+    speculative_usage = TurnUsage() # recorded with the turn only if the question is used
+
+    # Optional: Moderate interviewee responses, generating the next question meanwhile if speculative
+    if workflow.moderates_answers(interview):
+        context = workflow.speculative_context(interview, step, user_message)
+        if context:
+            speculation = asyncio.create_task(generate_question(step, template, context, deadline, speculative_usage))
+
+        try:
+            on_topic = await agent.review_answer(template, user_message, interview.context, deadline=deadline, usage=usage)
+        except DeadlineExceeded as e:
+            on_topic = workflow.unmoderated_answer(interview, e)
+
+        rejection = workflow.rejection(interview, user_message, on_topic)
+        if rejection:
+            if speculation:
+                speculation.cancel()
+            interview.record_usage(usage.to_state())
+            await interview.update_session()
+            yield 'message', rejection
+            return
+
+    # Update interview with new user message (after security checks)
+    await interview.add_chat_to_session(user_message, type="answer")
+
+    if step == 'close':
+        next_question = workflow.closing_question(interview)
+        if not next_question:
+            interview.record_usage(usage.to_state())
+            await interview.update_session()
+            yield 'message', workflow.response(interview, interview.parameters['end_of_interview_message'])
+            return
+
+    else:
+        try:
+            if speculation:
+                try:
+                    next_question = await speculation
+                finally:
+                    usage.add(speculative_usage)
+            elif stream:
+                async for event, data in stream_question(step, template, interview.context, deadline, usage):
+                    if event == 'token':
+                        yield event, data
+                next_question = data
+            else:
+                next_question = await generate_question(step, template, interview.context, deadline, usage)
+        except DeadlineExceeded as e:
+            next_question, step = workflow.fallback(interview, template, e, "question not generated")
+
+    # Optional: Check if next question is flagged by OpenAI's moderation endpoint (before storing it)
+    flagged_question = False
+    if workflow.moderates_questions(interview):
+        try:
+            flagged_question = await agent.review_question(next_question, deadline=deadline, usage=usage)
+        except DeadlineExceeded as e:
+            next_question, step = workflow.unmoderated_question(interview, template, step, next_question, e)
+    workflow.advance(interview, step, flagged_question)
+
+    # Update interview with new output, and the accounting of the turn
+    logging.info(f"Interviewer responded: '{next_question}'")
+    interview.record_usage(usage.to_state())
+    await interview.add_chat_to_session(next_question, type="question")
+    if flagged_question:
+        yield 'message', workflow.response(interview, interview.parameters['end_of_interview_message'])
+        return
+
+    # Optional: Summarize interview until the new topic, off the critical path
+    if workflow.summarizes(interview, step):
+        schedule_summary(session_id, interview_id, interview.current_state['order'])
+
+    yield 'message', workflow.response(interview, next_question)
+
+async def next_question(session_id:str, interview_id:str, user_message:str=None, deadline:Deadline=None) -> dict:
+    """ Process user message and return response by the AI-interviewer. """
+    async for _, response in process_message(session_id, interview_id, user_message, deadline=deadline):
+        pass
+    return response
+
+async def next_question_stream(session_id:str, interview_id:str, user_message:str=None, deadline:Deadline=None):
+    """ Process user message and stream response by the AI-interviewer. """
+    async for event in process_message(session_id, interview_id, user_message, stream=True, deadline=deadline):
+        yield event
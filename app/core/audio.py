@@ -0,0 +1,63 @@
+from base64 import b64decode
+from hashlib import sha256
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+# Bytes of a recording held in memory, beyond which it is spooled to a temporary file
+SPOOL_SIZE = 1024 * 1024
+
+# Bytes read (or base64 characters decoded) at a time, a multiple of 4
+CHUNK_SIZE = 64 * 1024
+
+# Name of uploaded recordings, whose extension tells the transcription model their format
+AUDIO_FILENAME = "audio.webm"
+
+# Characters of the preceding segment's transcription given as prompt, see `LLMAgent.transcribe`
+PROMPT_LENGTH = 800
+
+
+def spool(chunks) -> SpooledTemporaryFile:
+    """ Return file of recording received in chunks (bytes), e.g. of a request body, rewound. """
+    audio_file = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    for chunk in chunks:
+        audio_file.write(chunk)
+    audio_file.seek(0)
+    return audio_file
+
+async def spool_async(chunks) -> SpooledTemporaryFile:
+    """ Return file of recording received in asynchronous chunks, see `spool`. """
+    audio_file = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    async for chunk in chunks:
+        audio_file.write(chunk)
+    audio_file.seek(0)
+    return audio_file
+
+def read_chunks(stream):
+    """ Yield chunks of stream, e.g. the body of a request, until its end. """
+    return iter(lambda: stream.read(CHUNK_SIZE), b"")
+
+def digest(audio_file) -> str:
+    """ Return hash of the content of a recording's file, read chunk by chunk and rewound. """
+    content_hash = sha256()
+    for chunk in read_chunks(audio_file):
+        content_hash.update(chunk)
+    audio_file.seek(0)
+    return content_hash.hexdigest()
+
+def decode_base64(audio:str) -> SpooledTemporaryFile:
+    """ Return file of base64-encoded recording, decoded chunk by chunk rather than at once. """
+    return spool(b64decode(audio[i:i + CHUNK_SIZE]) for i in range(0, len(audio), CHUNK_SIZE))
+
+def audio_upload(audio, filename:str=None) -> tuple:
+    """
+    Return file of recording for the transcription client: (name, file). The recording is
+    either base64-encoded (`str`, the JSON requests of the Qualtrics survey) or binary
+    (`bytes` or a file, e.g. of a raw `audio/webm` or multipart request body).
+    """
+    if isinstance(audio, str):
+        audio = decode_base64(audio)
+    elif isinstance(audio, bytes):
+        audio = BytesIO(audio)
+    if not filename or "." not in filename: # e.g. 'blob' of browsers' form data
+        filename = AUDIO_FILENAME
+    return (filename, audio)
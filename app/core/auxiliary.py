@@ -1,63 +1,104 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import re
+import asyncio
 import time
 import logging 
 
+# Shared across requests rather than instantiated per query
+executor = ThreadPoolExecutor(max_workers=16)
+
+def message_to_string(message:dict) -> str:
+    """ Convert message into its line of the transcript (None if neither question nor answer). """
+    if message["type"] == "question":
+        return f'Interviewer: "{message['content']}"'
+    if message["type"] == "answer":
+        return f'Interviewee: "{message['content']}"'
+
 def chat_to_string(chat:list, only_topic:int=None, until_topic:int=None) -> str:
     """ Convert messages from chat into one string. """
-    topic_history = ""
+    topic_history = []
     for message in chat:
         # If desire specific topic's chat history:
         if only_topic and message['topic_idx'] != only_topic: 
             continue
         if until_topic and message['topic_idx'] == until_topic:
             break
-        if message["type"] == "question":
-            topic_history += f'Interviewer: "{message['content']}"\n'
-        if message["type"] == "answer":
-            topic_history += f'Interviewee: "{message['content']}"\n'
-    return topic_history.strip()
+        line = message_to_string(message)
+        if line: topic_history.append(line)
+    return "\n".join(topic_history).strip()
+
+def clean_completion(text:str) -> str:
+    """ Strip surrounding whitespace and quotes of completion text. """
+    return text.strip("\n\" '''")
 
-def fill_prompt_with_interview(template:str, topics:list, history:list, user_message:str=None) -> str:
-    """ Fill the prompt template with parameters from current interview. """
-    state = history[-1]
-    current_topic_idx = min(int(state['topic_idx']), len(topics))
-    next_topic_idx = min(current_topic_idx + 1, len(topics))
-    current_topic_chat = chat_to_string(history, only_topic=current_topic_idx)
-    prompt = template.format(
-        topics='\n'.join([topic['topic'] for topic in topics]),
-        question=state["content"],
-        answer=user_message,
-        summary=state['summary'] or chat_to_string(history, until_topic=current_topic_idx),
-        current_topic=topics[current_topic_idx - 1]["topic"],
-        next_interview_topic=topics[next_topic_idx - 1]["topic"],
-        current_topic_history=current_topic_chat
-    )
-    logging.debug(f"Prompt to GPT:\n{prompt}")
-    assert not re.findall(r"\{[^{}]+\}", prompt)
-    return prompt 
+def counted(query, task:str, usage):
+    """ Return query counting its requests in the turn's usage (see `core.usage.TurnUsage`). """
+    if usage is None:
+        return query
+    def wrapper(*args, **kwargs):
+        usage.request(task, kwargs.get('model'))
+        return query(*args, **kwargs)
+    return wrapper
 
-def execute_queries(query, task_args:dict) -> dict:
+def execute_queries(query, task_args:dict, hedges:dict=None, usage=None) -> dict:
     """ 
     Execute queries (concurrently if multiple).
 
     Args:
         query: function to execute
         task_args: (dict) of arguments for each task's query
+        hedges: (dict) `core.hedging.Hedge` of tasks whose slow queries are hedged
+        usage: (TurnUsage) accounting of the turn, recording each task's response
     Returns:
         suggestions (dict): {task: output} 
     """
     st = time.time()
+    hedges = hedges or {}
     suggestions = {}
-    with ThreadPoolExecutor(max_workers=len(task_args)) as executor:
-        futures = {
-            executor.submit(query, **kwargs): task 
-                for task, kwargs in task_args.items()
-        }
-        for future in as_completed(futures):
-            task = futures[future]
-            resp = future.result().choices[0].message.content.strip("\n\" '''")
-            suggestions[task] = resp
+    futures = {}
+    for task, kwargs in task_args.items():
+        task_query = counted(query, task, usage)
+        if task in hedges:
+            futures[executor.submit(hedges[task].call, task_query, kwargs)] = task
+        else:
+            futures[executor.submit(task_query, **kwargs)] = task
+    for future in as_completed(futures):
+        task = futures[future]
+        response = future.result()
+        if usage is not None:
+            usage.record(task, response, time.time() - st)
+        suggestions[task] = clean_completion(response.choices[0].message.content)
+
+    logging.info("OpenAI query took {:.2f} seconds".format(time.time() - st))
+    logging.info(f"OpenAI query returned: {suggestions}")
+    return suggestions
+
+async def execute_queries_async(query, task_args:dict, hedges:dict=None, usage=None) -> dict:
+    """ 
+    Execute asynchronous queries (concurrently if multiple).
+
+    Args:
+        query: coroutine function to execute
+        task_args: (dict) of arguments for each task's query
+        hedges: (dict) `core.hedging.Hedge` of tasks whose slow queries are hedged
+        usage: (TurnUsage) accounting of the turn, recording each task's response
+    Returns:
+        suggestions (dict): {task: output} 
+    """
+    st = time.time()
+    hedges = hedges or {}
+
+    async def respond(task:str, kwargs:dict):
+        task_query = counted(query, task, usage)
+        response = await (hedges[task].call_async(task_query, kwargs) if task in hedges else task_query(**kwargs))
+        if usage is not None:
+            usage.record(task, response, time.time() - st)
+        return response
+
+    responses = await asyncio.gather(*[respond(task, kwargs) for task, kwargs in task_args.items()])
+    suggestions = {
+        task: clean_completion(resp.choices[0].message.content)
+            for task, resp in zip(task_args, responses)
+    }
 
     logging.info("OpenAI query took {:.2f} seconds".format(time.time() - st))
     logging.info(f"OpenAI query returned: {suggestions}")
@@ -0,0 +1,176 @@
+from concurrent.futures import Future
+from threading import Lock, Thread, Timer
+import asyncio
+import logging
+import time
+
+
+def check_results(batch:list, results:list) -> list:
+    """ Return results of batch, raising `ValueError` unless there is one per input. """
+    if len(results) != len(batch):
+        raise ValueError(f"Batch of {len(batch)} inputs returned {len(results)} results")
+    return results
+
+def expiry(timeout:float) -> float:
+    """ Return monotonic time at which a submitter waiting `timeout` seconds gives up (None if it waits unbounded). """
+    return None if timeout is None else time.monotonic() + timeout
+
+def batch_timeout(batch:list) -> float:
+    """ Return seconds left to process batch, i.e. until its last submitter gives up (None if one waits unbounded). """
+    expiries = [expires for _, _, expires in batch]
+    if None in expiries:
+        return None
+    return max(max(expiries) - time.monotonic(), 0)
+
+
+class MicroBatcher(object):
+    """
+    Coalesce inputs submitted by concurrent requests (threads) into batches for a
+    function which processes a list of inputs in one call, e.g. one request to
+    OpenAI's moderation endpoint. An input submitted while no batch is in flight is
+    sent right away, so a single session waits no longer than before. Otherwise
+    inputs are collected until `max_size` are pending or at most `window` seconds
+    have passed, and the batch's results are fanned back out to each submitter.
+    A batch is given as much time as its submitter waiting longest, rather than
+    running on after every submitter has given up.
+
+    Args:
+        process: function of list of inputs and seconds left to process them (None if
+            unbounded), returning list of results (in order)
+        window: (float) maximum seconds an input waits for others to join its batch
+        max_size: (int) maximum number of inputs per batch
+    """
+    def __init__(self, process, window:float, max_size:int=32):
+        self.process = process
+        self.window = window
+        self.max_size = max_size
+        self.pending = []       # (input, future, expiry) waiting for the next batch
+        self.in_flight = 0      # number of batches being processed
+        self.timer = None
+        self.lock = Lock()
+
+    def submit(self, item, timeout:float=None):
+        """
+        Return result of item, once its batch has been processed, raising `TimeoutError` if
+        not within `timeout` seconds (or `CancelledError` if the batch is interrupted). Batches
+        run in threads of their own, such that the submitter which starts one waits no longer than others.
+        """
+        future = Future()
+        with self.lock:
+            self.pending.append((item, future, expiry(timeout)))
+            if not self.in_flight or len(self.pending) >= self.max_size:
+                batch = self._take()
+            else:
+                batch = None
+                if len(self.pending) == 1:
+                    self.timer = Timer(self.window, self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+        if batch:
+            Thread(target=self._run, args=(batch,), daemon=True).start()
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel() # left out of the fan-out
+            raise
+
+    def flush(self):
+        """ Process pending inputs, if any. """
+        with self.lock:
+            batch = self._take()
+        if batch:
+            self._run(batch)
+
+    def _take(self) -> list:
+        """ Take pending inputs as batch in flight (lock held). """
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            self.in_flight += 1
+        return batch
+
+    def _run(self, batch:list):
+        try:
+            results = check_results(batch, self.process([item for item, _, _ in batch], batch_timeout(batch)))
+            logging.info(f"Processed batch of {len(batch)} inputs.")
+            for (_, future, _), result in zip(batch, results):
+                if not future.done(): future.set_result(result)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done(): future.set_exception(e)
+        finally:
+            # Never leave submitters waiting, e.g. if the batch was interrupted
+            for _, future, _ in batch:
+                if not future.done(): future.cancel()
+            with self.lock:
+                self.in_flight -= 1
+
+
+class AsyncMicroBatcher(object):
+    """
+    Variant of `MicroBatcher` for the asynchronous request path,
+    coalescing inputs submitted by concurrent tasks of the event loop.
+
+    Args:
+        process: coroutine function of list of inputs and seconds left to process them
+            (None if unbounded), returning list of results (in order)
+        window: (float) maximum seconds an input waits for others to join its batch
+        max_size: (int) maximum number of inputs per batch
+    """
+    def __init__(self, process, window:float, max_size:int=32):
+        self.process = process
+        self.window = window
+        self.max_size = max_size
+        self.pending = []
+        self.in_flight = 0
+        self.timer = None
+        self.tasks = set()      # batches being processed, referenced until done
+
+    async def submit(self, item, timeout:float=None):
+        """
+        Return result of item, once its batch has been processed, raising `TimeoutError` if
+        not within `timeout` seconds (or `asyncio.CancelledError` if the batch is cancelled).
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((item, future, expiry(timeout)))
+        if not self.in_flight or len(self.pending) >= self.max_size:
+            self._start(self._take())
+        elif len(self.pending) == 1:
+            self.timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+        return await asyncio.wait_for(future, timeout)
+
+    def flush(self):
+        """ Process pending inputs, if any. """
+        if self.pending:
+            self._start(self._take())
+
+    def _start(self, batch:list):
+        """ Process batch in a task of its own, such that no submitter being cancelled cancels it. """
+        task = asyncio.ensure_future(self._run(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def _take(self) -> list:
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        self.in_flight += 1
+        return batch
+
+    async def _run(self, batch:list):
+        try:
+            results = check_results(batch, await self.process([item for item, _, _ in batch], batch_timeout(batch)))
+            logging.info(f"Processed batch of {len(batch)} inputs.")
+            for (_, future, _), result in zip(batch, results):
+                if not future.done(): future.set_result(result)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done(): future.set_exception(e)
+        finally:
+            # Never leave submitters waiting, e.g. if the batch was cancelled
+            for _, future, _ in batch:
+                if not future.done(): future.cancel()
+            self.in_flight -= 1
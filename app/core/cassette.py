@@ -0,0 +1,180 @@
+from hashlib import sha256
+from openai import AsyncOpenAI
+from openai.types import ModerationCreateResponse
+from openai.types.audio import Transcription
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from threading import Lock
+from types import SimpleNamespace
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+
+
+class CassetteMiss(Exception):
+    """ Raised when replaying a request that has not been recorded. """
+
+
+class Cassette(object):
+    """
+    Recorded OpenAI requests and their responses, keyed by a hash of the request (e.g. the
+    query of `LLMAgent.construct_query`), stored as gzipped JSON lines. When recording, each
+    response is appended with its latency; when replaying, recorded responses are served
+    back after their original latency (or immediately, `latency='zero'`), such that the
+    interview workflow can be benchmarked deterministically and without live models.
+
+    Args:
+        path: (str) file of the cassette
+        mode: (str) 'record' or 'replay'
+        latency: (str) 'original' or 'zero' latency of replayed responses
+    """
+    def __init__(self, path:str, mode:str='replay', latency:str='original'):
+        if mode not in ['record', 'replay']:
+            raise ValueError(f"unknown cassette mode '{mode}'")
+        if latency not in ['original', 'zero']:
+            raise ValueError(f"unknown cassette latency '{latency}'")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.entries = {}
+        self.lock = Lock()
+        if os.path.exists(path):
+            with gzip.open(path, 'rt') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.entries[entry['key']] = entry
+        logging.info(f"Cassette '{path}' with {len(self.entries)} recorded requests, {mode} mode.")
+
+    def key(self, endpoint:str, kwargs:dict) -> str:
+        """ Return hash of request to endpoint, files being represented by the hash of their content. """
+        def encode(value):
+            if hasattr(value, 'read'):
+                content = value.read()
+                value.seek(0)
+                return sha256(content).hexdigest()
+            return str(value)
+        return sha256(json.dumps([endpoint, kwargs], sort_keys=True, default=encode).encode()).hexdigest()
+
+    def get(self, key:str) -> dict:
+        entry = self.entries.get(key)
+        if entry is None:
+            raise CassetteMiss(f"Request '{key}' not recorded in cassette '{self.path}'")
+        return entry
+
+    def put(self, key:str, response, latency:float, offsets:list=None):
+        """ Record response (or list of chunks of a streamed response), appending it to the file. """
+        entry = {'key': key, 'latency': round(latency, 4)}
+        if offsets is None:
+            entry['response'] = response.to_dict()
+        else:
+            entry['chunks'] = [chunk.to_dict() for chunk in response]
+            entry['offsets'] = [round(offset, 4) for offset in offsets]
+        with self.lock:
+            self.entries[key] = entry
+            with gzip.open(self.path, 'at') as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def delays(self, entry:dict) -> list:
+        """ Return seconds to wait before each chunk of a replayed stream (or the response). """
+        if self.latency == 'zero':
+            return [0] * len(entry.get('chunks', [None]))
+        offsets = entry.get('offsets', [entry['latency']])
+        return [later - earlier for earlier, later in zip([0] + offsets, offsets)]
+
+
+class CassetteClient(object):
+    """
+    Stand-in of an OpenAI client (also asynchronous), recording its requests and responses to
+    or replaying them from a `Cassette`: chat completions (also streamed), moderations and
+    transcriptions, i.e. the endpoints used by `LLMAgent`.
+
+    Args:
+        client: OpenAI (or AsyncOpenAI) client, which sends the requests being recorded
+        cassette: (Cassette) of requests
+    """
+    def __init__(self, client, cassette:Cassette):
+        self.client = client
+        self.cassette = cassette
+        self.asynchronous = isinstance(client, AsyncOpenAI)
+        request = self.request_async if self.asynchronous else self.request
+        self.chat = SimpleNamespace(completions=SimpleNamespace(
+            create=lambda **kwargs: request('chat.completions', client.chat.completions.create, ChatCompletion, kwargs)
+        ))
+        self.moderations = SimpleNamespace(
+            create=lambda **kwargs: request('moderations', client.moderations.create, ModerationCreateResponse, kwargs)
+        )
+        self.audio = SimpleNamespace(transcriptions=SimpleNamespace(
+            create=lambda **kwargs: request('audio.transcriptions', client.audio.transcriptions.create, Transcription, kwargs)
+        ))
+
+    def with_options(self, **options) -> 'CassetteClient':
+        return CassetteClient(self.client.with_options(**options), self.cassette)
+
+    def request(self, endpoint:str, create, response_type, kwargs:dict):
+        key = self.cassette.key(endpoint, kwargs)
+        if kwargs.get('stream'):
+            return self.stream(key, create, kwargs)
+        if self.cassette.mode == 'replay':
+            entry = self.cassette.get(key)
+            time.sleep(self.cassette.delays(entry)[0])
+            return response_type.construct(**entry['response'])
+        start = time.monotonic()
+        response = create(**kwargs)
+        self.cassette.put(key, response, time.monotonic() - start)
+        return response
+
+    def stream(self, key:str, create, kwargs:dict):
+        if self.cassette.mode == 'replay':
+            entry = self.cassette.get(key)
+            for chunk, delay in zip(entry['chunks'], self.cassette.delays(entry)):
+                time.sleep(delay)
+                yield ChatCompletionChunk.construct(**chunk)
+            return
+        start = time.monotonic()
+        chunks, offsets = [], []
+        for chunk in create(**kwargs):
+            chunks.append(chunk)
+            offsets.append(time.monotonic() - start)
+            yield chunk
+        self.cassette.put(key, chunks, time.monotonic() - start, offsets)
+
+    async def request_async(self, endpoint:str, create, response_type, kwargs:dict):
+        key = self.cassette.key(endpoint, kwargs)
+        if kwargs.get('stream'):
+            return self.stream_async(key, create, kwargs)
+        if self.cassette.mode == 'replay':
+            entry = self.cassette.get(key)
+            await asyncio.sleep(self.cassette.delays(entry)[0])
+            return response_type.construct(**entry['response'])
+        start = time.monotonic()
+        response = await create(**kwargs)
+        self.cassette.put(key, response, time.monotonic() - start)
+        return response
+
+    async def stream_async(self, key:str, create, kwargs:dict):
+        if self.cassette.mode == 'replay':
+            entry = self.cassette.get(key)
+            for chunk, delay in zip(entry['chunks'], self.cassette.delays(entry)):
+                await asyncio.sleep(delay)
+                yield ChatCompletionChunk.construct(**chunk)
+            return
+        start = time.monotonic()
+        chunks, offsets = [], []
+        async for chunk in await create(**kwargs):
+            chunks.append(chunk)
+            offsets.append(time.monotonic() - start)
+            yield chunk
+        self.cassette.put(key, chunks, time.monotonic() - start, offsets)
+
+
+def cassette_from_environment() -> Cassette:
+    """ Return cassette of `LLM_CASSETTE` (file), if set, see `Cassette`. """
+    if not os.getenv("LLM_CASSETTE"):
+        return None
+    return Cassette(
+        os.environ["LLM_CASSETTE"],
+        os.getenv("LLM_CASSETTE_MODE", "replay"),
+        os.getenv("LLM_CASSETTE_LATENCY", "original")
+    )
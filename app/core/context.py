@@ -0,0 +1,114 @@
+from core.auxiliary import message_to_string
+
+# In place of messages left out of a transcript to fit a prompt's token budget
+ELISION = "[...]"
+
+
+class InterviewContext(object):
+    """
+    Transcript of an interview session from which prompts are filled, split into
+    segments per topic. It is built once from the session history and then
+    extended message by message, so filling the prompts of several tasks does
+    not scan (and concatenate) the whole history again for each of them. Sessions
+    cached by the process keep their context (see `database.cache.CachedDatabase`),
+    such that resuming them extends it rather than building it anew.
+    Equivalent to `chat_to_string` of the history, i.e.:
+        topic_history(i) == chat_to_string(history, only_topic=i)
+        history_until(i) == chat_to_string(history, until_topic=i)
+    Transcripts can leave out the lines (messages) before line `since`, e.g.
+    to fit a token budget (see `core.templates.PromptTemplate`).
+
+    Args:
+        history: (list) of messages (states) of the interview session
+    """
+    def __init__(self, history:list=()):
+        self.state = {}             # last message, i.e. current state
+        self.lines = []             # transcript lines of all messages
+        self.segments = {}          # topic index: transcript lines of topic
+        self.topic_start = {}       # topic index: number of lines before topic
+        self.texts = {}             # joined transcripts, until changed
+        for message in history:
+            self.append(message)
+
+    def append(self, message:dict):
+        """ Add message as new current state. """
+        self.state = message
+        topic = int(message['topic_idx'])
+        self.topic_start.setdefault(topic, len(self.lines))
+        line = message_to_string(message)
+        if line:
+            self.lines.append(line)
+            self.segments.setdefault(topic, []).append(line)
+            self.texts.pop(('topic', topic), None)
+
+    def update_state(self, state:dict):
+        """ Replace current state, e.g. its flags or summaries (but not its content). """
+        self.state = state
+
+    def copy(self) -> 'InterviewContext':
+        """ Return copy of context, which can be extended without changing this context (nor scanning the history). """
+        context = InterviewContext()
+        context.state = self.state
+        context.lines = self.lines.copy()
+        context.segments = {topic: lines.copy() for topic, lines in self.segments.items()}
+        context.topic_start = self.topic_start.copy()
+        context.texts = self.texts.copy()
+        return context
+
+    def preview(self, message:dict) -> 'InterviewContext':
+        """ Return copy of context with message added, leaving this context unchanged. """
+        context = self.copy()
+        context.append(message)
+        return context
+
+    def elide(self, start:int, end:int, since:int) -> str:
+        """ Return transcript of lines from `since` until `end`, marking the elision of lines from `start`. """
+        return "\n".join([ELISION] + self.lines[max(since, start):end]).strip()
+
+    def topic_history(self, topic:int, since:int=0) -> str:
+        """ Return transcript of topic. """
+        start = self.topic_start.get(topic, len(self.lines))
+        if since > start:
+            return self.elide(start, start + len(self.segments.get(topic, [])), since)
+        key = ('topic', topic)
+        if key not in self.texts:
+            self.texts[key] = "\n".join(self.segments.get(topic, [])).strip()
+        return self.texts[key]
+
+    def history_until(self, topic:int) -> str:
+        """ Return transcript of all messages before the topic (or all, if topic not reached). """
+        if topic not in self.topic_start:
+            return "\n".join(self.lines).strip()
+        # Fixed once topic has been reached
+        key = ('until', topic)
+        if key not in self.texts:
+            self.texts[key] = "\n".join(self.lines[:self.topic_start[topic]]).strip()
+        return self.texts[key]
+
+    def history_between(self, first:int, topic:int, since:int=0) -> str:
+        """ Return transcript of the topics from `first` until (before) `topic`. """
+        end = self.topic_start.get(topic, len(self.lines))
+        start = self.topic_start.get(first, end)
+        if since > start:
+            return self.elide(start, end, since) if end > start else ""
+        key = ('between', first, topic)
+        if key not in self.texts or topic not in self.topic_start:
+            self.texts[key] = "\n".join(self.lines[start:end]).strip()
+        return self.texts[key]
+
+    def summary_until(self, topic:int, since:int=0) -> str:
+        """
+        Return summaries of the topics before `topic` (see `InterviewManager.store_summary`),
+        with the transcript of topics not (yet) summarized in their place.
+        """
+        summaries = self.state.get('summary') or []
+        if isinstance(summaries, str):
+            # Running summary of all prior topics, as stored by earlier versions
+            return summaries or (self.history_between(1, topic, since) if since else self.history_until(topic))
+        pieces, start = [], 1
+        for summarized, summary in enumerate(summaries[:topic - 1], start=1):
+            if summary:
+                pieces += [self.history_between(start, summarized, since), summary]
+                start = summarized + 1
+        pieces.append(self.history_between(start, topic, since))
+        return "\n\n".join(piece for piece in pieces if piece)
@@ -0,0 +1,128 @@
+from functools import reduce, wraps
+from inspect import iscoroutinefunction
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+import asyncio
+import logging
+import os
+import time
+
+# Default time budget (seconds) of a request, below the 29 seconds of AWS API Gateway
+REQUEST_BUDGET = float(os.getenv("REQUEST_BUDGET", 25))
+
+# Seconds of the budget kept for storing the interview after the last OpenAI request
+STORAGE_RESERVE = 3
+
+# Errors of OpenAI requests worth retrying (timeouts are not, as they used up the budget)
+RETRIABLE = (APIConnectionError, RateLimitError, InternalServerError)
+
+# Seconds before the first retry of a request within budget, doubled for each further retry
+RETRY_BACKOFF = 0.5
+
+
+class DeadlineExceeded(Exception):
+    """ Raised if a stage of the request cannot complete within the remaining budget. """
+
+
+class Deadline(object):
+    """
+    Time budget of a request, passed on to each stage (OpenAI requests) such that
+    it is given the remaining time, rather than stacking timeouts and retries.
+
+    Args:
+        seconds: (float) budget from now
+        reserve: (float) seconds of the budget not given to stages, e.g. for storage
+    """
+    def __init__(self, seconds:float=REQUEST_BUDGET, reserve:float=STORAGE_RESERVE):
+        self.expires = time.monotonic() + seconds - reserve
+
+    def remaining(self) -> float:
+        return max(self.expires - time.monotonic(), 0)
+
+    def timeout(self, minimum:float=1) -> float:
+        """ Return remaining seconds for next stage, raising `DeadlineExceeded` if less than `minimum`. """
+        remaining = self.remaining()
+        if remaining < minimum:
+            raise DeadlineExceeded(f"{remaining:.1f} seconds of request budget left")
+        return remaining
+
+
+class BoundedClient(object):
+    """
+    OpenAI client whose requests (e.g. `chat.completions.create`) are bounded by the remaining
+    budget of a deadline: each attempt is given the remaining seconds as timeout, and attempts
+    failing with errors worth retrying are retried after a backoff, up to `max_retries` times
+    and as long as the budget allows.
+
+    Args:
+        client: OpenAI client
+        deadline: (Deadline) of the request
+        max_retries: (int) maximum number of retries
+    """
+    def __init__(self, client, deadline:Deadline, max_retries:int, path:tuple=()):
+        self.client = client
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.path = path
+
+    def __getattr__(self, name:str):
+        return type(self)(self.client, self.deadline, self.max_retries, self.path + (name,))
+
+    def attempt(self):
+        """ Return the request's function, on a client timing out at the end of the budget. """
+        return reduce(getattr, self.path, self.client.with_options(timeout=self.deadline.timeout(), max_retries=0))
+
+    def retry_delay(self, error:Exception, retries:int) -> float:
+        """ Return seconds to wait before retrying the failed attempt, or None if it is not retried. """
+        if isinstance(error, APITimeoutError) or not isinstance(error, RETRIABLE) or retries >= self.max_retries:
+            return None
+        delay = RETRY_BACKOFF * 2 ** retries
+        if self.deadline.remaining() < delay + 1:
+            return None
+        logging.warning(f"Retrying '{'.'.join(self.path)}' in {delay:.1f} seconds: {error!r}")
+        return delay
+
+    def __call__(self, **kwargs):
+        retries = 0
+        while True:
+            try:
+                return self.attempt()(**kwargs)
+            except Exception as e:
+                delay = self.retry_delay(e, retries)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            retries += 1
+
+
+class AsyncBoundedClient(BoundedClient):
+    """ Asynchronous OpenAI client whose requests are bounded by the remaining budget, see `BoundedClient`. """
+    async def __call__(self, **kwargs):
+        retries = 0
+        while True:
+            try:
+                return await self.attempt()(**kwargs)
+            except Exception as e:
+                delay = self.retry_delay(e, retries)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            retries += 1
+
+
+def bounded(method):
+    """ Decorate agent method to raise `DeadlineExceeded` if its OpenAI request times out. """
+    if iscoroutinefunction(method):
+        @wraps(method)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await method(*args, **kwargs)
+            except APITimeoutError as e:
+                raise DeadlineExceeded(f"OpenAI request timed out in '{method.__name__}'") from e
+    else:
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            except APITimeoutError as e:
+                raise DeadlineExceeded(f"OpenAI request timed out in '{method.__name__}'") from e
+    return wrapper
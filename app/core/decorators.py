@@ -1,4 +1,6 @@
-from werkzeug.exceptions import default_exceptions
+from werkzeug.exceptions import BadRequest, default_exceptions
+from database.errors import InvalidCursorError
+from database.pagination import decode_cursor
 from functools import wraps
 from flask import make_response, jsonify, request
 import time
@@ -15,6 +17,13 @@ logging.basicConfig(
 	handlers=[logging.StreamHandler()]
 )
 
+# Headers allowing browsers to call streaming endpoints from other origins (e.g. a survey), as the Lambda function's responses do
+CORS_HEADERS = {
+	"Access-Control-Allow-Headers": "*",
+	"Access-Control-Allow-Origin": "*",
+	"Access-Control-Allow-Methods": "POST, OPTIONS"
+}
+
 def jsonable(obj):
 	try: 
 		return json.dumps(obj)
@@ -38,6 +47,13 @@ def wrap_flask_errors():
 		)} for error_code, error in default_exceptions.items()
 	}
 
+def check_cursor(cursor:str):
+	""" Raise `BadRequest` (HTTP 400) for an invalid continuation token, before retrieving (or streaming) any page. """
+	try:
+		decode_cursor(cursor)
+	except InvalidCursorError as e:
+		raise BadRequest(str(e)) from e
+
 def handle_500(f):
 	@wraps(f)
 	def decorated(*args, **kwargs):
@@ -60,3 +76,50 @@ def handle_500(f):
 			response = make_response(jsonify(meta), http_code)
 		return response
 	return decorated
+
+def handle_500_async(f):
+	""" Variant of `handle_500` for asynchronous (Quart) endpoints, see `asgi.py`. """
+	from quart import make_response, jsonify, request
+	@wraps(f)
+	async def decorated(*args, **kwargs):
+		start_time = time.time()
+		try:
+			response = await f(*args, **kwargs)
+		except Exception as e:
+			http_code = getattr(e, "http_code", None) or getattr(e, "code", 500)
+			message = str(e) or getattr(e, "message", "Service failed")
+			meta = {"type":type(e).__name__,"tb":tb.format_exc(),"str":message}
+			# Log application errors
+			logging.error(jsonable({
+				"payload":await request.get_json(force=True, silent=True) or {},
+				"url":request.url,
+				"duration":time.time() - start_time,
+				"response":meta,
+				"http_code":http_code,
+				"type":meta["type"]	
+			}))
+			response = await make_response(jsonify(meta), http_code)
+		return response
+	return decorated
+
+def server_sent_events(events):
+	""" Format (event, data) tuples as Server-Sent Events, reporting errors as 'error' event. """
+	try:
+		for event, data in events:
+			yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+	except Exception as e:
+		# Response has already started, so errors are sent as event
+		message = str(e) or getattr(e, "message", "Service failed")
+		logging.error(jsonable({"type":type(e).__name__, "tb":tb.format_exc(), "str":message}))
+		yield f"event: error\ndata: {json.dumps({'type':type(e).__name__, 'message':message})}\n\n"
+
+async def server_sent_events_async(events):
+	""" Format asynchronous (event, data) tuples as Server-Sent Events, see `server_sent_events`. """
+	try:
+		async for event, data in events:
+			yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+	except Exception as e:
+		# Response has already started, so errors are sent as event
+		message = str(e) or getattr(e, "message", "Service failed")
+		logging.error(jsonable({"type":type(e).__name__, "tb":tb.format_exc(), "str":message}))
+		yield f"event: error\ndata: {json.dumps({'type':type(e).__name__, 'message':message})}\n\n"
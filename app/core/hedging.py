@@ -0,0 +1,95 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock
+import asyncio
+import logging
+import time
+
+# Requests of hedged queries, apart from the executor of `execute_queries` waiting on them
+executor = ThreadPoolExecutor(max_workers=32)
+
+
+class Hedge(object):
+    """
+    Hedging of an agent's completions against the slow tail of its model: if a
+    completion has not returned after the `percentile` of the agent's recent latencies
+    (or after `delay` seconds, until `min_samples` have been observed), a second request
+    is sent, optionally to a faster fallback `model`, and whichever returns first is used.
+    The other is cancelled (synchronous requests already sent complete in the background
+    and are discarded).
+
+    Args:
+        percentile: (float) percentile of recent latencies after which to hedge
+        model: (str) model of the hedging request (default: same model)
+        delay: (float) seconds after which to hedge until enough latencies are observed
+        min_samples: (int) number of latencies needed to use their percentile
+        window: (int) number of recent latencies kept
+    """
+    def __init__(self, percentile:float=95, model:str=None, delay:float=2, min_samples:int=20, window:int=200):
+        if not 0 < float(percentile) < 100:
+            raise ValueError("hedging percentile must be between 0 and 100")
+        self.percentile = float(percentile)
+        self.model = model
+        self.delay = float(delay)
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.lock = Lock()
+
+    def record(self, seconds:float):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def after(self) -> float:
+        """ Return seconds after which to send the hedging request. """
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if len(latencies) < self.min_samples:
+            return self.delay
+        return latencies[min(int(len(latencies) * self.percentile / 100), len(latencies) - 1)]
+
+    def hedging_query(self, kwargs:dict) -> dict:
+        return {**kwargs, 'model':self.model} if self.model else kwargs
+
+    def call(self, query, kwargs:dict):
+        """ Return response of query (function), hedged if slow. """
+        start = time.monotonic()
+        primary = executor.submit(query, **kwargs)
+        primary.add_done_callback(
+            lambda future: future.cancelled() or future.exception() or self.record(time.monotonic() - start)
+        )
+        done, _ = wait([primary], timeout=self.after())
+        if done:
+            return primary.result()
+        logging.info(f"Hedging '{kwargs['model']}' completion after {time.monotonic() - start:.2f} seconds")
+        pending = {primary, executor.submit(query, **self.hedging_query(kwargs))}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if not future.exception():
+                    for loser in pending:
+                        loser.cancel()
+                    return future.result()
+        return primary.result() # both failed
+
+    async def call_async(self, query, kwargs:dict):
+        """ Return response of query (coroutine function), hedged if slow. """
+        start = time.monotonic()
+        primary = asyncio.ensure_future(query(**kwargs))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.after())
+            if not done:
+                logging.info(f"Hedging '{kwargs['model']}' completion after {time.monotonic() - start:.2f} seconds")
+                pending.add(asyncio.ensure_future(query(**self.hedging_query(kwargs))))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.exception():
+                        return task.result()
+            return primary.result() # both failed
+        finally:
+            # Latency of a request cancelled while pending is at least the time it took so far
+            if not primary.done() or (not primary.cancelled() and not primary.exception()):
+                self.record(time.monotonic() - start)
+            for task in pending:
+                task.cancel()
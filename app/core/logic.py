@@ -1,20 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+import json
 import logging
 import os
 from parameters import INTERVIEW_PARAMETERS, OPENAI_API_KEY
+from core.context import InterviewContext
+from core.templates import InterviewTemplate
 from core.manager import InterviewManager
 from core.agent import LLMAgent
+from core.deadline import Deadline, DeadlineExceeded
+from core.usage import TurnUsage, aggregate_usage
+from core.cassette import cassette_from_environment
+from core.result_cache import result_cache_from_environment
+from core import setup, workflow
+from database.pagination import PAGE_SIZE, iterate_pages
+from database.errors import SessionConflictError
 
-def connect_to_database():
-    """ Instantiate specific backend database. """
-    if os.getenv("DATABASE") == "DYNAMODB":
-        # For AWS, leverage Dynamo database
-        from database.dynamo import DynamoDB
-        return DynamoDB(os.environ['DYNAMO_TABLE'])
-    from database.file import FileWriter
-    return FileWriter()
-
-agent = LLMAgent(OPENAI_API_KEY)
-db = connect_to_database()
+# Optional: Moderate questions of concurrent sessions in batches, waiting at most `MODERATION_BATCH_WINDOW` seconds,
+# record OpenAI requests to or replay them from the cassette `LLM_CASSETTE` (see `core.cassette`),
+# and cache results of deterministic requests, e.g. retried transcriptions (see `core.result_cache`)
+agent = LLMAgent(
+    OPENAI_API_KEY,
+    moderation_window=float(os.getenv("MODERATION_BATCH_WINDOW", 0)),
+    cassette=cassette_from_environment(),
+    result_cache=result_cache_from_environment()
+)
+db = setup.connect_to_database()
+templates = setup.interview_templates() # fails for invalid parameters
+executor = ThreadPoolExecutor() # for speculative question generation
+background = ThreadPoolExecutor(max_workers=4) # for summaries generated after responding
 
 def load_interview_session(session_id:str) -> dict:
     """ Return interview session history to user. """
@@ -40,7 +54,7 @@ def begin_interview_session(session_id:str, interview_id:str) -> dict:
         raise ValueError(f"Invalid interview parameters '{interview_id}' specified!")
     parameters = INTERVIEW_PARAMETERS[interview_id]
     interview = InterviewManager(db, session_id)
-    interview.begin_session(parameters)
+    interview.begin_session(parameters, interview_id)
     message = parameters['first_question']
     interview.add_chat_to_session(message, type='question')
     logging.info("Beginning {} interview session '{}' with prompt '{}'".format(
@@ -54,54 +68,176 @@ def retrieve_sessions(sessions:list=None) -> dict:
     """ Return specified or all existing interview sessions. """
     return db.retrieve_sessions(sessions)
 
-def transcribe(audio:str) -> dict:
-    """ Return audio file transcription using OpenAI Whisper API """
+def retrieve_sessions_page(sessions:list=None, page_size:int=PAGE_SIZE, cursor:str=None) -> dict:
+    """ Return one page of specified or all existing interview sessions and the cursor to the next page. """
+    messages, cursor = db.retrieve_sessions_page(sessions, int(page_size or PAGE_SIZE), cursor)
+    logging.info(f"Retrieved page of {len(messages)} messages, next cursor '{cursor}'")
+    return {'messages':messages, 'cursor':cursor}
+
+def stream_sessions(sessions:list=None, page_size:int=PAGE_SIZE, cursor:str=None):
+    """ Yield messages of specified or all existing interview sessions, one page at a time. """
+    for page in iterate_pages(db.retrieve_sessions_page, sessions, int(page_size or PAGE_SIZE), cursor):
+        yield from page
+
+def usage_report(sessions:list=None) -> dict:
+    """ Return token usage and latencies of specified or all existing interview sessions per interview, see `core.usage`. """
+    return aggregate_usage(stream_sessions(sessions))
+
+def transcribe(audio, filename:str=None, prompt:str=None) -> dict:
+    """
+    Return audio file transcription using OpenAI Whisper API, of base64-encoded (str) or binary audio (bytes or file).
+    Recordings may be transcribed in segments while they are recorded, each given the transcription
+    of the preceding segment (`prompt`), and their transcriptions joined by the client.
+    """
     logging.critical(f"Audio is: {type(audio)}...")
-    transcription = agent.transcribe(audio)
+    transcription = agent.transcribe(audio, filename, prompt)
     logging.info(f"Returning transcription text: '{transcription}'")
     return {'transcription':transcription}
 
-def next_question(session_id:str, interview_id:str, user_message:str=None) -> dict:
+def generate_question(step:str, template:InterviewTemplate, context:InterviewContext, deadline:Deadline=None, usage:TurnUsage=None) -> str:
+    """ Return LLM-generated next question for workflow step. """
+    if step == 'transition':
+        # Transition to *next* topic...
+        return agent.transition_topic(template, context, deadline=deadline, usage=usage)
+    # Proceed *within* topic...
+    return agent.probe_within_topic(template, context, deadline=deadline, usage=usage)
+
+def stream_question(step:str, template:InterviewTemplate, context:InterviewContext, deadline:Deadline=None, usage:TurnUsage=None):
+    """ Yield ('token', text) events of the streamed next question, returning the question. """
+    if step == 'transition':
+        stream = agent.stream_transition_topic(template, context, deadline=deadline, usage=usage)
+    else:
+        stream = agent.stream_probe_within_topic(template, context, deadline=deadline, usage=usage)
+    while True:
+        try:
+            token = next(stream)
+        except StopIteration as stop:
+            return stop.value
+        yield 'token', token
+
+def summarize_session(session_id:str, interview_id:str, order:int):
+    """
+    Generate summary of the topic finished before the transition question at `order`
+    (i.e. of its messages only) and store it apart from the session's messages (see
+    `InterviewManager.store_summary`), such that it neither waits for nor conflicts
+    with the turn being processed meanwhile, if any.
+    """
+    interview = InterviewManager(db, session_id)
+    interview.resume_session(INTERVIEW_PARAMETERS[interview_id])
+    target = workflow.summary_context(interview, order)
+    if target:
+        topic_idx, context = target
+        interview.store_summary(topic_idx, agent.summarize(templates[interview_id], context))
+        logging.info(f"Stored summary of topic {topic_idx} of session '{session_id}'")
+
+@cache
+def lambda_client():
+    from boto3 import client
+    return client('lambda')
+
+def schedule_summary(session_id:str, interview_id:str, order:int):
+    """ 
+    Summarize the interview in the background, after responding (see `summarize_session`):
+    by an asynchronous invocation of the function on AWS Lambda, otherwise by a background thread.
+    """
+    if os.getenv("AWS_LAMBDA_FUNCTION_NAME"):
+        lambda_client().invoke(
+            FunctionName=os.environ["AWS_LAMBDA_FUNCTION_NAME"],
+            InvocationType='Event',
+            Payload=json.dumps({'summarize': {'session_id':session_id, 'interview_id':interview_id, 'order':order}})
+        )
+    else:
+        background.submit(summarize_session, session_id, interview_id, order).add_done_callback(
+            lambda future: future.exception() and logging.error(f"Summary of session '{session_id}' failed: {future.exception()!r}")
+        )
+
+def process_message(session_id:str, interview_id:str, user_message:str=None, stream:bool=False, deadline:Deadline=None):
     """
     Process user message and generate response by the AI-interviewer.
+    Yields ('token', text) events while the next question is generated if streaming
+    (unless questions are moderated, which needs the full question before it is sent),
+    and always finally a ('message', response) event. The interview session is
+    stored once the full next question has been generated.
+
+    If the session has been changed elsewhere since it was loaded (e.g. it was cached
+    by this process, but the last turn was served by another), the message is 
+    processed once more with the session freshly loaded, unless tokens were streamed.
+
+    Each OpenAI request is given the remaining time budget of the request. Once it
+    runs out, answers are accepted without moderation and the template's fallback
+    question is asked (staying on topic) instead of waiting for the next question,
+    or instead of a question that could not be moderated, such that the request
+    still completes. When transitioning to the next topic,
+    the summary of the interview is generated after responding (`schedule_summary`).
+    The tokens and latencies of the turn's OpenAI requests are stored with its
+    question (see `core.usage.TurnUsage`).
 
     Args:
         session_id: (str) unique interview session ID
         user_message: (str) interviewee response
         interview_id: (str) containing interview guidelines index
-    Returns:
-        response: (dict) containing `message` from interviewer
+        stream: (bool) whether to stream next question
+        deadline: (Deadline) time budget of the request (default: `REQUEST_BUDGET` seconds from now)
+    Yields:
+        event: (tuple) of event type and data, i.e. text of 'token' or response of 'message'
     """
+    deadline = deadline or Deadline()
+    usage = TurnUsage()
+    streamed = False
+    try:
+        for event in respond_to_message(session_id, interview_id, user_message, stream, deadline, usage):
+            streamed = True
+            yield event
+    except SessionConflictError:
+        if streamed: raise
+        logging.warning(f"Session '{session_id}' changed since loaded, processing message again...")
+        yield from respond_to_message(session_id, interview_id, user_message, stream, deadline, usage)
+
+def respond_to_message(session_id:str, interview_id:str, user_message:str=None, stream:bool=False, deadline:Deadline=None, usage:TurnUsage=None):
+    """ Process user message and generate response by the AI-interviewer, see `process_message` (and `core.workflow`). """
+    usage = usage or TurnUsage()
 
     # Resume if interview has started, otherwise begin (new) session
     try:
         interview = resume_interview_session(session_id, interview_id, user_message)
-        parameters = interview.parameters
+        template = templates[interview_id]
     except AssertionError:
-        return begin_interview_session(session_id, interview_id)
+        yield 'message', begin_interview_session(session_id, interview_id)
+        return
 
     # Exit condition: this interview has been previously ended
     if interview.is_terminated():
-        return {'session_id':session_id, 'message':parameters['termination_message']}
+        yield 'message', workflow.response(interview, interview.parameters['termination_message'])
+        return
 
-    # Provide interview guidelines to LLM agent
-    agent.load_parameters(parameters)
+    # Next step in workflow does not depend on the user message
+    step = workflow.next_step(interview)
+    stream = workflow.streams_question(interview, stream)
+    speculation = None
+    speculative_usage = TurnUsage() # recorded with the turn only if the question is used
 
     # Optional: Moderate interviewee responses, e.g. flagging off-topic or harmful messages
-    if parameters.get('moderate_answers') and parameters.get('moderator'):
-        on_topic = agent.review_answer(user_message, interview.get_history())
-        if not on_topic:
-            interview.flag_risk(user_message)
+    if workflow.moderates_answers(interview):
+        # Optional: Generate next question while the answer is being moderated
+        context = workflow.speculative_context(interview, step, user_message)
+        if context:
+            speculation = executor.submit(generate_question, step, template, context, deadline, speculative_usage)
 
-        # Terminate if the conversation has been flagged too often
-        if interview.flagged_too_often():
-            interview.update_session()
-            return {'session_id':session_id, 'message':parameters['flagged_message']}
+        try:
+            on_topic = agent.review_answer(template, user_message, interview.context, deadline=deadline, usage=usage)
+        except DeadlineExceeded as e:
+            on_topic = workflow.unmoderated_answer(interview, e)
 
-        # If user message does not fit the interview context, give another chance
-        if not on_topic: # but not flagged too often...
-            interview.update_session() 
-            return {'session_id':session_id, 'message':parameters['off_topic_message']}
+        # Terminate if flagged too often, or give another chance
+        rejection = workflow.rejection(interview, user_message, on_topic)
+        if rejection:
+            if speculation:
+                # Discard speculatively generated question (not recorded, even if it keeps running)
+                speculation.cancel()
+            interview.record_usage(usage.to_state())
+            interview.update_session()
+            yield 'message', rejection
+            return
 
     """
     UPDATE INTERVIEW WITH NEW USER MESSAGE
@@ -113,49 +249,78 @@ def next_question(session_id:str, interview_id:str, user_message:str=None) -> di
 
     ##### CONTINUE INTERVIEW BASED ON WORKFLOW #####
 
-    # Current topic guide
-    num_topics = len(parameters['interview_plan'])
-    current_topic_idx = interview.get_current_topic()
-    on_last_topic = current_topic_idx == num_topics
-    logging.info(f"On topic {current_topic_idx}/{num_topics}...")
-
-    # Current question within topic guide
-    current_question_idx = interview.get_current_topic_question()
-    num_questions = parameters['interview_plan'][current_topic_idx-1]['length']
-    on_last_question = current_question_idx >= num_questions
-    logging.info(f"On question {current_question_idx}/{num_questions}...")
-
-    # Continue in workflow
-    if on_last_topic and on_last_question:
+    if step == 'close':
         # Close interview with pre-determined closing questions
-        next_question = interview.get_final_question()
-        interview.update_closing()
+        next_question = workflow.closing_question(interview)
         if not next_question:
-            # Exit condition: have already produced last "final" question
-            interview.terminate()
+            interview.record_usage(usage.to_state())
             interview.update_session()
-            return {'session_id':session_id, 'message':parameters['end_of_interview_message']}
-
-    elif on_last_question:
-        # Transition to *next* topic...
-        next_question, summary = agent.transition_topic(interview.get_history())
-        interview.update_transition(summary)
+            yield 'message', workflow.response(interview, interview.parameters['end_of_interview_message'])
+            return
 
     else:
-        # Proceed *within* topic...
-        next_question = agent.probe_within_topic(interview.get_history())
-        interview.update_probe()
+        try:
+            if speculation:
+                try:
+                    next_question = speculation.result()
+                finally:
+                    usage.add(speculative_usage)
+            elif stream:
+                next_question = yield from stream_question(step, template, interview.context, deadline, usage)
+            else:
+                next_question = generate_question(step, template, interview.context, deadline, usage)
+        except DeadlineExceeded as e:
+            next_question, step = workflow.fallback(interview, template, e, "question not generated")
+
+    # Optional: Check if next question is flagged by OpenAI's moderation endpoint (before storing it)
+    flagged_question = False
+    if workflow.moderates_questions(interview):
+        try:
+            flagged_question = agent.review_question(next_question, deadline=deadline, usage=usage)
+        except DeadlineExceeded as e:
+            next_question, step = workflow.unmoderated_question(interview, template, step, next_question, e)
+    workflow.advance(interview, step, flagged_question)
 
-    # Update interview with new output
+    # Update interview with new output, and the accounting of the turn
     logging.info(f"Interviewer responded: '{next_question}'")
+    interview.record_usage(usage.to_state())
     interview.add_chat_to_session(next_question, type="question")
+    if flagged_question:
+        yield 'message', workflow.response(interview, interview.parameters['end_of_interview_message'])
+        return
 
-    # Optional: Check if next question is flagged by OpenAI's moderation endpoint
-    if parameters.get('moderate_questions'):
-        flagged_question = agent.review_question(next_question)
-        if flagged_question:
-            interview.terminate(reason="question_flagged")
-            interview.update_session()
-            return {'session_id':session_id, 'message':parameters['end_of_interview_message']}
+    # Optional: Summarize interview until the new topic, off the critical path
+    if workflow.summarizes(interview, step):
+        schedule_summary(session_id, interview_id, interview.current_state['order'])
     
-    return {'session_id':session_id, 'message':next_question}
+    yield 'message', workflow.response(interview, next_question)
+
+def next_question(session_id:str, interview_id:str, user_message:str=None, deadline:Deadline=None) -> dict:
+    """
+    Process user message and generate response by the AI-interviewer.
+
+    Args:
+        session_id: (str) unique interview session ID
+        user_message: (str) interviewee response
+        interview_id: (str) containing interview guidelines index
+        deadline: (Deadline) time budget of the request, see `process_message`
+    Returns:
+        response: (dict) containing `message` from interviewer
+    """
+    for _, response in process_message(session_id, interview_id, user_message, deadline=deadline):
+        pass
+    return response
+
+def next_question_stream(session_id:str, interview_id:str, user_message:str=None, deadline:Deadline=None):
+    """
+    Process user message and stream response by the AI-interviewer.
+
+    Args:
+        session_id: (str) unique interview session ID
+        user_message: (str) interviewee response
+        interview_id: (str) containing interview guidelines index
+        deadline: (Deadline) time budget of the request, see `process_message`
+    Yields:
+        event: (tuple) ('token', text) while generating, finally ('message', response)
+    """
+    yield from process_message(session_id, interview_id, user_message, stream=True, deadline=deadline)
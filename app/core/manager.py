@@ -1,4 +1,6 @@
 from datetime import datetime
+from core.context import InterviewContext
+from core.usage import merge_usage
 import logging
 
 
@@ -15,32 +17,44 @@ class InterviewManager(object):
         self.client = client
         self.session_id = session_id
     
-    def begin_session(self, parameters:dict):
+    def begin_session(self, parameters:dict, interview_id:str=None):
         """ Set starting interview session variables. """
         logging.info(f"Starting new session '{self.session_id}'")
         self.history = []           # List of 'states', i.e. messages
         self.current_state = {
             'order': 0,                         # index of message
             'session_id': self.session_id,      # always store session_id
+            'interview_id': interview_id,       # key of interview parameters
             'topic_idx': 1,                     # topic index
             'question_idx': 1,                  # within-topic question index
             'finish_idx': 1,                    # closing question index
             'flagged_messages': 0,              # count of flagged messages
             'terminated': False,                # whether termination signal been sent
-            'summary': '',                      # running summary
+            'summary': [],                      # summary of each (finished) topic
+            'version': 0,                       # count of writes to the stored session
             'type': 'question',                 # question or answer
             'content': None                     # content
         }
         self.parameters = parameters
+        self.context = InterviewContext()
 
     def resume_session(self, parameters:dict):
         """ Load (remote) history into current Interview object. """
-        self.history = self.client.load_remote_session(self.session_id)
+        self.set_history(self.client.load_remote_session(self.session_id), parameters)
+
+    def set_history(self, history:list, parameters:dict):
+        """
+        Set (loaded) history of existing session as current Interview object, with the context
+        cached with the session if the database keeps one (see `database.cache.CachedDatabase`).
+        """
+        self.history = history
         assert len(self.history) >= 1 
         assert self.history[-1].get('session_id') == self.session_id
         # Set current state equal to last
         self.current_state = self.history[-1].copy()
         self.parameters = parameters
+        load_context = getattr(self.client, 'load_context', None)
+        self.context = load_context(self.session_id, self.history) if load_context else InterviewContext(self.history)
         logging.info(f"Resumed existing interview session '{self.session_id}'")
 
     def get_history(self):
@@ -63,23 +77,67 @@ class InterviewManager(object):
             return True        
         return False
 
-    def add_chat_to_session(self, message:str, type:str):
-        """ Add to chat transcript to remote database """ 
+    def preview_chat(self, message:str, type:str) -> dict:
+        """ Return message state as it would be added to the session (without adding it). """
+        state = self.current_state.copy()
+        state['order'] += 1
+        state['content'] = message
+        state['type'] = type
+        return state
+
+    def add_chat(self, message:str, type:str):
+        """ Add to chat transcript (without writing to remote database) """ 
         self.current_state['order'] += 1
         self.current_state['time'] = str(datetime.now()) 
         self.current_state['content'] = message
         self.current_state['type'] = type
+        if type == 'answer':
+            # Usage is stored with the question of the turn, see `record_usage`
+            self.current_state.pop('usage', None)
         self.history.append(self.current_state.copy())
-        self.client.update_remote_session(self.session_id, self.history)
+        self.context.append(self.history[-1])
+
+    def increment_version(self):
+        """ Count write to remote database, which requires the stored session at the prior version. """
+        self.current_state['version'] = int(self.current_state.get('version', 0)) + 1
+
+    def add_chat_to_session(self, message:str, type:str):
+        """ Add to chat transcript to remote database """ 
+        self.increment_version()
+        self.add_chat(message, type)
+        if len(self.history) == 1:
+            # New (or restarted) session: (over)write the stored transcript
+            self.client.update_remote_session(self.session_id, self.history)
+        else:
+            # Only write the new message, not the whole transcript
+            self.client.append_message(self.session_id, self.history[-1])
 
     def terminate(self, reason:str="end_of_interview"):
         """ Record termination of interview. """
         self.current_state["terminated"] = True
         logging.info(f"Terminating interview because: '{reason}'")
 
-    def update_summary(self, summary:str):
-        """ Update summary of prior interview. """
-        self.current_state["summary"] = summary
+    def store_summary(self, topic_idx:int, summary:str):
+        """
+        Store summary of (finished) topic in remote database apart from the messages, i.e. without
+        writing the current state (nor its version), such that it cannot conflict with a turn being
+        processed. It is set in the current state once the session is loaded again.
+        """
+        self.client.store_summary(self.session_id, topic_idx, summary)
+
+    def get_summary(self, topic_idx:int) -> str:
+        """ Return summary of topic (empty if not summarized). """
+        summaries = self.current_state.get("summary") or []
+        if isinstance(summaries, list) and topic_idx <= len(summaries):
+            return summaries[topic_idx - 1]
+        return ''
+
+    def record_usage(self, usage:dict):
+        """
+        Add accounting of the turn's OpenAI requests (see `core.usage.TurnUsage`) to the current
+        state, i.e. the turn's question, or else (e.g. off-topic answers) the last stored message.
+        """
+        self.current_state['usage'] = merge_usage(self.current_state.get('usage'), usage)
 
     def get_current_topic(self) -> int:
         """ Return topic index. """
@@ -101,17 +159,16 @@ class InterviewManager(object):
             self.current_state["finish_idx"] += 1
         return out
 
-    def update_transition(self, summary:str):
+    def update_transition(self):
         """ 
         Having transitioned, update topic counter (and reset question). 
         
-        If summary agent is provided, also update interview summary of 
-        prior topics covered for future context.
+        If summary agent is provided, the finished topic is summarized in the
+        background (see `core.logic.summarize_session`), until then prompts
+        include its transcript.
         """
         self.current_state["question_idx"] = 1  
         self.current_state["topic_idx"] += 1
-        if self.parameters.get('summary'):
-            self.update_summary(summary)
 
     def update_closing(self):
         self.current_state["question_idx"] = 99  
@@ -123,6 +180,41 @@ class InterviewManager(object):
 
     def update_session(self):
         """ Update current state in remote database """ 
+        self.increment_version()
+        self.history[-1] = self.current_state
+        self.context.update_state(self.current_state)
+        self.client.patch_last_state(self.session_id, self.current_state)
+
+
+class AsyncInterviewManager(InterviewManager):
+    """
+    Variant of `InterviewManager` for the asynchronous request path,
+    i.e. with awaitable reads and writes of the remote database.
+
+    Args:
+        client: asynchronous database manager, see `database.async_adapter`
+        session_id: (str) unique interview session key
+    """
+    async def resume_session(self, parameters:dict):
+        """ Load (remote) history into current Interview object. """
+        self.set_history(await self.client.load_remote_session(self.session_id), parameters)
+
+    async def add_chat_to_session(self, message:str, type:str):
+        """ Add to chat transcript to remote database """ 
+        self.increment_version()
+        self.add_chat(message, type)
+        if len(self.history) == 1:
+            await self.client.update_remote_session(self.session_id, self.history)
+        else:
+            await self.client.append_message(self.session_id, self.history[-1])
+
+    async def store_summary(self, topic_idx:int, summary:str):
+        """ Store summary of (finished) topic in remote database, see `InterviewManager.store_summary`. """
+        await self.client.store_summary(self.session_id, topic_idx, summary)
+
+    async def update_session(self):
+        """ Update current state in remote database """ 
+        self.increment_version()
         self.history[-1] = self.current_state
-        self.client.update_remote_session(self.session_id, self.history)
-   
\ No newline at end of file
+        self.context.update_state(self.current_state)
+        await self.client.patch_last_state(self.session_id, self.current_state)
@@ -0,0 +1,61 @@
+import re
+
+STOPWORDS = set("""
+a about above after again all am an and any are as at be because been before being below between both but by can
+could did do does doing down during each few for from further had has have having he her here hers him his how i if
+in into is it its itself just me more most my no nor not now of off on once only or other our ours out over own same
+she should so some such than that the their theirs them then there these they this those through to too under until
+up very was we were what when where which while who whom why will with would you your yours yourself
+""".split())
+
+# Replies the moderator agent accepts by definition, e.g. not knowing or wishing to move on
+NON_ANSWERS = re.compile(
+    r"^\W*(i\s+(really\s+)?(do\s*n[o']?t|don't|dont)\s+know|not\s+sure|no\s+idea|i'?m\s+not\s+sure|"
+    r"(i\s+)?(would|'d)\s+rather\s+not\s+(say|answer)|(let'?s\s+)?move\s+on|skip|pass|next\s+question)\W*$",
+    re.IGNORECASE
+)
+
+# Answers addressing the AI rather than the question are always left to the moderator agent
+INSTRUCTIONS = re.compile(r"\b(ignore|disregard|instructions?|prompt|system|assistant|chatgpt|gpt|ai|language model|pretend|act as)\b", re.IGNORECASE)
+
+def content_words(text:str) -> set:
+    """ Return (crudely stemmed) words of text that are not stopwords. """
+    return set(word[:5] for word in re.findall(r"[a-z]+", text.lower()) if word not in STOPWORDS and len(word) > 2)
+
+
+class AnswerPrefilter(object):
+    """
+    Local pre-classifier of interviewee answers in front of the moderator agent, which
+    accepts answers that are obviously on topic without an LLM request: non-answers
+    the moderator allows anyway (e.g. "I don't know"), and answers of at least `min_words`
+    words which share at least `min_shared` content words (and `min_overlap` of their
+    own) with the question or the current topic of the interview plan. All other answers,
+    e.g. those seemingly instructing the AI, are escalated to the moderator agent;
+    answers are never rejected locally.
+    Override `review` to plug in another classifier, e.g. a small offline model.
+
+    Args:
+        min_words: (int) minimum number of words of answers accepted for their overlap
+        min_shared: (int) minimum number of content words shared with question or topic
+        min_overlap: (float) minimum share of the answer's content words in question or topic
+    """
+    def __init__(self, min_words:int=8, min_shared:int=2, min_overlap:float=0.1):
+        self.min_words = min_words
+        self.min_shared = min_shared
+        self.min_overlap = min_overlap
+
+    def review(self, question:str, topic:str, answer:str) -> bool:
+        """ Return True if answer is on topic, or None if the moderator agent has to decide. """
+        if not answer:
+            return None
+        if NON_ANSWERS.match(answer):
+            return True
+        if INSTRUCTIONS.search(answer):
+            return None
+        if len(answer.split()) < self.min_words:
+            return None
+        words = content_words(answer)
+        shared = words & (content_words(question or '') | content_words(topic))
+        if words and len(shared) >= self.min_shared and len(shared) / len(words) >= self.min_overlap:
+            return True
+        return None
@@ -0,0 +1,148 @@
+from database.cache import LRUCache
+from hashlib import sha256
+from threading import Lock
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+
+
+def result_key(*parts) -> str:
+    """ Return hash of a request, e.g. of its task and the query of `LLMAgent.construct_query`. """
+    return sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+def is_deterministic(query:dict) -> bool:
+    """ Whether completions of query are (close to) reproducible, i.e. sampled at temperature 0. """
+    return query.get('temperature', 1) == 0 and query.get('n', 1) == 1
+
+
+class SQLiteResults(object):
+    """
+    Results shared by the processes of one host, in a local SQLite file. Each process opens its
+    own connection on first use, as connections must not be inherited by forked processes
+    (e.g. uWSGI workers forked after the app has been imported).
+    """
+    def __init__(self, path:str):
+        self.path = path
+        self.lock = Lock()
+        self.connections = {} # connection of each process
+        logging.info(f"Sharing cached results in SQLite file '{path}'")
+
+    def connection(self) -> sqlite3.Connection:
+        pid = os.getpid()
+        if pid not in self.connections:
+            connection = sqlite3.connect(self.path, check_same_thread=False, timeout=1)
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+            self.connections = {pid: connection} # not the parent's
+        return self.connections[pid]
+
+    def get(self, key:str):
+        with self.lock:
+            row = self.connection().execute("SELECT value, expires FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def put(self, key:str, value, ttl:float):
+        with self.lock:
+            connection = self.connection()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO results (key, value, expires) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), time.time() + ttl)
+                )
+
+
+class DynamoResults(object):
+    """
+    Results shared by all instances (e.g. of the Lambda function), in a DynamoDB table of
+    their own with (string) key 'key', expired by DynamoDB's time to live on 'expires'.
+    """
+    def __init__(self, table_name:str):
+        from boto3 import resource
+        from database.dynamo import CONFIG
+        self.table = resource('dynamodb', config=CONFIG).Table(table_name)
+        logging.info(f"Sharing cached results in DynamoDB table '{table_name}'")
+
+    def get(self, key:str):
+        item = self.table.get_item(Key={'key':key}).get('Item')
+        if item is None or int(item['expires']) < time.time():
+            return None # expired items are deleted eventually
+        return json.loads(item['value'])
+
+    def put(self, key:str, value, ttl:float):
+        self.table.put_item(Item={'key':key, 'value':json.dumps(value), 'expires':int(time.time() + ttl)})
+
+
+class ResultCache(object):
+    """
+    Results of deterministic OpenAI requests (transcriptions, the moderation endpoint and
+    completions at temperature 0, such as the moderator agent's), keyed by a hash of the
+    request, such that retries (e.g. of a failed transcription, or an answer resubmitted after
+    the off-topic message) are not sent again. Recent results are held in memory; results
+    may also be shared by processes through a `backend` (`SQLiteResults` or `DynamoResults`).
+    Failures of the backend are logged rather than raised, as results can always be requested.
+
+    Args:
+        max_size: (int) maximum number of results held in memory
+        ttl: (float) seconds after which results are requested again
+        backend: shared store of results, optional
+    """
+    def __init__(self, max_size:int=1024, ttl:float=3600, backend=None):
+        self.ttl = ttl
+        self.memory = LRUCache(max_size, ttl)
+        self.backend = backend
+        logging.info(f"Caching up to {max_size} results of deterministic requests for {ttl:.0f} seconds.")
+
+    def get(self, key:str):
+        """ Return cached result, or None. """
+        value = self.memory.get(key)
+        if value is None and self.backend is not None:
+            try:
+                value = self.backend.get(key)
+            except Exception as e:
+                logging.warning(f"Cached result not loaded: {e!r}")
+            if value is not None:
+                self.memory.put(key, value)
+        if value is not None:
+            logging.info(f"Result '{key[:12]}' served from cache")
+        return value
+
+    def put(self, key:str, value):
+        self.memory.put(key, value)
+        if self.backend is not None:
+            try:
+                self.backend.put(key, value, self.ttl)
+            except Exception as e:
+                logging.warning(f"Result not cached: {e!r}")
+
+    async def get_async(self, key:str):
+        """ Return cached result, or None, without blocking the event loop on the backend. """
+        if self.backend is None:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def put_async(self, key:str, value):
+        if self.backend is None:
+            return self.put(key, value)
+        await asyncio.to_thread(self.put, key, value)
+
+
+def result_cache_from_environment() -> ResultCache:
+    """
+    Return cache of `RESULT_CACHE_SIZE` results (default: 1024, none if 0) held for `RESULT_CACHE_TTL`
+    seconds (default: 3600), shared through the DynamoDB table `RESULT_CACHE_TABLE` or the SQLite
+    file `RESULT_CACHE_FILE`, if set.
+    """
+    max_size = int(os.getenv("RESULT_CACHE_SIZE", 1024))
+    if not max_size:
+        return None
+    backend = None
+    if os.getenv("RESULT_CACHE_TABLE"):
+        backend = DynamoResults(os.environ["RESULT_CACHE_TABLE"])
+    elif os.getenv("RESULT_CACHE_FILE"):
+        backend = SQLiteResults(os.environ["RESULT_CACHE_FILE"])
+    return ResultCache(max_size, float(os.getenv("RESULT_CACHE_TTL", 3600)), backend)
@@ -0,0 +1,34 @@
+"""
+Setup of the request paths (`core.logic` and `core.async_logic`), each of which connects to
+the database and compiles the interview templates once when imported. Importing this module
+sets up nothing by itself, such that either path can be imported without the other's setup.
+"""
+from parameters import INTERVIEW_PARAMETERS
+from core.templates import compile_interview_templates
+import os
+
+def connect_to_backend():
+    """ Instantiate specific backend database. """
+    if os.getenv("DATABASE") == "DYNAMODB":
+        # For AWS, leverage Dynamo database
+        from database.dynamo import DynamoDB
+        return DynamoDB(os.environ['DYNAMO_TABLE'])
+    if os.getenv("DATABASE") == "DYNAMODB_MESSAGES":
+        # Dynamo database with one item per message, see `aws_migrate.py`
+        from database.dynamo import DynamoMessagesDB
+        return DynamoMessagesDB(os.environ['DYNAMO_TABLE'])
+    from database.file import FileWriter
+    return FileWriter()
+
+def connect_to_database():
+    """ Instantiate backend database, caching recently used sessions unless `SESSION_CACHE_SIZE=0`. """
+    backend = connect_to_backend()
+    max_sessions = int(os.getenv("SESSION_CACHE_SIZE", 256))
+    if not max_sessions:
+        return backend
+    from database.cache import CachedDatabase
+    return CachedDatabase(backend, max_sessions, float(os.getenv("SESSION_CACHE_TTL", 600)))
+
+def interview_templates() -> dict:
+    """ Return compiled templates of the interviews in `parameters.py`, raising `ValueError` for invalid parameters. """
+    return compile_interview_templates(INTERVIEW_PARAMETERS)
@@ -0,0 +1,229 @@
+from string import Formatter
+from core.prefilter import AnswerPrefilter
+from core.hedging import Hedge
+from core.tokens import count_tokens, load_encodings
+import logging
+
+# Placeholders which may be used in prompts, see `parameters.py`
+PLACEHOLDERS = {
+    'topics', 'current_topic', 'next_interview_topic',           # fixed per interview topic
+    'question', 'answer', 'summary', 'current_topic_history'     # filled per turn
+}
+
+# Placeholders which are the same for all sessions of an interview
+STATIC_PLACEHOLDERS = {'topics'}
+
+# Asked if no question could be generated within the budget of the request, see `core.deadline`
+FALLBACK_QUESTION = "Thank you. Could you tell me a bit more about that?"
+
+def escape(text:str) -> str:
+    """ Escape braces of text to be included literally in a format string. """
+    return text.replace('{', '{{').replace('}', '}}')
+
+def label(field:str) -> str:
+    """ Return heading of placeholder's input in the dynamic message of cache-friendly prompts. """
+    return field.replace('_', ' ').upper()
+
+class PromptTemplate(object):
+    """
+    Prompt of an agent (task) compiled for an interview plan: its placeholders are
+    checked once, and those fixed per interview topic are filled in ahead of time,
+    leaving only the per-turn substitutions when rendering.
+    Prompts over the agent's `max_prompt_tokens` leave out the oldest messages of their
+    transcripts, always keeping the last question and answer (summaries are kept).
+    Cache-friendly prompts are split into a `system` message, i.e. the prompt with
+    placeholders referring to inputs below, which is identical for all sessions of an
+    interview (and thus a prefix OpenAI can cache), and the rendered inputs.
+
+    Args:
+        task_parameters: (dict) of agent, i.e. its `prompt` and model settings
+        topics: (list) interview plan
+        task: (str) name of agent, for logging
+        cache_friendly: (bool) whether to split the prompt into static and dynamic messages
+    """
+    def __init__(self, task_parameters:dict, topics:list, task:str=None, cache_friendly:bool=False):
+        if not isinstance(task_parameters.get('prompt'), str):
+            raise ValueError("no 'prompt' specified")
+        self.settings = {
+            "model": task_parameters.get('model', 'gpt-4o-mini'),
+            "max_tokens": task_parameters.get('max_tokens', 300),
+            "temperature": task_parameters.get('temperature', 0)
+        }
+        self.task = task
+        self.max_prompt_tokens = task_parameters.get('max_prompt_tokens')
+        if self.max_prompt_tokens is not None and int(self.max_prompt_tokens) < 1:
+            raise ValueError("'max_prompt_tokens' must be positive")
+        # Optional: Hedge slow completions, see `core.hedging`
+        self.hedge = None
+        if task_parameters.get('hedge_percentile'):
+            self.hedge = Hedge(
+                task_parameters['hedge_percentile'],
+                task_parameters.get('hedge_model'),
+                task_parameters.get('hedge_delay', 2)
+            )
+        self.num_topics = len(topics)
+        parsed = list(Formatter().parse(task_parameters['prompt']))
+        self.fields = set(field for _, field, _, _ in parsed if field is not None)
+        if self.fields - PLACEHOLDERS:
+            raise ValueError(f"unknown placeholders {sorted(self.fields - PLACEHOLDERS)} in prompt")
+        # Optional: Static system message, with the other placeholders as inputs of the rendered message
+        self.system = None
+        if cache_friendly:
+            static = {'topics': '\n'.join([topic['topic'] for topic in topics])}
+            self.system = "".join(
+                literal + (Formatter().format_field(static[field], spec) if field in STATIC_PLACEHOLDERS
+                    else f"(see {label(field)} below)" if field is not None else "")
+                    for literal, field, spec, conversion in parsed
+            ).strip()
+            inputs = {}
+            for _, field, spec, conversion in parsed:
+                if field is not None and field not in STATIC_PLACEHOLDERS:
+                    inputs.setdefault(field, (spec, conversion))
+            parsed = [
+                (("\n\n" if i else "") + f"{label(field)}:\n", field, spec, conversion)
+                    for i, (field, (spec, conversion)) in enumerate(inputs.items())
+            ]
+        # Format string per topic, with fixed placeholders filled in
+        self.formats = []
+        for topic_idx in range(1, self.num_topics + 1):
+            fixed = {
+                'topics': '\n'.join([topic['topic'] for topic in topics]),
+                'current_topic': topics[topic_idx - 1]['topic'],
+                'next_interview_topic': topics[min(topic_idx + 1, self.num_topics) - 1]['topic']
+            }
+            self.formats.append("".join(
+                escape(literal) + self._compile_field(field, spec, conversion, fixed)
+                    for literal, field, spec, conversion in parsed
+            ))
+
+    def _compile_field(self, field:str, spec:str, conversion:str, fixed:dict) -> str:
+        if field is None:
+            return ""
+        if field in fixed:
+            return escape(Formatter().format_field(Formatter().convert_field(fixed[field], conversion), spec))
+        return "{" + field + (f"!{conversion}" if conversion else "") + (f":{spec}" if spec else "") + "}"
+
+    def fill(self, context, user_message:str=None, since:int=0) -> str:
+        """ Return prompt filled with the interview, leaving out transcript lines before `since`. """
+        state = context.state
+        current_topic_idx = min(int(state['topic_idx']), self.num_topics)
+        values = {'question': state["content"], 'answer': user_message}
+        if 'summary' in self.fields:
+            values['summary'] = context.summary_until(current_topic_idx, since)
+        if 'current_topic_history' in self.fields:
+            values['current_topic_history'] = context.topic_history(current_topic_idx, since)
+        return self.formats[current_topic_idx - 1].format(**values)
+
+    def render(self, context, user_message:str=None) -> str:
+        """ Fill the prompt with the current interview, i.e. its `InterviewContext` (see `core.context`). """
+        prompt = self.fill(context, user_message)
+        if self.max_prompt_tokens:
+            prompt = self.window(prompt, context, user_message)
+        logging.debug(f"Prompt to GPT:\n{prompt}")
+        return prompt
+
+    def window(self, prompt:str, context, user_message:str=None) -> str:
+        """ Return prompt within `max_prompt_tokens`, leaving out as few of the oldest messages as needed. """
+        model, budget = self.settings['model'], int(self.max_prompt_tokens)
+        # The system message of cache-friendly prompts counts towards the budget
+        overhead = count_tokens(self.system, model) if self.system else 0
+        budget -= overhead
+        tokens = count_tokens(prompt, model)
+        if tokens <= budget:
+            logging.debug(f"'{self.task}' prompt of {tokens + overhead} tokens")
+            return prompt
+        # Smallest first line kept (by binary search), keeping at least the last question and answer
+        low, high = 1, max(len(context.lines) - 2, 0)
+        windowed, windowed_tokens, since = prompt, tokens, 0
+        while low <= high:
+            middle = (low + high) // 2
+            candidate = self.fill(context, user_message, middle)
+            candidate_tokens = count_tokens(candidate, model)
+            if candidate_tokens <= budget or middle == high and candidate_tokens < windowed_tokens:
+                windowed, windowed_tokens, since = candidate, candidate_tokens, middle
+            if candidate_tokens <= budget:
+                high = middle - 1
+            else:
+                low = middle + 1
+        if windowed_tokens > budget:
+            logging.warning(f"'{self.task}' prompt of {windowed_tokens + overhead} tokens over budget of {self.max_prompt_tokens} tokens")
+        logging.info(f"Windowed '{self.task}' prompt from {tokens + overhead} to {windowed_tokens + overhead} tokens, omitting {since} messages")
+        return windowed
+
+
+class InterviewTemplate(object):
+    """
+    Interview parameters (see `parameters.py`) validated, and the prompts of
+    all its agents compiled, once at startup rather than for every request.
+
+    Args:
+        parameters: (dict) of interview
+    """
+    TASKS = ['summary', 'transition', 'probe', 'moderator']
+
+    def __init__(self, parameters:dict):
+        self.parameters = parameters
+        topics = parameters.get('interview_plan')
+        if not topics or not all(isinstance(topic.get('topic'), str) and int(topic.get('length', 0)) >= 1 for topic in topics):
+            raise ValueError("'interview_plan' must list topics, each with 'topic' and 'length' of at least 1")
+        for key in ['first_question', 'termination_message', 'end_of_interview_message']:
+            if not isinstance(parameters.get(key), str):
+                raise ValueError(f"no '{key}' specified")
+        self.fallback_question = parameters.get('fallback_question', FALLBACK_QUESTION)
+        if not isinstance(self.fallback_question, str):
+            raise ValueError("'fallback_question' must be a string")
+        if parameters.get('moderate_answers') and parameters.get('moderator'):
+            for key in ['off_topic_message', 'flagged_message']:
+                if not isinstance(parameters.get(key), str):
+                    raise ValueError(f"no '{key}' specified, but answers are moderated")
+        required = ['probe'] + (['transition'] if len(topics) > 1 else []) + (['summary'] if parameters.get('summarize') else [])
+        for task in required:
+            if not parameters.get(task):
+                raise ValueError(f"no '{task}' agent specified")
+        self.prompts = {}
+        for task in self.TASKS:
+            if parameters.get(task):
+                try:
+                    self.prompts[task] = PromptTemplate(parameters[task], topics, task, bool(parameters.get('cache_friendly_prompts')))
+                except ValueError as e:
+                    raise ValueError(f"'{task}' agent: {e}") from e
+        # Optional: Accept obviously on-topic answers without the moderator agent
+        prefilter = parameters.get('answer_prefilter')
+        try:
+            self.prefilter = AnswerPrefilter(**(prefilter if isinstance(prefilter, dict) else {})) if prefilter else None
+        except TypeError as e:
+            raise ValueError(f"'answer_prefilter': {e}") from e
+
+    def current_topic(self, context) -> str:
+        """ Return description of current topic of interview plan. """
+        topics = self.parameters['interview_plan']
+        return topics[min(int(context.state['topic_idx']), len(topics)) - 1]['topic']
+
+    def render(self, task:str, context, user_message:str=None) -> str:
+        return self.prompts[task].render(context, user_message)
+
+    def hedges(self, tasks:list) -> dict:
+        """ Return hedging (if any) of each task's completions. """
+        return {task: self.prompts[task].hedge for task in tasks if self.prompts[task].hedge}
+
+
+def compile_interview_templates(interview_parameters:dict) -> dict:
+    """
+    Return compiled `InterviewTemplate` of each interview, raising `ValueError` for invalid parameters.
+    Tokenizers of the agents with `max_prompt_tokens` are loaded, warning if tokens are to be estimated.
+    """
+    templates = {}
+    for interview_id, parameters in interview_parameters.items():
+        try:
+            templates[interview_id] = InterviewTemplate(parameters)
+        except ValueError as e:
+            raise ValueError(f"Invalid interview parameters '{interview_id}': {e}") from e
+    # Load tokenizers of prompt budgets now, rather than (downloading them) on the first long prompt
+    missing = load_encodings(
+        prompt.settings['model'] for template in templates.values()
+            for prompt in template.prompts.values() if prompt.max_prompt_tokens
+    )
+    if missing:
+        logging.warning(f"Prompt tokens of models {missing} are estimated, set `TIKTOKEN_CACHE_DIR` to cached encodings to count them.")
+    logging.info(f"Compiled templates of interviews {list(templates)}.")
+    return templates
@@ -0,0 +1,43 @@
+from math import ceil
+import logging
+
+# Tokenizer of each model, None if unavailable
+encodings = {}
+
+# Encodings of OpenAI's models: GPT-4o and later, and GPT-4 and GPT-3.5
+ENCODINGS = ["o200k_base", "cl100k_base"]
+
+def get_encoding(model:str):
+    """
+    Return (cached) tokenizer of model, or None if `tiktoken` or its encoding is not
+    available (encodings are downloaded once, see `TIKTOKEN_CACHE_DIR` to keep them offline).
+    Tokenizers of prompt budgets are loaded at startup, see `load_encodings`.
+    """
+    if model not in encodings:
+        try:
+            import tiktoken
+            try:
+                encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encodings[model] = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logging.warning(f"No tokenizer for '{model}' (see `TIKTOKEN_CACHE_DIR`), estimating tokens from characters: {e!r}")
+            encodings[model] = None
+    return encodings[model]
+
+def load_encodings(models) -> list:
+    """ Load tokenizers of models (e.g. at startup rather than on a request), returning models without tokenizer. """
+    return [model for model in sorted(set(models)) if get_encoding(model) is None]
+
+def cache_encodings():
+    """ Download encodings into `TIKTOKEN_CACHE_DIR` (e.g. when building an image) to count tokens offline. """
+    import tiktoken
+    for name in ENCODINGS:
+        tiktoken.get_encoding(name)
+
+def count_tokens(text:str, model:str) -> int:
+    """ Return number of tokens of text for model (estimated as 4 characters per token without tokenizer). """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return ceil(len(text) / 4)
+    return len(encoding.encode(text, disallowed_special=()))
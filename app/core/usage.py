@@ -0,0 +1,135 @@
+from collections import defaultdict
+from threading import Lock
+import time
+
+# Numbers of each task's accounting, summed when turns are merged or aggregated
+COUNTS = ['requests', 'prompt_tokens', 'completion_tokens', 'cached_tokens', 'latency_ms']
+
+
+class TurnUsage(object):
+    """
+    Accounting of the OpenAI requests of one turn (`/next` request), stored with the
+    interview (the state's 'usage', see `InterviewManager.record_usage`): per task its
+    model, requests (including hedging requests, see `core.hedging`), prompt, completion
+    and cached prompt tokens, and latency, as well as the time of question moderation
+    and the whole turn. Times are integer milliseconds, as DynamoDB does not store floats.
+    Tasks may be recorded concurrently. Speculative question generation records into a
+    `TurnUsage` of its own, added to the turn's (see `add`) only if the question is used.
+    """
+    def __init__(self):
+        self.start = time.monotonic()
+        self.tasks = {}
+        self.moderation_ms = 0
+        self.lock = Lock()
+
+    def task(self, task:str) -> dict:
+        return self.tasks.setdefault(task, {'model':None, **dict.fromkeys(COUNTS, 0)})
+
+    def request(self, task:str, model:str=None):
+        """ Count request sent for task. """
+        with self.lock:
+            entry = self.task(task)
+            entry['requests'] += 1
+            entry['model'] = entry['model'] or model
+
+    def record(self, task:str, response, seconds:float):
+        """ Record model, token usage and latency of task's (completion) response. """
+        usage = getattr(response, 'usage', None)
+        details = getattr(usage, 'prompt_tokens_details', None)
+        with self.lock:
+            entry = self.task(task)
+            entry['requests'] = entry['requests'] or 1
+            entry['model'] = getattr(response, 'model', None) or entry['model']
+            entry['prompt_tokens'] += getattr(usage, 'prompt_tokens', 0) or 0
+            entry['completion_tokens'] += getattr(usage, 'completion_tokens', 0) or 0
+            entry['cached_tokens'] += getattr(details, 'cached_tokens', 0) or 0
+            entry['latency_ms'] += round(seconds * 1000)
+
+    def add(self, other:'TurnUsage'):
+        """ Add tasks and moderation time recorded by other, e.g. by a speculatively generated question. """
+        with other.lock:
+            tasks = {task: entry.copy() for task, entry in other.tasks.items()}
+            moderation_ms = other.moderation_ms
+        with self.lock:
+            for task, entry in tasks.items():
+                totals = self.task(task)
+                totals['model'] = totals['model'] or entry['model']
+                for count in COUNTS:
+                    totals[count] += entry[count]
+            self.moderation_ms += moderation_ms
+
+    def record_moderation(self, seconds:float):
+        with self.lock:
+            self.moderation_ms += round(seconds * 1000)
+
+    def to_state(self) -> dict:
+        """ Return accounting of the turn so far. """
+        with self.lock:
+            return {
+                'turns': 1,
+                'total_ms': round((time.monotonic() - self.start) * 1000),
+                'moderation_ms': self.moderation_ms,
+                'tasks': {task: entry.copy() for task, entry in self.tasks.items()}
+            }
+
+
+def merge_usage(usage:dict, other:dict) -> dict:
+    """ Return accounting of both (e.g. an off-topic turn and the turn of the same question). """
+    if not usage:
+        return other
+    tasks = {task: dict(entry) for task, entry in usage.get('tasks', {}).items()}
+    for task, entry in other.get('tasks', {}).items():
+        totals = tasks.setdefault(task, {'model':None, **dict.fromkeys(COUNTS, 0)})
+        totals['model'] = entry.get('model') or totals.get('model')
+        for count in COUNTS:
+            totals[count] = int(totals.get(count, 0)) + int(entry.get(count, 0))
+    merged = {key: int(usage.get(key, 0)) + int(other.get(key, 0)) for key in ['turns', 'total_ms', 'moderation_ms']}
+    merged['tasks'] = tasks
+    return merged
+
+def percentiles(values:list, points:tuple=(50, 95, 99)) -> dict:
+    """ Return (nearest-rank) percentiles of values. """
+    values = sorted(values)
+    if not values:
+        return {}
+    return {f"p{point}": values[min(int(len(values) * point / 100), len(values) - 1)] for point in points}
+
+def aggregate_usage(messages) -> dict:
+    """
+    Return accounting of stored messages per interview: numbers of sessions and turns,
+    totals per task and model, and percentiles of the latencies of tasks and turns.
+    Sessions begun before interviews were stored with their state are reported as 'unknown'.
+    """
+    sessions = defaultdict(set)
+    num_turns = defaultdict(int)
+    turns = defaultdict(list)
+    moderation = defaultdict(list)
+    tasks = defaultdict(dict)
+    latencies = defaultdict(lambda: defaultdict(list))
+    for message in messages:
+        interview_id = message.get('interview_id') or 'unknown'
+        sessions[interview_id].add(message.get('session_id'))
+        usage = message.get('usage')
+        if not usage:
+            continue
+        num_turns[interview_id] += int(usage.get('turns', 1))
+        turns[interview_id].append(int(usage.get('total_ms', 0)))
+        moderation[interview_id].append(int(usage.get('moderation_ms', 0)))
+        for task, entry in usage.get('tasks', {}).items():
+            key = f"{task} ({entry.get('model')})"
+            totals = tasks[interview_id].setdefault(key, dict.fromkeys(COUNTS[:-1], 0))
+            for count in COUNTS[:-1]:
+                totals[count] += int(entry.get(count, 0))
+            latencies[interview_id][key].append(int(entry.get('latency_ms', 0)))
+    return {
+        interview_id: {
+            'sessions': len(sessions[interview_id]),
+            'turns': num_turns[interview_id],
+            'turn_ms': percentiles(turns[interview_id]),
+            'moderation_ms': percentiles(moderation[interview_id]),
+            'tasks': {
+                key: {**totals, 'latency_ms': percentiles(latencies[interview_id][key])}
+                    for key, totals in tasks[interview_id].items()
+            }
+        } for interview_id in sessions
+    }
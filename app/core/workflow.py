@@ -0,0 +1,127 @@
+"""
+Decisions of the interview workflow, shared by the synchronous (`core.logic`) and the
+asynchronous (`core.async_logic`) request paths. They only read and change the state of
+the interview (`core.manager.InterviewManager`), without OpenAI requests or database
+operations, which the request paths perform (or await) in between.
+"""
+from core.context import InterviewContext
+from core.manager import InterviewManager
+from core.templates import InterviewTemplate
+import logging
+
+
+def next_step(interview:InterviewManager) -> str:
+    """
+    Determine next step in the interview workflow based on the topic guide:
+    'close' (closing questions), 'transition' (to next topic) or 'probe' (within topic).
+    """
+    parameters = interview.parameters
+
+    # Current topic guide
+    num_topics = len(parameters['interview_plan'])
+    current_topic_idx = interview.get_current_topic()
+    on_last_topic = current_topic_idx == num_topics
+    logging.info(f"On topic {current_topic_idx}/{num_topics}...")
+
+    # Current question within topic guide
+    current_question_idx = interview.get_current_topic_question()
+    num_questions = parameters['interview_plan'][current_topic_idx-1]['length']
+    on_last_question = current_question_idx >= num_questions
+    logging.info(f"On question {current_question_idx}/{num_questions}...")
+
+    if on_last_topic and on_last_question:
+        return 'close'
+    return 'transition' if on_last_question else 'probe'
+
+def response(interview:InterviewManager, message:str) -> dict:
+    """ Return response of the AI-interviewer with message. """
+    return {'session_id':interview.session_id, 'message':message}
+
+def streams_question(interview:InterviewManager, stream:bool) -> bool:
+    """ Whether to stream the next question: not if it is moderated, as no token may be sent before the whole question is reviewed. """
+    return stream and not interview.parameters.get('moderate_questions')
+
+def moderates_answers(interview:InterviewManager) -> bool:
+    return bool(interview.parameters.get('moderate_answers') and interview.parameters.get('moderator'))
+
+def moderates_questions(interview:InterviewManager) -> bool:
+    return bool(interview.parameters.get('moderate_questions'))
+
+def speculative_context(interview:InterviewManager, step:str, user_message:str) -> InterviewContext:
+    """
+    Return context of the next question including the answer, if it is to be generated while
+    the answer is being moderated (`speculative_generation`), otherwise None.
+    """
+    if interview.parameters.get('speculative_generation') and step != 'close':
+        return interview.context.preview(interview.preview_chat(user_message, type="answer"))
+    return None
+
+def unmoderated_answer(interview:InterviewManager, error:Exception) -> bool:
+    """ Return verdict on an answer that could not be moderated: rather accept it than fail the request. """
+    logging.warning(f"Answer of session '{interview.session_id}' not moderated: {error}")
+    return True
+
+def rejection(interview:InterviewManager, user_message:str, on_topic:bool) -> dict:
+    """
+    Return response rejecting the moderated answer, if the conversation has been flagged too often
+    (terminating the interview) or the answer does not fit the interview context (giving another
+    chance), otherwise None. Rejected answers are not added to the interview history.
+    """
+    if not on_topic:
+        interview.flag_risk(user_message)
+    if interview.flagged_too_often():
+        return response(interview, interview.parameters['flagged_message'])
+    if not on_topic:
+        return response(interview, interview.parameters['off_topic_message'])
+    return None
+
+def closing_question(interview:InterviewManager) -> str:
+    """ Return next pre-determined closing question, terminating the interview if none is left. """
+    question = interview.get_final_question()
+    interview.update_closing()
+    if not question:
+        # Exit condition: have already produced last "final" question
+        interview.terminate()
+    return question
+
+def fallback(interview:InterviewManager, template:InterviewTemplate, error:Exception, reason:str) -> tuple[str, str]:
+    """
+    Return the template's fallback question and its step, staying on topic such that a
+    transition is attempted again next turn, instead of a question which could not be
+    generated (or moderated) within the request budget.
+    """
+    logging.warning(f"Asking fallback question in session '{interview.session_id}', {reason}: {error}")
+    return template.fallback_question, 'probe'
+
+def unmoderated_question(interview:InterviewManager, template:InterviewTemplate, step:str, question:str, error:Exception) -> tuple[str, str]:
+    """ Return question and step instead of a question that could not be moderated: the (known safe) fallback question, unless closing. """
+    if step == 'close': # closing questions are pre-determined
+        return question, step
+    return fallback(interview, template, error, "question not moderated")
+
+def advance(interview:InterviewManager, step:str, flagged_question:bool=False):
+    """ Update state for the question of the step being asked, terminating the interview if the question was flagged. """
+    if flagged_question:
+        interview.terminate(reason="question_flagged")
+    if step == 'transition':
+        interview.update_transition()
+    elif step == 'probe':
+        interview.update_probe()
+
+def summarizes(interview:InterviewManager, step:str) -> bool:
+    """ Whether to summarize the interview until the new topic (off the critical path). """
+    return step == 'transition' and bool(interview.parameters.get('summarize'))
+
+def summary_context(interview:InterviewManager, order:int) -> tuple[int, InterviewContext]:
+    """
+    Return topic finished before the transition question at `order` and the context of its
+    summary (i.e. of the messages until then), or None if the interview has ended or the
+    topic has been summarized already.
+    """
+    history = interview.get_history()
+    position = next(i for i, message in enumerate(history) if int(message['order']) == int(order))
+    topic_idx = int(history[position - 1]['topic_idx']) # finished topic
+    if interview.is_terminated() or interview.get_summary(topic_idx):
+        logging.info(f"Session '{interview.session_id}' ended or topic {topic_idx} summarized, not summarizing")
+        return None
+    return topic_idx, InterviewContext(history[:position])
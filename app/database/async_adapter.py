@@ -0,0 +1,47 @@
+from core.context import InterviewContext
+from database.pagination import PAGE_SIZE
+import asyncio
+import logging
+
+
+class AsyncDatabase(object):
+    """
+    Awaitable adapter of the (blocking) database backends for the asynchronous
+    request path. Each call runs in the default thread pool of the event loop,
+    so slow reads and writes (e.g. to DynamoDB via boto3) never block the loop.
+
+    Args:
+        db: database manager, e.g. `DynamoDB` or `FileWriter`
+    """
+    def __init__(self, db):
+        self.db = db
+        logging.info(f"Asynchronous adapter for '{type(db).__name__}' database set up.")
+
+    async def load_remote_session(self, session_id:str) -> list:
+        return await asyncio.to_thread(self.db.load_remote_session, session_id)
+
+    def load_context(self, session_id:str, history:list):
+        """ Return context of the loaded history (not awaited, as it is read from memory), see `CachedDatabase.load_context`. """
+        load_context = getattr(self.db, 'load_context', None)
+        return load_context(session_id, history) if load_context else InterviewContext(history)
+
+    async def delete_remote_session(self, session_id:str):
+        await asyncio.to_thread(self.db.delete_remote_session, session_id)
+
+    async def update_remote_session(self, session_id:str, session:list):
+        await asyncio.to_thread(self.db.update_remote_session, session_id, session)
+
+    async def append_message(self, session_id:str, message:dict):
+        await asyncio.to_thread(self.db.append_message, session_id, message)
+
+    async def patch_last_state(self, session_id:str, state:dict):
+        await asyncio.to_thread(self.db.patch_last_state, session_id, state)
+
+    async def store_summary(self, session_id:str, topic_idx:int, summary:str):
+        await asyncio.to_thread(self.db.store_summary, session_id, topic_idx, summary)
+
+    async def retrieve_sessions(self, sessions:list=None) -> list:
+        return await asyncio.to_thread(self.db.retrieve_sessions, sessions)
+
+    async def retrieve_sessions_page(self, sessions:list=None, page_size:int=PAGE_SIZE, cursor:str=None) -> tuple[list, str]:
+        return await asyncio.to_thread(self.db.retrieve_sessions_page, sessions, page_size, cursor)
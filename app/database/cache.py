@@ -0,0 +1,158 @@
+from collections import OrderedDict
+from core.context import InterviewContext
+from database.summaries import merge_summaries
+from threading import Lock
+import logging
+import time
+
+
+def same_message(message:dict, other:dict) -> bool:
+    """ Whether both are the same message of a session, i.e. at the same order and version. """
+    return int(message['order']) == int(other['order']) and int(message.get('version', 0)) == int(other.get('version', 0))
+
+
+class LRUCache(object):
+    """
+    Thread-safe mapping which holds at most `max_size` entries, evicting the least 
+    recently used, and drops entries not written to for more than `ttl` seconds.
+    """
+    def __init__(self, max_size:int, ttl:float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()    # key: (time written, value)
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class CachedDatabase(object):
+    """
+    Wrapper of a database backend keeping recently used sessions in memory, such 
+    that resuming a session served by this process before skips the database read.
+
+    A cached session can be stale if another process has since written to it. 
+    This is detected when writing: each message carries the session `version`,
+    and backends only write if the stored session is at the preceding version,
+    otherwise raising `SessionConflictError`. The session is then evicted, 
+    such that it is loaded from the database again when the request is retried.
+    Summaries stored apart from the messages (see `store_summary`) do not change the
+    version, so those stored by other processes (e.g. an asynchronous invocation on
+    AWS Lambda) are only seen once the session is loaded from the database again.
+    The transcript context of each cached session (see `core.context.InterviewContext`)
+    is kept as well and extended by each written message, such that resuming the
+    session does not scan its whole history to fill prompts.
+
+    Args:
+        db: database manager, e.g. `DynamoDB` or `FileWriter`
+        max_sessions: (int) maximum number of cached sessions
+        ttl: (float) seconds after which a cached session is evicted
+    """
+    def __init__(self, db, max_sessions:int=256, ttl:float=600):
+        self.db = db
+        self.cache = LRUCache(max_sessions, ttl)
+        self.summaries = LRUCache(max_sessions, ttl)     # summaries stored by this process
+        self.contexts = LRUCache(max_sessions, ttl)      # context of the last message written or loaded
+        logging.info(f"Caching up to {max_sessions} sessions of '{type(db).__name__}' database.")
+
+    def __getattr__(self, name:str):
+        # Everything not cached, e.g. retrieving sessions, is read from the database
+        return getattr(self.db, name)
+
+    def load_remote_session(self, session_id:str) -> list:
+        """ Retrieve the interview session from the cache, else from the database. """
+        cached = self.cache.get(session_id)
+        if cached is not None:
+            logging.info(f"Session '{session_id}' loaded from cache.")
+            return merge_summaries([message.copy() for message in cached], self.summaries.get(session_id))
+        session = self.db.load_remote_session(session_id)
+        if session:
+            self.cache.put(session_id, tuple(message.copy() for message in session))
+        return session
+
+    def load_context(self, session_id:str, history:list) -> InterviewContext:
+        """
+        Return context of the loaded session history: a copy of the cached context if it is
+        at the history's last message (and version), else built from the history and cached.
+        """
+        context = self.contexts.get(session_id)
+        if context is not None and same_message(context.state, history[-1]):
+            context = context.copy()
+            context.update_state(history[-1]) # e.g. with summaries merged
+            return context
+        context = InterviewContext(history)
+        self.contexts.put(session_id, context.copy())
+        return context
+
+    def delete_remote_session(self, session_id:str):
+        self.cache.pop(session_id)
+        self.summaries.pop(session_id)
+        self.contexts.pop(session_id)
+        self.db.delete_remote_session(session_id)
+
+    def update_remote_session(self, session_id:str, session:list):
+        self.summaries.pop(session_id)
+        self.contexts.pop(session_id)
+        self._write(self.db.update_remote_session, session_id, session)
+        self.cache.put(session_id, tuple(message.copy() for message in session))
+
+    def append_message(self, session_id:str, message:dict):
+        self._write(self.db.append_message, session_id, message)
+        cached = self.cache.get(session_id)
+        if cached and cached[-1]['order'] == message['order'] - 1:
+            self.cache.put(session_id, cached + (message.copy(),))
+        else:
+            self.cache.pop(session_id)
+        context = self.contexts.get(session_id)
+        if context is not None and int(context.state['order']) == int(message['order']) - 1:
+            # Cached contexts are copied rather than changed, as other requests may be copying them
+            self.contexts.put(session_id, context.preview(message.copy()))
+        else:
+            self.contexts.pop(session_id)
+
+    def patch_last_state(self, session_id:str, state:dict):
+        self._write(self.db.patch_last_state, session_id, state)
+        cached = self.cache.get(session_id)
+        if cached and cached[-1]['order'] == state['order']:
+            self.cache.put(session_id, cached[:-1] + (state.copy(),))
+        else:
+            self.cache.pop(session_id)
+        context = self.contexts.get(session_id)
+        if context is not None and int(context.state['order']) == int(state['order']):
+            context = context.copy()
+            context.update_state(state.copy())
+            self.contexts.put(session_id, context)
+        else:
+            self.contexts.pop(session_id)
+
+    def store_summary(self, session_id:str, topic_idx:int, summary:str):
+        self.db.store_summary(session_id, topic_idx, summary)
+        self.summaries.put(session_id, {**(self.summaries.get(session_id) or {}), topic_idx: summary})
+
+    def _write(self, write, session_id:str, data):
+        """ Write to database, evicting the session if the write fails (e.g. a version conflict). """
+        try:
+            write(session_id, data)
+        except Exception:
+            self.cache.pop(session_id)
+            self.contexts.pop(session_id)
+            raise
@@ -1,22 +1,76 @@
 from boto3 import resource
+from boto3.dynamodb.conditions import Key
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from decimal import Decimal
+from database.pagination import PAGE_SIZE, encode_cursor, decode_cursor, iterate_pages
+from database.errors import SessionConflictError, expected_version
+from database.summaries import merge_summaries
 import logging 
+import time
 
+# Short timeouts and few retries, such that storage calls fit the budget of a request (see `core.deadline`)
+CONFIG = Config(connect_timeout=1, read_timeout=2, retries={'mode':'standard', 'max_attempts':2})
+
+# Retries of keys left unprocessed by a batch read (e.g. throttled), after a backoff doubling from 50 ms up to 2 seconds
+UNPROCESSED_RETRIES = 8
+UNPROCESSED_BACKOFF = 0.05
+MAX_BACKOFF = 2
+
+
+def from_dynamo(message:dict) -> dict:
+    """ Get JSON serializable message, i.e. without DynamoDB decimals (also nested, e.g. its usage). """
+    return dict(map(
+        lambda x: (x[0], int(x[1])) if isinstance(x[1], Decimal) \
+            else (x[0], from_dynamo(x[1])) if isinstance(x[1], dict) \
+            else x, message.items()
+    ))
+
+def version_condition(version:int) -> tuple[str, dict]:
+    """ Return condition (and its values) that item is at `version`, unversioned items being at 0. """
+    if version:
+        return "#version = :version", {':version':version}
+    return "attribute_not_exists(#version)", {}
+
+def is_conflict(error:ClientError) -> bool:
+    return error.response['Error']['Code'] in ['ConditionalCheckFailedException', 'TransactionCanceledException']
+
+def store_summary(table, key:dict, topic_idx:int, summary:str):
+    """
+    Set summary of topic in the map attribute `summaries` of an existing item (without changing
+    its version), which is added first, as attributes cannot be set in a missing map.
+    """
+    table.update_item(
+        Key=key,
+        UpdateExpression="SET #summaries = if_not_exists(#summaries, :empty)",
+        ConditionExpression="attribute_exists(session_id)",
+        ExpressionAttributeNames={'#summaries':'summaries'},
+        ExpressionAttributeValues={':empty':{}}
+    )
+    table.update_item(
+        Key=key,
+        UpdateExpression="SET #summaries.#topic = :summary",
+        ConditionExpression="attribute_exists(session_id)",
+        ExpressionAttributeNames={'#summaries':'summaries', '#topic':str(topic_idx)},
+        ExpressionAttributeValues={':summary':summary}
+    )
 
 class DynamoDB(object):
     def __init__(self, table_name:str) :
         """ 
-        Initialize the Dynamo database table.
+        Initialize the Dynamo database table. Summaries of topics are stored in the
+        session's item apart from its messages, such that they do not change its version.
         """
         logging.info(f"Setting up DynamoDB for table '{table_name}'")
-        self.table = resource('dynamodb').Table(table_name)
+        self.resource = resource('dynamodb', config=CONFIG)
+        self.table = self.resource.Table(table_name)
         logging.info("DynamoDB table connection established. Should happen only once!")
 
     def load_remote_session(self, session_id:str) -> list:
         """ Retrieve the interview session data from the database. """
         result = self.table.get_item(Key={'session_id':session_id})
         if result.get('Item'):
-            return result['Item']['session']
+            return merge_summaries(result['Item']['session'], result['Item'].get('summaries'))
         logging.warning(f"Can't load session '{session_id}': not started!")
         return {}
 
@@ -28,41 +82,291 @@ class DynamoDB(object):
     def update_remote_session(self, session_id:str, session:list):
         """ Update or insert session data in the database. """
         assert 'session_id' in session[-1] and session[-1]['session_id'] == session_id
-        self.table.put_item(Item={'session_id':session_id, 'session':session})
+        version = session[-1].get('version', 0)
+        self.table.put_item(Item={'session_id':session_id, 'session':session, 'version':version})
         logging.info(f"Session '{session_id}' updated!")
 
-    def retrieve_sessions(self, sessions:list=None) -> list:
+    def append_message(self, session_id:str, message:dict):
+        """ Append a single new message to the stored session (without rewriting it). """
+        assert message.get('session_id') == session_id
+        version = expected_version(message)
+        condition, values = version_condition(version)
+        try:
+            self.table.update_item(
+                Key={'session_id':session_id},
+                UpdateExpression="SET #session = list_append(if_not_exists(#session, :empty), :message), #version = :next",
+                ConditionExpression=condition,
+                ExpressionAttributeNames={'#session':'session', '#version':'version'},
+                ExpressionAttributeValues={':empty':[], ':message':[message], ':next':version + 1, **values}
+            )
+        except ClientError as e:
+            if is_conflict(e): raise SessionConflictError(session_id, version) from e
+            raise
+        logging.info(f"Session '{session_id}' appended message {message['order']}!")
+
+    def patch_last_state(self, session_id:str, state:dict):
+        """ Replace the last message (i.e. current state) of the stored session. """
+        assert state.get('session_id') == session_id
+        # Messages are stored in order, i.e. message `n` sits at list index `n-1`
+        index = int(state['order']) - 1
+        version = expected_version(state)
+        condition, values = version_condition(version)
+        try:
+            self.table.update_item(
+                Key={'session_id':session_id},
+                UpdateExpression=f"SET #session[{index}] = :state, #version = :next",
+                ConditionExpression=f"size(#session) = :length AND {condition}",
+                ExpressionAttributeNames={'#session':'session', '#version':'version'},
+                ExpressionAttributeValues={':state':state, ':length':index + 1, ':next':version + 1, **values}
+            )
+        except ClientError as e:
+            if is_conflict(e): raise SessionConflictError(session_id, version) from e
+            raise
+        logging.info(f"Session '{session_id}' patched message {state['order']}!")
+
+    def store_summary(self, session_id:str, topic_idx:int, summary:str):
+        """ Store summary of (finished) topic apart from the session's messages, i.e. without changing its version. """
+        store_summary(self.table, {'session_id':session_id}, topic_idx, summary)
+        logging.info(f"Session '{session_id}' stored summary of topic {topic_idx}!")
+
+    def batch_get_sessions(self, sessions:list) -> list:
+        """ Look up specified sessions directly (in batches of at most 100 keys), retrying unprocessed keys with backoff. """
+        items = []
+        for i in range(0, len(sessions), 100):
+            request = {self.table.name: {'Keys': [{'session_id':s} for s in sessions[i:i+100]]}}
+            for attempt in range(UNPROCESSED_RETRIES + 1):
+                if attempt:
+                    time.sleep(min(UNPROCESSED_BACKOFF * 2 ** (attempt - 1), MAX_BACKOFF))
+                resp = self.resource.batch_get_item(RequestItems=request)
+                items.extend(resp['Responses'].get(self.table.name, []))
+                # Retry keys not processed, e.g. due to throttling or the 16 MB response limit
+                request = resp.get('UnprocessedKeys')
+                if not request: break
+            else:
+                unprocessed = len(request[self.table.name]['Keys'])
+                raise RuntimeError(f"{unprocessed} sessions not retrieved after {UNPROCESSED_RETRIES} retries of unprocessed keys")
+        # Return in order of specified sessions
+        positions = {session_id: i for i, session_id in enumerate(sessions)}
+        items.sort(key=lambda item: positions[item['session_id']])
+        return items
+
+    def retrieve_sessions_page(self, sessions:list=None, page_size:int=PAGE_SIZE, cursor:str=None) -> tuple[list, str]:
         """ 
-        Retrieve chat history (list of dicts) for specified sessions
-        or *all* sessions if no sessions specified in optional argument.
+        Retrieve chat history (list of dicts) for one page of at most `page_size` specified
+        sessions or *all* sessions if no sessions specified in optional argument. 
+        Specified sessions are looked up directly instead of scanning the whole table.
 
         Returns
-            all_interview_chats: (list) of "long" form data, e.g.
+            messages: (list) of "long" form data, e.g.
                 [
                     {'session_id':101, 'time':0, 'role':'interviewer', 'message':'Hello', ... },
                     {'session_id':101, 'time':1, 'role':'respondent', 'message':'World', ... },
                     ...
                 ]
+            cursor: (str) continuation token for the next page, None if no pages remain
+        """
+        position = decode_cursor(cursor) or {}
+        if sessions:
+            offset = int(position.get('offset', 0))
+            items = self.batch_get_sessions(sessions[offset:offset+page_size])
+            next_position = {'offset':offset+page_size} if offset+page_size < len(sessions) else None
+        else:
+            kwargs = {'Limit':page_size}
+            if position: kwargs['ExclusiveStartKey'] = position
+            resp = self.table.scan(**kwargs)
+            items = resp.get('Items', [])
+            next_position = resp.get('LastEvaluatedKey')
+        # Get JSON serializable data of all messages in interview sessions
+        messages = [from_dynamo(message) for item in items for message in merge_summaries(item['session'], item.get('summaries'))]
+        return messages, encode_cursor(next_position)
+
+    def retrieve_sessions(self, sessions:list=None) -> list:
+        """ 
+        Retrieve chat history (list of dicts) for specified sessions
+        or *all* sessions if no sessions specified in optional argument.
+
+        Returns
+            all_interview_chats: (list) of "long" form data, see `retrieve_sessions_page`
+        """
+        all_interview_chats = [
+            message for page in iterate_pages(self.retrieve_sessions_page, sessions)
+                for message in page
+        ]
+        logging.info(f"Retrieved {len(all_interview_chats)} messages!")
+        return all_interview_chats
+
+
+class DynamoMessagesDB(object):
+    def __init__(self, table_name:str):
+        """ 
+        Initialize the Dynamo database table storing one item per message,
+        keyed by `session_id` (partition key) and `order` (sort key). Unlike
+        `DynamoDB`, sessions are not bound by the 400 KB item size limit.
+        Appending and patching are transactions which also check that
+        the message is (or follows) the last one at the expected version.
+        Summaries of topics are stored in the item of the first message,
+        which is no longer written once the interview is under way.
         """
-        all_interview_chats = []
+        logging.info(f"Setting up DynamoDB (message items) for table '{table_name}'")
+        self.table = resource('dynamodb', config=CONFIG).Table(table_name)
+        logging.info("DynamoDB table connection established. Should happen only once!")
+
+    def _query(self, session_id:str, **kwargs) -> list:
+        """ Return all items of session, handling paginated query results. """
+        items = []
         last_eval = None
         while True:
-            # Handle multiple chunks with contiguous scan
-            resp = self.table.scan(ExclusiveStartKey=last_eval) if last_eval else self.table.scan()
-            for item in resp.get('Items', []):
-                # Skip keys not specified
-                if sessions and not item['session_id'] in sessions: 
-                    continue
-                # Get JSON serializable data
-                session_messages = [dict(map(
-                    lambda x: (x[0], int(x[1])) if isinstance(x[1], Decimal) \
-                        else x, message.items()
-                )) for message in item['session']]
-                # Add all messages in current interview session
-                all_interview_chats.extend(session_messages)
-
+            if last_eval: kwargs['ExclusiveStartKey'] = last_eval
+            resp = self.table.query(KeyConditionExpression=Key('session_id').eq(session_id), **kwargs)
+            items.extend(resp.get('Items', []))
             if not resp.get('LastEvaluatedKey'): break
             last_eval = resp['LastEvaluatedKey']
+        return items
+
+    def _keys(self, session_id:str) -> list:
+        return self._query(
+            session_id, 
+            ProjectionExpression="session_id, #order",
+            ExpressionAttributeNames={'#order':'order'}
+        )
+
+    def _session(self, session_id:str) -> list:
+        """ Return messages of session (ordered), with the summaries stored in its first message set in its last. """
+        session = self._query(session_id)
+        return merge_summaries(session, session[0].pop('summaries', None)) if session else session
 
+    def load_remote_session(self, session_id:str) -> list:
+        """ Retrieve the interview session messages (ordered) from the database. """
+        session = self._session(session_id)
+        if session:
+            return session
+        logging.warning(f"Can't load session '{session_id}': not started!")
+        return {}
+
+    def load_last_state(self, session_id:str) -> dict:
+        """ Retrieve only the latest message (i.e. current state) of the session. """
+        resp = self.table.query(
+            KeyConditionExpression=Key('session_id').eq(session_id),
+            ScanIndexForward=False,
+            Limit=1
+        )
+        if resp.get('Items'):
+            return resp['Items'][0]
+        logging.warning(f"Can't load session '{session_id}': not started!")
+        return {}
+
+    def delete_remote_session(self, session_id:str):
+        """ Delete all session messages from the database. """
+        with self.table.batch_writer() as batch:
+            for key in self._keys(session_id):
+                batch.delete_item(Key=key)
+        logging.info(f"Session '{session_id}' deleted!")
+
+    def update_remote_session(self, session_id:str, session:list):
+        """ Update or insert (i.e. overwrite) session messages in the database. """
+        assert 'session_id' in session[-1] and session[-1]['session_id'] == session_id
+        orders = set(int(message['order']) for message in session)
+        with self.table.batch_writer(overwrite_by_pkeys=['session_id', 'order']) as batch:
+            for key in self._keys(session_id):
+                if int(key['order']) not in orders:
+                    batch.delete_item(Key=key)
+            for message in session:
+                batch.put_item(Item=message)
+        logging.info(f"Session '{session_id}' updated!")
+
+    def _transact_write(self, session_id:str, version:int, items:list):
+        """ Write (action, item) pairs as one transaction, i.e. all or none, else raise `SessionConflictError`. """
+        try:
+            self.table.meta.client.transact_write_items(TransactItems=[
+                {action: {'TableName':self.table.name, **item}} for action, item in items
+            ])
+        except ClientError as e:
+            if is_conflict(e): raise SessionConflictError(session_id, version) from e
+            raise
+
+    def _version_check(self, session_id:str, order:int, version:int) -> dict:
+        """ Condition that message `order` exists and is at `version`. """
+        condition, values = version_condition(version)
+        check = {
+            'Key': {'session_id':session_id, 'order':order},
+            'ConditionExpression': f"attribute_exists(session_id) AND {condition}",
+            'ExpressionAttributeNames': {'#version':'version'}
+        }
+        if values: check['ExpressionAttributeValues'] = values
+        return check
+
+    def append_message(self, session_id:str, message:dict):
+        """ Insert a single new message item, following the last message at the expected version. """
+        assert message.get('session_id') == session_id
+        order, version = int(message['order']), expected_version(message)
+        items = [('Put', {
+            'Item': message,
+            'ConditionExpression': "attribute_not_exists(session_id)"
+        })]
+        if order > 1:
+            items.append(('ConditionCheck', self._version_check(session_id, order - 1, version)))
+        self._transact_write(session_id, version, items)
+        logging.info(f"Session '{session_id}' appended message {message['order']}!")
+
+    def patch_last_state(self, session_id:str, state:dict):
+        """ Replace the last message (i.e. current state) item, if still last and at the expected version. """
+        assert state.get('session_id') == session_id
+        order, version = int(state['order']), expected_version(state)
+        check = self._version_check(session_id, order, version)
+        del check['Key']
+        self._transact_write(session_id, version, [
+            ('Put', {'Item': state, **check}),
+            ('ConditionCheck', {
+                'Key': {'session_id':session_id, 'order':order + 1},
+                'ConditionExpression': "attribute_not_exists(session_id)"
+            })
+        ])
+        logging.info(f"Session '{session_id}' patched message {state['order']}!")
+
+    def store_summary(self, session_id:str, topic_idx:int, summary:str):
+        """ Store summary of (finished) topic in the item of the first message, i.e. without changing the session's version. """
+        store_summary(self.table, {'session_id':session_id, 'order':1}, topic_idx, summary)
+        logging.info(f"Session '{session_id}' stored summary of topic {topic_idx}!")
+
+    def retrieve_sessions_page(self, sessions:list=None, page_size:int=PAGE_SIZE, cursor:str=None) -> tuple[list, str]:
+        """ 
+        Retrieve chat history (list of dicts) for one page of at most `page_size` specified
+        sessions, or at most `page_size` messages of *all* sessions if no sessions specified.
+        Specified sessions are queried directly rather than scanning the table. Stored
+        summaries are set in the last message of specified sessions, or else (scanning
+        messages rather than sessions) left in the `summaries` of their first message.
+
+        Returns
+            messages: (list) of "long" form data, ordered within each session
+            cursor: (str) continuation token for the next page, None if no pages remain
+        """
+        position = decode_cursor(cursor) or {}
+        if sessions:
+            offset = int(position.get('offset', 0))
+            items = [message for session_id in sessions[offset:offset+page_size] 
+                for message in self._session(session_id)]
+            next_position = {'offset':offset+page_size} if offset+page_size < len(sessions) else None
+        else:
+            kwargs = {'Limit':page_size}
+            if position: kwargs['ExclusiveStartKey'] = position
+            resp = self.table.scan(**kwargs)
+            items = resp.get('Items', [])
+            next_position = resp.get('LastEvaluatedKey')
+        return [from_dynamo(message) for message in items], encode_cursor(next_position)
+
+    def retrieve_sessions(self, sessions:list=None) -> list:
+        """ 
+        Retrieve chat history (list of dicts) for specified sessions
+        or *all* sessions if no sessions specified in optional argument.
+
+        Returns
+            all_interview_chats: (list) of "long" form data, ordered by session and message
+        """
+        all_interview_chats = [
+            message for page in iterate_pages(self.retrieve_sessions_page, sessions)
+                for message in page
+        ]
+        if not sessions:
+            all_interview_chats.sort(key=lambda x: (x['session_id'], x['order']))
         logging.info(f"Retrieved {len(all_interview_chats)} messages!")
         return all_interview_chats
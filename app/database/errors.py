@@ -0,0 +1,22 @@
+class SessionConflictError(Exception):
+    """
+    Raised if a (conditional) write finds the stored session at another version
+    than expected, i.e. the session has been changed by another request or process
+    since it was loaded. The written message is discarded.
+    """
+    def __init__(self, session_id:str, version:int):
+        super().__init__(f"Session '{session_id}' is not at expected version {version}!")
+        self.session_id = session_id
+        self.version = version
+
+
+class InvalidCursorError(ValueError):
+    """ Raised if a continuation token (cursor) of retrieved pages cannot be decoded, e.g. as it was altered. """
+    def __init__(self, cursor:str):
+        super().__init__(f"Invalid cursor '{cursor}' specified!")
+        self.cursor = cursor
+
+
+def expected_version(state:dict) -> int:
+    """ Return version the stored session must be at for `state` to be written. """
+    return int(state.get('version', 1)) - 1
@@ -1,41 +1,154 @@
+from database.pagination import PAGE_SIZE, encode_cursor, decode_cursor, iterate_pages
+from database.errors import SessionConflictError, expected_version
+from database.summaries import merge_summaries
+from threading import Lock
 import logging
 import os
 import json
+try:
+    import fcntl
+except ImportError: # e.g. on Windows, where writes are only serialized within the process
+    fcntl = None
 
 # By default, will save interview data to app/data
 DATA_DIR = os.getenv("DATA_DIR", "./app/data")
 
+# Bytes read at a time when looking for the last line of a log
+TAIL_BLOCK = 4096
+
 class FileWriter(object):
+    """
+    File 'database' storing each interview session as an append-only
+    JSON Lines log, i.e. one message (state) per line. Patching the last
+    state appends a line with the same `order`, which supersedes the prior
+    line when the session is loaded. Thus each write is O(1) in interview length.
+    Appending or patching is refused if the last line is not at the expected `version`,
+    which is read from the end of the log, under a lock of the file (`flock`) held across
+    the check and the write, such that processes (e.g. uWSGI workers) cannot interleave.
+    Summaries of topics are appended to a log of their own (`<session_id>.summaries`),
+    such that storing them does not change the session's version.
+    """
+    lock = Lock()   # serializes version check and write within the process
+
     def __init__(self) :
         if not os.path.isdir(DATA_DIR): os.makedirs(DATA_DIR)
         logging.info(f"Will write interviews to '{DATA_DIR}'.")
 
-    def load_remote_session(self, session_id:str) -> dict:
-        """ Retrieve the interview session data from the 'database'. """
-        filepath = os.path.join(DATA_DIR, f"{session_id}.json")
-        if not os.path.isfile(filepath):
-            logging.warning(f"Can't load session '{session_id}': not started!")
+    def _log_path(self, session_id:str) -> str:
+        return os.path.join(DATA_DIR, f"{session_id}.jsonl")
+
+    def _legacy_path(self, session_id:str) -> str:
+        return os.path.join(DATA_DIR, f"{session_id}.json")
+
+    def _summaries_path(self, session_id:str) -> str:
+        return os.path.join(DATA_DIR, f"{session_id}.summaries")
+
+    def _read_summaries(self, session_id:str) -> dict:
+        """ Return stored summaries of session (topic index: summary), later lines replacing earlier ones. """
+        if not os.path.isfile(self._summaries_path(session_id)):
             return {}
+        summaries = {}
+        with open(self._summaries_path(session_id), 'r') as f:
+            for line in f:
+                if not line.strip(): continue
+                entry = json.loads(line)
+                summaries[entry['topic_idx']] = entry['summary']
+        return summaries
+
+    def _read_log(self, filepath:str) -> list:
+        """ Replay log such that later lines replace earlier ones of same `order`. """
+        messages = {}
         with open(filepath, 'r') as f:
-            session = json.load(f) 
-        return session
+            for line in f:
+                if not line.strip(): continue
+                message = json.loads(line)
+                messages[message['order']] = message
+        return list(messages.values())
+
+    def _read_session(self, session_file:str) -> list:
+        filepath = os.path.join(DATA_DIR, session_file)
+        if session_file.endswith('.jsonl'):
+            return self._read_log(filepath)
+        with open(filepath, 'r') as f:
+            return json.load(f)
+
+    def _migrate_legacy(self, session_id:str):
+        """ Convert session stored as single JSON document into a log. """
+        if os.path.isfile(self._legacy_path(session_id)):
+            with open(self._legacy_path(session_id), 'r') as f:
+                session = json.load(f)
+            self.update_remote_session(session_id, session)
+
+    def _last_line(self, f) -> bytes:
+        """ Return last non-empty line of log opened in binary mode, reading backwards from its end. """
+        position = f.seek(0, os.SEEK_END)
+        tail = b""
+        while position > 0:
+            step = min(TAIL_BLOCK, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+            if b"\n" in tail.rstrip():
+                return tail.rstrip().rsplit(b"\n", 1)[1]
+        return tail.strip()
+
+    def _append_lines(self, session_id:str, messages:list):
+        self._migrate_legacy(session_id)
+        version = expected_version(messages[0])
+        with self.lock, open(self._log_path(session_id), 'a+b') as f:
+            if fcntl: fcntl.flock(f, fcntl.LOCK_EX) # released when the file is closed
+            last = self._last_line(f)
+            if last and int(json.loads(last).get('version', 0)) != version:
+                raise SessionConflictError(session_id, version)
+            f.write("".join(json.dumps(message) + "\n" for message in messages).encode())
+
+    def load_remote_session(self, session_id:str) -> dict:
+        """ Retrieve the interview session data from the 'database'. """
+        if os.path.isfile(self._log_path(session_id)):
+            return merge_summaries(self._read_log(self._log_path(session_id)), self._read_summaries(session_id))
+        if os.path.isfile(self._legacy_path(session_id)):
+            return merge_summaries(self._read_session(f"{session_id}.json"), self._read_summaries(session_id))
+        logging.warning(f"Can't load session '{session_id}': not started!")
+        return {}
 
     def delete_remote_session(self, session_id:str):
         """ Delete session data from the 'database'. """
-        os.remove(os.path.join(DATA_DIR, f"{session_id}.json"))
+        for filepath in [self._log_path(session_id), self._legacy_path(session_id), self._summaries_path(session_id)]:
+            if os.path.isfile(filepath): os.remove(filepath)
         logging.info(f"Session '{session_id}' deleted!")
 
     def update_remote_session(self, session_id:str, session:list):
-        """ Update or insert session data in the 'database'. """
+        """ Update or insert (i.e. overwrite) session data in the 'database'. """
         assert 'session_id' in session[-1] and session[-1]['session_id'] == session_id
-        with open(os.path.join(DATA_DIR, f"{session_id}.json"), 'w') as f:
-            json.dump(session, f)
+        with open(self._log_path(session_id), 'w') as f:
+            f.write("".join(json.dumps(message) + "\n" for message in session))
+        for filepath in [self._legacy_path(session_id), self._summaries_path(session_id)]:
+            if os.path.isfile(filepath): os.remove(filepath)
         logging.info(f"Session '{session_id}' updated!")
 
-    def retrieve_sessions(self, sessions:list=None) -> list:
-        """ 
-        Retrieve chat history (list of dicts) for specified sessions
-        or *all* sessions if no sessions specified in optional argument.
+    def append_message(self, session_id:str, message:dict):
+        """ Append a single new message to the session log. """
+        assert message.get('session_id') == session_id
+        self._append_lines(session_id, [message])
+        logging.info(f"Session '{session_id}' appended message {message['order']}!")
+
+    def patch_last_state(self, session_id:str, state:dict):
+        """ Replace the last message (i.e. current state) of the session log. """
+        assert state.get('session_id') == session_id
+        self._append_lines(session_id, [state])
+        logging.info(f"Session '{session_id}' patched message {state['order']}!")
+
+    def store_summary(self, session_id:str, topic_idx:int, summary:str):
+        """ Store summary of (finished) topic apart from the session log, i.e. without changing its version. """
+        with self.lock, open(self._summaries_path(session_id), 'a') as f:
+            if fcntl: fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(json.dumps({'topic_idx':topic_idx, 'summary':summary}) + "\n")
+        logging.info(f"Session '{session_id}' stored summary of topic {topic_idx}!")
+
+    def retrieve_sessions_page(self, sessions:list=None, page_size:int=PAGE_SIZE, cursor:str=None) -> tuple[list, str]:
+        """
+        Retrieve chat history (list of dicts) for one page of at most `page_size` specified
+        sessions or *all* sessions if no sessions specified in optional argument.
 
         Returns
             chats: (list) of "long" form data with one session-message per row, e.g.
@@ -44,16 +157,33 @@ class FileWriter(object):
                     {'session_id':101, 'time':1, 'role':'respondent', 'message':'World', ...}
                     ...
                 ]
+            cursor: (str) continuation token for the next page, None if no pages remain
         """
+        session_files = [
+            session_file for session_file in sorted(os.listdir(DATA_DIR))
+                if session_file.endswith(('.json', '.jsonl')) and \
+                    (not sessions or os.path.splitext(session_file)[0] in sessions)
+        ]
+        offset = int((decode_cursor(cursor) or {}).get('offset', 0))
         chats = []
-        for session_file in os.listdir(DATA_DIR):
-            if not session_file.endswith('.json'): continue
-            if sessions and not os.splitext(session_file)[0] in sessions: continue
-            filepath = os.path.join(DATA_DIR, session_file)
-            with open(filepath, 'r') as f:
-                session = json.load(f) 
+        for session_file in session_files[offset:offset+page_size]:
             # Add all messages in current interview session
-            chats.extend(session)
+            session_id = os.path.splitext(session_file)[0]
+            chats.extend(merge_summaries(self._read_session(session_file), self._read_summaries(session_id)))
+        next_position = {'offset':offset+page_size} if offset+page_size < len(session_files) else None
+        return chats, encode_cursor(next_position)
 
+    def retrieve_sessions(self, sessions:list=None) -> list:
+        """
+        Retrieve chat history (list of dicts) for specified sessions
+        or *all* sessions if no sessions specified in optional argument.
+
+        Returns
+            chats: (list) of "long" form data with one session-message per row, see `retrieve_sessions_page`
+        """
+        chats = [
+            message for page in iterate_pages(self.retrieve_sessions_page, sessions)
+                for message in page
+        ]
         logging.info(f"Retrieved {len(chats)} messages!")
         return chats
@@ -0,0 +1,34 @@
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from decimal import Decimal
+from database.errors import InvalidCursorError
+import json
+
+# Default number of sessions (or DynamoDB items) per page of retrieved data
+PAGE_SIZE = 25
+
+def encode_cursor(position:dict) -> str:
+    """ Encode position in database (e.g. `LastEvaluatedKey`) as opaque continuation token. """
+    if not position:
+        return None
+    data = json.dumps(position, default=lambda x: int(x) if isinstance(x, Decimal) else str(x))
+    return urlsafe_b64encode(data.encode()).decode()
+
+def decode_cursor(cursor:str) -> dict:
+    """ Decode continuation token into position in database, raising `InvalidCursorError` if it is not one. """
+    if not cursor:
+        return None
+    try:
+        # Numbers as decimals, as expected for DynamoDB keys
+        position = json.loads(urlsafe_b64decode(str(cursor).encode()), parse_int=Decimal)
+    except ValueError as e:
+        raise InvalidCursorError(cursor) from e
+    if not isinstance(position, dict):
+        raise InvalidCursorError(cursor)
+    return position
+
+def iterate_pages(retrieve_page, sessions:list=None, page_size:int=PAGE_SIZE, cursor:str=None):
+    """ Yield pages (lists of messages) following the continuation tokens until exhausted. """
+    while True:
+        messages, cursor = retrieve_page(sessions, page_size, cursor)
+        yield messages
+        if not cursor: break
@@ -0,0 +1,17 @@
+def merge_summaries(session:list, summaries:dict) -> list:
+    """
+    Return session with the summaries stored apart from its messages (topic index: summary)
+    set in its last state, i.e. the current state, unless it has a summary of the topic
+    already. Topics not summarized (yet) have empty summaries.
+    """
+    if not session or not summaries:
+        return session
+    state = dict(session[-1])
+    merged = state.get('summary') or []
+    merged = list(merged) if isinstance(merged, list) else []
+    for topic_idx, summary in summaries.items():
+        topic_idx = int(topic_idx)
+        merged += [''] * (topic_idx - len(merged))
+        merged[topic_idx - 1] = merged[topic_idx - 1] or summary
+    state['summary'] = merged
+    return list(session[:-1]) + [state]
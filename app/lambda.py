@@ -2,11 +2,17 @@
 You can delete this file if you are deploying the AI interviewer application on your own dedicated server."""
 
 import json
+from core.deadline import Deadline, REQUEST_BUDGET
 from core.logic import (
     next_question, 
+    summarize_session,
     retrieve_sessions, 
+    retrieve_sessions_page,
+    usage_report,
     transcribe
 )
+from database.errors import InvalidCursorError
+from database.pagination import decode_cursor
 
 def handler(event, context):
     """This function processes requests to the AWS Lambda function for conducting AI-led interviewers.
@@ -22,6 +28,7 @@ def handler(event, context):
         https://u94z55rxvt.execute-api.eu-north-1.amazonaws.com/Prod/
 
     The lambda function has three main routes (next, transcribe, and retrieve) that can be accessed via POST requests.
+    It also invokes itself (asynchronously, not via the endpoint) to summarize interviews after responding.
 
     We describe each route below, including how they can be accessed programmatically. If you use our recommendation
     to integrate the AI interviewer into a Qualtrics survey, you can use the HTML and JavaScript code
@@ -63,7 +70,21 @@ def handler(event, context):
             ```
 
     TRANSCRIBE:
-        This route transcribes an audio file to text. The audio file must be in base64 string format.
+        This route transcribes an audio file to text. The recording is preferably sent as the raw request body
+        (Content-Type: audio/webm) with the route in the query string ("?route=transcribe"), which API Gateway
+        passes on base64-encoded (see `BinaryMediaTypes` in template.yaml), decoded chunk by chunk into a temporary file.
+        It may also be sent as base64 string in a JSON body. Long recordings can be transcribed in segments while
+        they are recorded, each given the end of the transcription of the preceding segment as "prompt"
+        (query string or payload), see the Qualtrics voice survey.
+
+        Example request via Python's requests package (raw recording):
+            ```
+            with open("recording.webm", "rb") as f:
+                response = requests.post(
+                    https://u94z55rxvt.execute-api.eu-north-1.amazonaws.com/Prod/?route=transcribe,
+                    data=f, headers={"Content-Type": "audio/webm"}
+                )
+            ```
 
         Example request via Python's requests package:
             ```
@@ -90,10 +111,21 @@ def handler(event, context):
                 contentType: 'application/json',
                 dataType: 'json'
             });
+            // Or, without base64 encoding, the recording (Blob) itself:
+            fetch('https://u94z55rxvt.execute-api.eu-north-1.amazonaws.com/Prod/?route=transcribe', {
+                method: 'POST',
+                body: audioBlob,
+                headers: {'Content-Type': 'audio/webm'}
+            });
             ```
 
     RETRIEVE:
         This route retrieves all stored interviews from the DynamoDB database.
+        Lambda responses are limited to 6 MB, so with many interviews you should retrieve them page by page:
+        add "page_size" (number of sessions per page) to the payload and pass the returned "cursor"
+        in the next request until it is null. Specific interviews can be requested with a list of "sessions".
+        With "format": "usage", the OpenAI tokens and latencies of the interviews are returned instead
+        (totals and percentiles per interview).
 
         Example request via Python's requests package:
             ```
@@ -102,6 +134,13 @@ def handler(event, context):
                 "payload": {}
             }
             response = requests.post(https://u94z55rxvt.execute-api.eu-north-1.amazonaws.com/Prod/, json=body)
+
+            body = {
+                "route": "retrieve",
+                "payload": {"page_size": 10, "cursor": None}
+            }
+            page = requests.post(https://u94z55rxvt.execute-api.eu-north-1.amazonaws.com/Prod/, json=body).json()
+            # page = {"messages": [...], "cursor": "<CONTINUATION_TOKEN>"}
             ```
             
         Example JavaScript request:
@@ -119,6 +158,11 @@ def handler(event, context):
             ```
     """
 
+    if 'summarize' in event:
+        # Asynchronous invocation by `core.logic.schedule_summary`
+        summarize_session(**event['summarize'])
+        return
+
     response = {
         "statusCode": 200, 
         "headers": {
@@ -128,20 +172,45 @@ def handler(event, context):
         },
     }
 
+    query = event.get('queryStringParameters') or {}
+    if event.get('isBase64Encoded') and query.get('route') == 'transcribe':
+        # Raw recording (binary media type), decoded by `transcribe` rather than parsed as JSON
+        response['body'] = json.dumps(transcribe(event['body'], prompt=query.get('prompt')))
+        return response
+
     request = json.loads(event.get('body', '{}'))
     payload = request.get('payload', {})
     if request.get('route') == 'transcribe':
-        response['body'] = json.dumps(transcribe(payload['audio']))
+        response['body'] = json.dumps(transcribe(payload['audio'], prompt=payload.get('prompt')))
     elif request.get('route') == 'next':
+        # Budget of the request: at most `REQUEST_BUDGET` seconds, and never beyond the Lambda timeout
+        budget = min(REQUEST_BUDGET, context.get_remaining_time_in_millis() / 1000) if context else REQUEST_BUDGET
         response['body'] = json.dumps(
             next_question(
                 payload['session_id'], 
                 payload['interview_id'], 
-                payload.get('user_message')
+                payload.get('user_message'),
+                deadline=Deadline(budget)
             )
         )
     elif request.get('route') == 'retrieve':
-        response['body'] = json.dumps(retrieve_sessions())
+        try:
+            decode_cursor(payload.get('cursor'))
+        except InvalidCursorError as e:
+            # Invalid continuation token of the client, rather than a failure
+            response['statusCode'] = 400
+            response['body'] = json.dumps({'message': str(e)})
+            return response
+        if payload.get('format') == 'usage':
+            response['body'] = json.dumps(usage_report(payload.get('sessions')))
+        elif payload.get('page_size') or payload.get('cursor'):
+            response['body'] = json.dumps(retrieve_sessions_page(
+                payload.get('sessions'), 
+                payload.get('page_size'), 
+                payload.get('cursor')
+            ))
+        else:
+            response['body'] = json.dumps(retrieve_sessions(payload.get('sessions')))
     else:
         raise ValueError("Invalid request. Please try again.")
 
@@ -30,7 +30,21 @@ We describe all parameters that should be included in a parameter set below:
 - summarize (book): 				whether to active the summarization agent for the interview (default: True)
 - moderate_answers (bool): 			Whether the moderator agent should review answers from the interviewee and potentially flag them (default: True)
 - moderate_questions (bool): 		whether AI-generated interview questions should be reviewed with OpenAI's moderation endpoint
-									before sending them back to the interviewee (default: True)
+									before sending them back to the interviewee (default: True). Their tokens are then not streamed,
+									as questions are only sent once reviewed
+- speculative_generation (bool):	whether to generate the next interview question while the moderator agent reviews the answer,
+									rather than afterwards (default: False). This reduces waiting times for interviewees, but the
+									tokens of questions generated for answers that the moderator flags are wasted.
+- answer_prefilter (bool/dict):		whether to accept obviously on-topic answers without asking the moderator agent (default: False),
+									i.e. non-answers like "I don't know" and long answers sharing words with the question or current topic.
+									Other answers are still reviewed by the moderator agent. Optionally a dictionary of thresholds
+									(min_words, min_shared, min_overlap), see app/core/prefilter.py. Evaluate the thresholds on
+									stored interviews with benchmarks/prefilter_eval.py.
+- cache_friendly_prompts (bool):	whether to send the prompt of each agent as a system message that is identical for all sessions
+									of the interview (its instructions and the interview plan, referring to the other placeholders),
+									followed by a message with the current inputs (default: False). OpenAI caches identical prompt
+									prefixes of at least 1024 tokens, reducing the latency and cost of completions. Check the
+									cacheable prefixes offline with benchmarks/prefix_cache_check.py.
 
 
 2) INTERVIEW STRUCTURE and PRE-DETERMINED MESSAGES: The following parameters define the structure of the interview and
@@ -58,6 +72,8 @@ The first_question and the interview_plan variable are the most critical paramet
 - flagged_message (str): 			Message to display to interviewees if their response has been flagged too often by the
 									moderator agent (and the interview was terminated)
 - max_flags_allowed (int): 			The maximum number of flagged messages allowed before an interview is terminated (default: 3)
+- fallback_question (str): 			Question asked if no question could be generated within the time budget of the request
+									(default: "Thank you. Could you tell me a bit more about that?"), see `REQUEST_BUDGET` in the README.
 
 
 
@@ -82,6 +98,12 @@ Each of the above dictionaries should specify the following set of parameters:
 	- max_tokens (int): the maximum number of completion tokens the agent can generate in its response (default: 1000)
 	- temperature (float): the temperature parameter for the LLM (default: 0.9)
 	- model (str): the model to use for the agent (default: gpt-4o)
+	- hedge_percentile (float): optional, send a second request if a completion has not returned after this percentile (e.g. 95)
+	  of the agent's recent response times, and use whichever response arrives first (streamed questions are not hedged)
+	- hedge_model (str): optional, the model of the second request, e.g. a faster "gpt-4o-mini" (default: same model)
+	- hedge_delay (float): seconds after which to send the second request until enough response times are observed (default: 2)
+	- max_prompt_tokens (int): optional, the maximum number of prompt tokens; longer prompts leave out the oldest messages of the
+	  transcripts filled in ({summary}, {current_topic_history}) but always keep the last question and answer
 
 3. DETAILS ABOUT THE PROMPTS:
 The prompts for the AI agent include placeholder variables that are programmatically replaced based on the current state of the interview.
@@ -97,9 +119,10 @@ at the specified place in the prompt)):
  - {summary}: 				Summary of the interview up to the current interview topic (see *interview_plan* variable).
 			  				Example: If the interview is currently in topic 3 of the *interview_plan*, then {summary} would cover topics 1 and 2.
 							The messages for topic 3 would be included in full via the {current_topic_history} placeholder.
-							If summarization has been turned off, then {summary} would contain the full conversation on topics 1 and 2
-							in the same format as {current_topic_history}.
-							This placeholder is used by all agents (except moderator).
+							Each topic is summarized once, when it has ended, and {summary} joins the summaries of the topics.
+							If summarization has been turned off (or a topic has not been summarized yet), then {summary} would
+							contain the full conversation on (those of) topics 1 and 2 in the same format as {current_topic_history}.
+							This placeholder is used by all agents (except moderator and summary agent).
  - {topics}:  				The list of all topic descriptions from the interview_plan variable
  							(e.g. all values of "topic" from the interview_plan variable)
 							This placeholder is used by the summary agent to provide an overview of the interview structure.
@@ -111,6 +134,9 @@ at the specified place in the prompt)):
 							This placeholder is typically used only by the transition agent to inform the agent
 							about the next topic it should transition to.
 
+The parameter sets are checked when the application starts (see app/core/templates.py): prompts with other placeholders,
+or missing messages and agents, stop the application with an error rather than failing during an interview.
+
 See our paper for more details about how the individual parts of the AI interviewer application work.
 """
 
@@ -130,6 +156,9 @@ INTERVIEW_PARAMETERS = {
 		# OPTIONAL FEATURES:
 		"moderate_answers": True,
 		"moderate_questions": True,
+		"speculative_generation": False,
+		"answer_prefilter": False,
+		"cache_friendly_prompts": False,
 		"summarize": True,
 		"max_flags_allowed": 3,
 		# INTERVIEW STRUCTURE:
@@ -170,26 +199,23 @@ INTERVIEW_PARAMETERS = {
 				A. Interview Plan:
 				{topics}
 
-				B. Previous Conversation Summary:
-				{summary}
-
-				C. Current Topic:
+				B. Current Topic:
 				{current_topic}
 
-				D. Current Conversation:
+				C. Current Conversation:
 				{current_topic_history}
 
-				TASK: Maintain an ongoing conversation summary that highlights key points and recurring themes. The goal is to ensure that future interviewers can continue exploring the reasons for non-participation without having to read the full interview transcripts.
+				TASK: Summarize the Current Conversation on the Current Topic, highlighting key points and recurring themes. The summaries of all topics are given to future interviewers, so that they can continue exploring the reasons for non-participation without having to read the full interview transcripts.
 
 				GUIDELINES:
 				1. Relevance: Prioritize and represent information based on their relevance and significance to understanding the interviewee's reasons for not investing in the stock market.
-				2. Update the summary: Integrate the Current Conversation into the Previous Conversation Summary, ensuring a coherent and updated overview. Avoid adding redundant information.
-				3. Structure: Your summary should follow the interview's chronology, starting with the first topic. Allocate space in the summary based on relevance for the research objective, not just its recency.
+				2. Scope: Only summarize the Current Conversation. Use the Interview Plan to place it within the interview, but do not anticipate other topics.
+				3. Structure: Your summary should follow the chronology of the Current Conversation. Allocate space in the summary based on relevance for the research objective, not just its recency.
 				4. Neutrality: Stay true to the interviewee's responses without adding your own interpretations of inferences.
 				5. Sensitive topics: Document notable emotional responses or discomfort, so subsequent interviewers are aware of sensitive areas.
 				6. Reasons: Keep an up-to-date overview of the interviewee's reasons for non-participation.
 
-				YOUR RESPONSE: Your summary should be a succinct yet comprehensive account of the full interview, allowing other interviewers to continue the conversation.
+				YOUR RESPONSE: Your summary should be a succinct yet comprehensive account of the Current Conversation, allowing other interviewers to continue the conversation.
 			""",
 			"max_tokens": 1000,
 			"model": "gpt-4o"
@@ -279,6 +305,9 @@ INTERVIEW_PARAMETERS = {
 		# OPTIONAL FEATURES:
 		"moderate_answers": True,
 		"moderate_questions": True,
+		"speculative_generation": False,
+		"answer_prefilter": False,
+		"cache_friendly_prompts": False,
 		"summarize": True,
 		"max_flags_allowed": 3,
 		# INTERVIEW STRUCTURE:
@@ -11,19 +11,23 @@ echo
 
 BUCKET_NAME=${1:-${S3_BUCKET}}
 TABLE_NAME=${DYNAMO_TABLE:-'interview-sessions'}
+DATABASE=${DATABASE:-'DYNAMODB'}
 
 if [ -z "$BUCKET_NAME" ]
 then
     echo "Error: S3_BUCKET cannot be empty and must match that used during setup!"; echo; exit
 fi
 
+echo; echo "Caching tokenizer encodings to count prompt tokens offline..."
+(cd app && TIKTOKEN_CACHE_DIR=tiktoken_cache python -c "from core.tokens import cache_encodings; cache_encodings()")
+
 echo; echo "Building application including local changes..."
 sam build --use-container 
 
 
 echo; echo "Deploying to cloud using provided S3 bucket and Dynamo table..." 
 sam deploy \
-	--parameter-overrides TableName=$TABLE_NAME \
+	--parameter-overrides TableName=$TABLE_NAME Database=$DATABASE ${RESULT_CACHE_TABLE:+ResultCacheTable=$RESULT_CACHE_TABLE} \
 	--no-confirm-changeset \
 	--no-fail-on-empty-changeset \
 	--s3-bucket $BUCKET_NAME
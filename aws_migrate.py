@@ -0,0 +1,57 @@
+from boto3 import resource
+from argparse import ArgumentParser
+
+def create_messages_table(table_name:str):
+    """ Create DynamoDB table with one item per message, keyed by `session_id` and `order`. """
+    table = resource('dynamodb').create_table(
+        TableName=table_name,
+        AttributeDefinitions=[
+            {'AttributeName':'session_id', 'AttributeType':'S'},
+            {'AttributeName':'order', 'AttributeType':'N'}
+        ],
+        KeySchema=[
+            {'AttributeName':'session_id', 'KeyType':'HASH'},
+            {'AttributeName':'order', 'KeyType':'RANGE'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    table.wait_until_exists()
+    print(f"Created table '{table_name}'!")
+
+def migrate_sessions(source_table:str, target_table:str):
+    """
+    Copy all AI interviews stored as one item per session (`DATABASE=DYNAMODB`) into
+    a table storing one item per message (`DATABASE=DYNAMODB_MESSAGES`).
+    The source table is left untouched, so the migration can safely be re-run.
+    Arguments:
+    - source_table (str): Name of the DynamoDB table with one item per session.
+    - target_table (str): Name of the DynamoDB table with one item per message.
+    """
+    source = resource('dynamodb').Table(source_table)
+    target = resource('dynamodb').Table(target_table)
+    num_sessions, num_messages = 0, 0
+    last_eval = None
+    with target.batch_writer(overwrite_by_pkeys=['session_id', 'order']) as batch:
+        while True:
+            # Handle multiple chunks with contiguous scan
+            resp = source.scan(ExclusiveStartKey=last_eval) if last_eval else source.scan()
+            for item in resp.get('Items', []):
+                for message in item.get('session', []):
+                    batch.put_item(Item=message)
+                    num_messages += 1
+                num_sessions += 1
+            if not resp.get('LastEvaluatedKey'): break
+            last_eval = resp['LastEvaluatedKey']
+
+    print(f"{num_sessions} interview sessions ({num_messages} messages) migrated!")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('--source_table', type=str, help="Name of DynamoDB table with one item per session")
+    parser.add_argument('--target_table', type=str, help="Name of DynamoDB table with one item per message")
+    parser.add_argument('--create_table', action='store_true', help="Create the target table first")
+    args = parser.parse_args()
+    if args.create_table:
+        create_messages_table(args.target_table)
+    migrate_sessions(args.source_table, args.target_table)
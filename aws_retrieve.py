@@ -1,47 +1,153 @@
-from boto3 import resource
+from boto3.session import Session
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from csv import DictWriter
+from decimal import Decimal
+from queue import Full, Queue
+from tempfile import TemporaryFile
+from threading import Event
+import json
+import os
+import sys
+import time
 
-def retrieve_all_sessions(table_name:str, output_path:str, print_chats:bool=False):
-    """ 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+from core.usage import aggregate_usage
+from database.summaries import merge_summaries
+
+def jsonable(value):
+    """ Convert DynamoDB decimals into JSON serializable numbers. """
+    if isinstance(value, Decimal):
+        return int(value) if value == int(value) else float(value)
+    raise TypeError(f"Cannot serialize {type(value)}")
+
+# Seconds a segment waits for room on the queue of pages before checking whether the export has stopped
+PUT_TIMEOUT = 1
+
+def put_page(pages:Queue, page, stop:Event) -> bool:
+    """ Put page on the queue once there is room, unless the export stops meanwhile (returning False). """
+    while not stop.is_set():
+        try:
+            pages.put(page, timeout=PUT_TIMEOUT)
+            return True
+        except Full:
+            pass
+    return False
+
+def page_messages(items:list) -> list:
+    """ Return messages of the scanned items, with the summaries stored apart from the messages of session items set in their last state. """
+    return [message for item in items for message in (merge_summaries(item['session'], item.get('summaries')) if 'session' in item else [item])]
+
+def scan_segment(table_name:str, segment:int, total_segments:int, pages:Queue, stop:Event):
+    """
+    Scan one segment of the DynamoDB table, putting the messages of each page on the queue until done or stopped.
+    Items either hold a whole session (`DATABASE=DYNAMODB`) or a single message (`DATABASE=DYNAMODB_MESSAGES`).
+    """
+    try:
+        # Boto3 resources are not thread-safe, so each worker gets its own
+        table = Session().resource('dynamodb').Table(table_name)
+        last_eval = None
+        while True:
+            kwargs = {'Segment':segment, 'TotalSegments':total_segments}
+            if last_eval: kwargs['ExclusiveStartKey'] = last_eval
+            resp = table.scan(**kwargs)
+            items = resp.get('Items', [])
+            if not put_page(pages, page_messages(items), stop): break
+            if not resp.get('LastEvaluatedKey'): break
+            last_eval = resp['LastEvaluatedKey']
+    finally:
+        # Signal that this segment is done (also if it failed)
+        put_page(pages, None, stop)
+
+def with_summaries(message:dict, summaries:dict, last_orders:dict) -> dict:
+    """ Return message with the summaries of its session set, if it is the session's last message. """
+    session_id = message['session_id']
+    if session_id in summaries and int(message['order']) == last_orders[session_id]:
+        return merge_summaries([message], summaries[session_id])[0]
+    return message
+
+def retrieve_all_sessions(table_name:str, output_path:str, print_chats:bool=False, segments:int=8, usage:bool=False):
+    """
     Retrieve all stored AI interviews from your AWS DynamoDB database and export them as a CSV file.
     The variables "session_id" and "order" uniquely identify each row.
+
+    The table is scanned in parallel segments and messages are streamed to a temporary file
+    as pages arrive, so memory does not grow with the table size. The CSV header is the union
+    of all message keys, hence the CSV is written from the temporary file once the scan is done.
+    Summaries stored in the first message of a session (`DATABASE=DYNAMODB_MESSAGES`) are then
+    set in its last message, which may be scanned by another segment.
+    If the export fails (or is interrupted), the segments are stopped rather than left waiting for the queue.
     Arguments:
     - table_name (str): Name of the DynamoDB table from which to retrieve the interviews.
     - output_path (str): Filepath to save the CSV file.
     - print_chats (bool): Whether to print each interview session to console.
+    - segments (int): Number of segments (and workers) of the parallel scan.
+    - usage (bool): Whether to print the OpenAI tokens and latencies per interview (totals and percentiles).
     """
-    # Retrieve interview sessions from DynamoDB
-    table = resource('dynamodb').Table(table_name)
-    all_interview_chats = []
-    last_eval = None
-    while True:
-        # Handle multiple chunks with contiguous scan
-        resp = table.scan(ExclusiveStartKey=last_eval) if last_eval else table.scan()
-        for item in resp.get('Items', []):
-            session_messages = item['session']
-            # Add all messages in current interview session
-            all_interview_chats.extend(session_messages)
-            if print_chats: # Print each session-message to console
-                for message in session_messages:
-                    print(message)
-        if not resp.get('LastEvaluatedKey'): break
-        last_eval = resp['LastEvaluatedKey']
-
-    print(f"{len(all_interview_chats)} interview sessions retrieved!")
-    if not all_interview_chats: return
-
-    # Save to specified CSV output filepath
-    with open(output_path, 'w') as csvfile:
-        writer = DictWriter(csvfile, fieldnames=all_interview_chats[0].keys())
-        writer.writeheader()
-        writer.writerows(all_interview_chats)
-    
+    fieldnames = {}     # ordered union of message keys
+    summaries = {}      # session: summaries stored in its first message
+    last_orders = {}    # session: order of its last message
+    num_messages = 0
+    start_time = last_report = time.time()
+    pages = Queue(maxsize=4 * segments)
+    stop = Event()
+    with TemporaryFile('w+') as spool, ThreadPoolExecutor(max_workers=segments) as executor:
+        futures = [
+            executor.submit(scan_segment, table_name, segment, segments, pages, stop)
+                for segment in range(segments)
+        ]
+        try:
+            remaining = segments
+            while remaining:
+                messages = pages.get()
+                if messages is None:
+                    remaining -= 1
+                    continue
+                for message in messages:
+                    session_summaries = message.pop('summaries', None)
+                    if session_summaries:
+                        summaries[message['session_id']] = session_summaries
+                    last_orders[message['session_id']] = max(int(message['order']), last_orders.get(message['session_id'], 0))
+                    fieldnames.update(dict.fromkeys(message))
+                    spool.write(json.dumps(message, default=jsonable) + "\n")
+                    if print_chats: # Print each session-message to console
+                        print(message)
+                num_messages += len(messages)
+                # Report progress and throughput
+                if time.time() - last_report > 5:
+                    last_report = time.time()
+                    print("{} messages retrieved ({:.0f} messages/second)...".format(
+                        num_messages,
+                        num_messages / (last_report - start_time)
+                    ))
+        except BaseException:
+            # Stop the segments, as the executor waits for them (e.g. if blocked on the full queue)
+            stop.set()
+            raise
+        # Raise errors of any segment
+        for future in futures: future.result()
+
+        print("{} messages retrieved in {:.1f} seconds!".format(num_messages, time.time() - start_time))
+        if not num_messages: return
+
+        # Save to specified CSV output filepath
+        spool.seek(0)
+        with open(output_path, 'w') as csvfile:
+            writer = DictWriter(csvfile, fieldnames=list(fieldnames))
+            writer.writeheader()
+            writer.writerows(with_summaries(json.loads(line), summaries, last_orders) for line in spool)
+
+        if usage:
+            spool.seek(0)
+            print(json.dumps(aggregate_usage(json.loads(line) for line in spool), indent=2))
+
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument('--table_name', type=str, help="Name of DynamoDBTable")
     parser.add_argument('--output_path', type=str, default="chats.csv", help="Filepath to chats CSV")
+    parser.add_argument('--segments', type=int, default=8, help="Number of parallel scan segments")
+    parser.add_argument('--usage', action='store_true', help="Print OpenAI tokens and latencies per interview")
     args = parser.parse_args()
-    retrieve_all_sessions(args.table_name, args.output_path)
-    
\ No newline at end of file
+    retrieve_all_sessions(args.table_name, args.output_path, segments=args.segments, usage=args.usage)
+
@@ -69,14 +69,43 @@ aws s3api put-bucket-lifecycle-configuration \
 
 # Create AWS DynamoDB table to store interviews. By default named 'interview-sessions', 
 # unless DYNAMO_TABLE is otherwise set as environment variable.
+# If DATABASE=DYNAMODB_MESSAGES is exported, each message is stored as its own item instead.
 TABLE_NAME=${DYNAMO_TABLE:-'interview-sessions'}
 echo; echo "Creating DynamoDB table '$TABLE_NAME' to store interview sessions"
-aws dynamodb create-table \
-	--table-name $TABLE_NAME \
-	--attribute-definitions AttributeName=session_id,AttributeType=S \
-	--key-schema AttributeName=session_id,KeyType=HASH \
-	--billing-mode PAY_PER_REQUEST \
-	--region $AWS_REGION
+if [ "$DATABASE" == "DYNAMODB_MESSAGES" ]
+then
+	aws dynamodb create-table \
+		--table-name $TABLE_NAME \
+		--attribute-definitions AttributeName=session_id,AttributeType=S AttributeName=order,AttributeType=N \
+		--key-schema AttributeName=session_id,KeyType=HASH AttributeName=order,KeyType=RANGE \
+		--billing-mode PAY_PER_REQUEST \
+		--region $AWS_REGION
+else
+	aws dynamodb create-table \
+		--table-name $TABLE_NAME \
+		--attribute-definitions AttributeName=session_id,AttributeType=S \
+		--key-schema AttributeName=session_id,KeyType=HASH \
+		--billing-mode PAY_PER_REQUEST \
+		--region $AWS_REGION
+fi
+
+# Optional: Create table caching results of retried requests (transcriptions, moderation) across instances,
+# if RESULT_CACHE_TABLE is exported (also before running aws_deploy.sh). Results expire by DynamoDB's time to live.
+if [ -n "$RESULT_CACHE_TABLE" ]
+then
+	echo; echo "Creating DynamoDB table '$RESULT_CACHE_TABLE' to cache results"
+	aws dynamodb create-table \
+		--table-name $RESULT_CACHE_TABLE \
+		--attribute-definitions AttributeName=key,AttributeType=S \
+		--key-schema AttributeName=key,KeyType=HASH \
+		--billing-mode PAY_PER_REQUEST \
+		--region $AWS_REGION
+	aws dynamodb wait table-exists --table-name $RESULT_CACHE_TABLE --region $AWS_REGION
+	aws dynamodb update-time-to-live \
+		--table-name $RESULT_CACHE_TABLE \
+		--time-to-live-specification "Enabled=true, AttributeName=expires" \
+		--region $AWS_REGION
+fi
 
 echo
 echo "----------------------------------- IMPORTANT NOTES: --------------------------------------"
@@ -0,0 +1,112 @@
+"""
+Microbenchmark of assembling the interview transcripts for the prompts of one turn:
+rebuilt with `chat_to_string` for every task (previous approach) versus
+taken from an `InterviewContext` built once or extended by the new message.
+Also checks that both approaches fill identical prompts.
+Run from the repository root, e.g.:
+    python benchmarks/context_benchmark.py --sizes 10 50 100 200
+"""
+from argparse import ArgumentParser
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from parameters import INTERVIEW_PARAMETERS
+from core.auxiliary import chat_to_string
+from core.context import InterviewContext
+from core.templates import PromptTemplate
+
+TASKS = ['moderator', 'summary', 'transition', 'probe']
+
+def synthetic_history(parameters:dict, num_messages:int) -> list:
+    """ Return interview history of alternating questions and answers spread over all topics. """
+    num_topics = len(parameters['interview_plan'])
+    history = []
+    for order in range(1, num_messages + 1):
+        message_type = 'question' if order % 2 else 'answer'
+        history.append({
+            'order': order,
+            'session_id': 'benchmark',
+            'topic_idx': 1 + (order - 1) * num_topics // num_messages,
+            'question_idx': 1,
+            'finish_idx': 1,
+            'flagged_messages': 0,
+            'terminated': False,
+            'summary': [],
+            'type': message_type,
+            'content': f"{message_type} {order}: " + "lorem ipsum dolor sit amet " * 8
+        })
+    return history
+
+def fill_from_history(template:str, topics:list, history:list, user_message:str=None) -> str:
+    """ Previous way of filling prompts, scanning the history for each prompt. """
+    state = history[-1]
+    current_topic_idx = min(int(state['topic_idx']), len(topics))
+    next_topic_idx = min(current_topic_idx + 1, len(topics))
+    return template.format(
+        topics='\n'.join([topic['topic'] for topic in topics]),
+        question=state["content"],
+        answer=user_message,
+        summary=state['summary'] or chat_to_string(history, until_topic=current_topic_idx),
+        current_topic=topics[current_topic_idx - 1]["topic"],
+        next_interview_topic=topics[next_topic_idx - 1]["topic"],
+        current_topic_history=chat_to_string(history, only_topic=current_topic_idx)
+    )
+
+def transcripts_from_history(history:list, topic:int) -> tuple[str, str]:
+    """ Transcripts of one prompt as previously assembled, i.e. scanning the history twice. """
+    return chat_to_string(history, only_topic=topic), chat_to_string(history, until_topic=topic)
+
+def transcripts_from_context(context:InterviewContext, topic:int) -> tuple[str, str]:
+    return context.topic_history(topic), context.history_until(topic)
+
+def benchmark(parameters:dict, num_messages:int, number:int) -> dict:
+    """ 
+    Return microseconds per turn of assembling the transcripts of all task prompts: 
+    scanning the history for each prompt, building the context from the history once,
+    or extending a context by the new message, as resuming a cached session does
+    (see `database.cache.CachedDatabase.load_context`).
+    """
+    history = synthetic_history(parameters, num_messages)
+    topics = parameters['interview_plan']
+    topic = min(int(history[-1]['topic_idx']), len(topics))
+
+    context = InterviewContext(history[:-1])
+    assert transcripts_from_context(context.preview(history[-1]), topic) == transcripts_from_history(history, topic)
+    for task in TASKS:
+        assert PromptTemplate(parameters[task], topics).render(InterviewContext(history), 'answer') == \
+            fill_from_history(parameters[task]['prompt'], topics, history, 'answer')
+
+    def scan_history():
+        for _ in TASKS:
+            transcripts_from_history(history, topic)
+
+    def build_context():
+        turn_context = InterviewContext(history)
+        for _ in TASKS:
+            transcripts_from_context(turn_context, topic)
+
+    def extend_context():
+        turn_context = context.preview(history[-1])
+        for _ in TASKS:
+            transcripts_from_context(turn_context, topic)
+
+    return {
+        name: 1e6 * min(timeit.repeat(func, number=number, repeat=5)) / number
+            for name, func in [('history', scan_history), ('context', build_context), ('incremental', extend_context)]
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('--interview_id', type=str, default='STOCK_MARKET', help="Key of interview parameters")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 25, 50, 100, 200], help="Numbers of messages in history")
+    parser.add_argument('--number', type=int, default=200, help="Turns per timing")
+    args = parser.parse_args()
+    parameters = INTERVIEW_PARAMETERS[args.interview_id]
+    print(f"Transcripts for {len(TASKS)} prompts per turn (microseconds per turn, best of 5):")
+    print(f"{'messages':>10}{'history':>12}{'context':>12}{'incremental':>14}")
+    for num_messages in args.sizes:
+        result = benchmark(parameters, num_messages, args.number)
+        print(f"{num_messages:>10}{result['history']:>12.1f}{result['context']:>12.1f}{result['incremental']:>14.1f}")
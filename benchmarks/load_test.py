@@ -0,0 +1,126 @@
+"""
+End-to-end load test of the interview workflow: synthetic respondents answer questions
+concurrently through `/next` until their interviews end, against a running app (e.g. the
+Flask app) or the Lambda handler in this process. Reports turns per second, percentiles
+of the turns' latencies as seen by respondents, and per stage (agent, question moderation)
+from the accounting stored with the sessions (see `app/core/usage.py`).
+Use with the offline OpenAI stand-in (`mock_openai.py`). Run from the repository root, e.g.:
+    python benchmarks/mock_openai.py --port 8001 &
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=mock python app/app.py &
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --respondents 50 --concurrency 20
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=mock python benchmarks/load_test.py --lambda
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+import importlib
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from core.usage import percentiles
+
+WORDS = "money risk savings bank fees trust family time retirement market crash news friends debt job house".split()
+
+POINTS = (50, 95, 99)
+
+
+class HTTPTarget(object):
+    """ App served at `url`, e.g. `app.py` or `asgi.py`. """
+    def __init__(self, url:str, timeout:float=60):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def post(self, route:str, payload:dict) -> dict:
+        request = Request(
+            f"{self.url}/{route}", data=json.dumps(payload).encode(),
+            headers={'Content-Type': "application/json"}, method="POST"
+        )
+        with urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+
+class LambdaTarget(object):
+    """ Handler of the AWS Lambda function (`lambda.py`), called in this process. """
+    def __init__(self):
+        self.handler = importlib.import_module('lambda').handler
+
+    def post(self, route:str, payload:dict) -> dict:
+        response = self.handler({'body': json.dumps({'route': route, 'payload': payload})}, None)
+        return json.loads(response['body'])
+
+
+def respondent(target, interview_id:str, session_id:str, max_turns:int, seed:int, think_time:float=0) -> list:
+    """
+    Return (seconds, succeeded) of each turn of a synthetic respondent's interview,
+    who answers after `think_time` seconds on average (exponentially distributed).
+    """
+    rng = random.Random(seed)
+    turns = []
+    user_message = None # first request begins the session
+    for _ in range(max_turns):
+        start = time.monotonic()
+        try:
+            response = target.post('next', {'session_id': session_id, 'interview_id': interview_id, 'user_message': user_message})
+        except Exception:
+            turns.append((time.monotonic() - start, False))
+            continue
+        turns.append((time.monotonic() - start, True))
+        if '---END---' in response.get('message', ''):
+            break
+        user_message = " ".join(rng.choices(WORDS, k=rng.randint(5, 80)))
+        if think_time:
+            time.sleep(rng.expovariate(1 / think_time))
+    return turns
+
+def load_test(target, interview_id:str, respondents:int, concurrency:int, max_turns:int, think_time:float=0) -> dict:
+    """ Return client-side results of the load test, and the server-side accounting of its sessions. """
+    run = uuid.uuid4().hex[:8]
+    sessions = [f"load-{run}-{i}" for i in range(respondents)]
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(
+            lambda i: respondent(target, interview_id, sessions[i], max_turns, i, think_time), range(respondents)
+        ))
+    duration = time.monotonic() - start
+    turns = [turn for result in results for turn in result]
+    usage = target.post('retrieve', {'format': 'usage', 'sessions': sessions}).get(interview_id, {})
+    return {
+        'duration': duration,
+        'turns': len(turns),
+        'errors': sum(not succeeded for _, succeeded in turns),
+        'turn_ms': percentiles([round(1000 * seconds) for seconds, succeeded in turns if succeeded], POINTS),
+        'usage': usage
+    }
+
+def report(result:dict):
+    print(f"{result['turns']} turns in {result['duration']:.1f} seconds: {result['turns'] / result['duration']:.1f} turns/second, {result['errors']} errors")
+    print(f"{'stage':>28}" + "".join(f"{f'p{point} (ms)':>12}" for point in POINTS))
+    stages = {'turn (respondent)': result['turn_ms']}
+    usage = result['usage']
+    if usage:
+        stages['turn (server)'] = usage.get('turn_ms', {})
+        stages['question moderation'] = usage.get('moderation_ms', {})
+        stages.update({task: entry['latency_ms'] for task, entry in usage.get('tasks', {}).items()})
+    for stage, values in stages.items():
+        print(f"{stage:>28}" + "".join(f"{values.get(f'p{point}', float('nan')):>12}" for point in POINTS))
+    for task, entry in usage.get('tasks', {}).items():
+        print(f"{task}: {entry['requests']} requests, {entry['prompt_tokens']} prompt and {entry['completion_tokens']} completion tokens")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('--url', type=str, default="http://127.0.0.1:8000", help="URL of the app")
+    parser.add_argument('--lambda', dest='use_lambda', action='store_true', help="Call the Lambda handler in this process instead")
+    parser.add_argument('--interview_id', type=str, default='STOCK_MARKET', help="Key of interview parameters")
+    parser.add_argument('--respondents', type=int, default=20, help="Number of synthetic respondents")
+    parser.add_argument('--concurrency', type=int, default=10, help="Number of respondents answering at the same time")
+    parser.add_argument('--max_turns', type=int, default=40, help="Maximum number of turns per respondent")
+    parser.add_argument('--think_time', type=float, default=0, help="Mean seconds respondents take to answer")
+    args = parser.parse_args()
+    target = LambdaTarget() if args.use_lambda else HTTPTarget(args.url)
+    report(load_test(target, args.interview_id, args.respondents, args.concurrency, args.max_turns, args.think_time))
@@ -0,0 +1,159 @@
+"""
+Offline stand-in for the OpenAI API endpoints used by `LLMAgent` (chat completions, also
+streamed, moderations and audio transcriptions), for load tests without cost or network
+(see `load_test.py`). Latencies are drawn from lognormal distributions around the given
+medians, and a share of requests can fail (HTTP 500), be rate limited (HTTP 429) or hang.
+Completions answer the moderator agent's question with "yes" and other prompts with a
+generic interview question. Run from the repository root, and point the app to it with
+`OPENAI_BASE_URL`, e.g.:
+    python benchmarks/mock_openai.py --port 8001 --chat_latency 0.8 --error_rate 0.01
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=mock python app/app.py
+"""
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import random
+import time
+import uuid
+
+QUESTIONS = [
+    "Could you tell me more about what makes you feel that way?",
+    "How did that experience shape your view of investing?",
+    "What would need to change for you to see this differently?",
+    "Why do you think that matters to you in particular?"
+]
+
+def estimate_tokens(text:str) -> int:
+    return math.ceil(len(text) / 4)
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    """ Requests to the mock API, configured by the `options` of its server. """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.options.verbose:
+            super().log_message(format, *args)
+
+    def delay(self, median:float) -> float:
+        """ Return latency drawn around median (seconds). """
+        return median * math.exp(random.gauss(0, self.server.options.sigma)) if median > 0 else 0
+
+    def send_json(self, status:int, body:dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def inject_failure(self) -> bool:
+        """ Fail, rate limit or hang (beyond the client's timeout) a share of requests. """
+        options = self.server.options
+        draw = random.random()
+        if draw < options.hang_rate:
+            time.sleep(options.hang_seconds)
+        elif draw < options.hang_rate + options.error_rate:
+            self.send_json(500, {'error': {'message': "Injected server error", 'type': "server_error"}})
+            return True
+        elif draw < options.hang_rate + options.error_rate + options.rate_limit_rate:
+            self.send_json(429, {'error': {'message': "Injected rate limit", 'type': "rate_limit_error"}})
+            return True
+        return False
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.inject_failure():
+            return
+        if self.path.endswith("/chat/completions"):
+            self.chat_completion(json.loads(body))
+        elif self.path.endswith("/moderations"):
+            self.moderation(json.loads(body))
+        elif self.path.endswith("/audio/transcriptions"):
+            time.sleep(self.delay(self.server.options.transcription_latency))
+            self.send_json(200, {'text': f"Transcription of {len(body)} bytes of audio."})
+        else:
+            self.send_json(404, {'error': {'message': f"Unknown endpoint '{self.path}'", 'type': "invalid_request_error"}})
+
+    def moderation(self, query:dict):
+        inputs = query['input'] if isinstance(query['input'], list) else [query['input']]
+        time.sleep(self.delay(self.server.options.moderation_latency))
+        self.send_json(200, {
+            'id': f"modr-{uuid.uuid4().hex}",
+            'model': query.get('model', "omni-moderation-latest"),
+            'results': [{'flagged': False, 'categories': {}, 'category_scores': {}} for _ in inputs]
+        })
+
+    def chat_completion(self, query:dict):
+        prompt = "\n".join(str(message.get('content')) for message in query['messages'])
+        text = "yes" if "'yes' or 'no'" in prompt else random.choice(QUESTIONS)
+        usage = {
+            'prompt_tokens': estimate_tokens(prompt),
+            'completion_tokens': estimate_tokens(text),
+            'total_tokens': estimate_tokens(prompt) + estimate_tokens(text)
+        }
+        latency = self.delay(self.server.options.chat_latency)
+        completion = {'id': f"chatcmpl-{uuid.uuid4().hex}", 'created': int(time.time()), 'model': query['model']}
+        if not query.get('stream'):
+            time.sleep(latency)
+            self.send_json(200, {
+                **completion,
+                'object': "chat.completion",
+                'choices': [{'index': 0, 'message': {'role': "assistant", 'content': text}, 'finish_reason': "stop"}],
+                'usage': usage
+            })
+            return
+        # Streamed: first token after a third of the latency, the others spread over the rest
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = text.split(" ")
+        time.sleep(latency / 3)
+        for i, word in enumerate(words):
+            delta = {'content': word if i == 0 else " " + word}
+            self.send_event({**completion, 'object': "chat.completion.chunk",
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]})
+            time.sleep(2 * latency / 3 / len(words))
+        self.send_event({**completion, 'object': "chat.completion.chunk",
+            'choices': [{'index': 0, 'delta': {}, 'finish_reason': "stop"}]})
+        if (query.get('stream_options') or {}).get('include_usage'):
+            self.send_event({**completion, 'object': "chat.completion.chunk", 'choices': [], 'usage': usage})
+        self.send_chunk(b"data: [DONE]\n\n")
+        self.send_chunk(b"")
+
+    def send_event(self, data:dict):
+        self.send_chunk(f"data: {json.dumps(data)}\n\n".encode())
+
+    def send_chunk(self, data:bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def serve(options):
+    server = ThreadingHTTPServer((options.host, options.port), MockOpenAIHandler)
+    server.daemon_threads = True
+    server.options = options
+    print(f"Mock OpenAI API at http://{options.host}:{options.port}/v1")
+    server.serve_forever()
+
+
+def parse_options(args:list=None):
+    parser = ArgumentParser()
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--chat_latency', type=float, default=0.8, help="Median seconds of chat completions")
+    parser.add_argument('--moderation_latency', type=float, default=0.2, help="Median seconds of moderations")
+    parser.add_argument('--transcription_latency', type=float, default=1.0, help="Median seconds of transcriptions")
+    parser.add_argument('--sigma', type=float, default=0.5, help="Spread of latencies (sigma of their logarithm)")
+    parser.add_argument('--error_rate', type=float, default=0, help="Share of requests failing with HTTP 500")
+    parser.add_argument('--rate_limit_rate', type=float, default=0, help="Share of requests failing with HTTP 429")
+    parser.add_argument('--hang_rate', type=float, default=0, help="Share of requests hanging for --hang_seconds")
+    parser.add_argument('--hang_seconds', type=float, default=60)
+    parser.add_argument('--verbose', action='store_true', help="Log each request")
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    serve(parse_options())
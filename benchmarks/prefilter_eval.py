@@ -0,0 +1,83 @@
+"""
+Offline evaluation of the local answer prefilter (see `app/core/prefilter.py`) over stored
+interviews: the share of answers it decides without the moderator agent (skip rate), and
+how often its decisions agree with the moderator agent. Stored answers were accepted by the
+moderator (if moderation was on), unless `--moderator` asks it again for each skipped answer.
+Run from the repository root, e.g. for local interviews in `app/data`, or a CSV export of
+`aws_retrieve.py`:
+    python benchmarks/prefilter_eval.py --interview_id STOCK_MARKET
+    python benchmarks/prefilter_eval.py --interview_id STOCK_MARKET --csv interviews.csv --moderator
+"""
+from argparse import ArgumentParser
+from itertools import groupby
+import csv
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from parameters import INTERVIEW_PARAMETERS
+from core.context import InterviewContext
+from core.prefilter import AnswerPrefilter
+from core.templates import InterviewTemplate
+
+def load_messages(csv_file:str=None) -> list:
+    """ Return stored messages from CSV export, or else from the configured database (see `core.logic`). """
+    if csv_file:
+        with open(csv_file, 'r') as f:
+            messages = [
+                {**row, 'order':int(float(row['order'])), 'topic_idx':int(float(row['topic_idx']))}
+                    for row in csv.DictReader(f)
+            ]
+    else:
+        from core.setup import connect_to_backend
+        messages = connect_to_backend().retrieve_sessions()
+    return sorted(messages, key=lambda message: (message['session_id'], int(message['order'])))
+
+def evaluate(template:InterviewTemplate, prefilter:AnswerPrefilter, messages:list, moderator:bool=False) -> dict:
+    """ Return counts of answers, answers decided by the prefilter, and decisions agreeing with the moderator. """
+    agent = None
+    if moderator:
+        from core.logic import agent
+    counts = {'answers':0, 'skipped':0, 'agreed':0}
+    disagreements = []
+    for _, session in groupby(messages, key=lambda message: message['session_id']):
+        history = list(session)
+        for i, message in enumerate(history):
+            if message['type'] != 'answer' or i == 0:
+                continue
+            counts['answers'] += 1
+            context = InterviewContext(history[:i])
+            decision = prefilter.review(context.state['content'], template.current_topic(context), message['content'])
+            if decision is None:
+                continue
+            counts['skipped'] += 1
+            on_topic = agent.review_answer(template, message['content'], context, prefilter=False) if agent else True
+            if decision == on_topic:
+                counts['agreed'] += 1
+            else:
+                disagreements.append(message['content'])
+    return {**counts, 'disagreements':disagreements}
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('--interview_id', type=str, required=True, help="Key of interview parameters of the stored interviews")
+    parser.add_argument('--csv', type=str, default=None, help="CSV export of interviews (default: configured database)")
+    parser.add_argument('--moderator', action='store_true', help="Ask the moderator agent about each answer decided by the prefilter")
+    parser.add_argument('--min_words', type=int, default=8)
+    parser.add_argument('--min_shared', type=int, default=2)
+    parser.add_argument('--min_overlap', type=float, default=0.1)
+    args = parser.parse_args()
+
+    template = InterviewTemplate(INTERVIEW_PARAMETERS[args.interview_id])
+    prefilter = AnswerPrefilter(args.min_words, args.min_shared, args.min_overlap)
+    messages = [message for message in load_messages(args.csv) if message.get('content') is not None]
+    result = evaluate(template, prefilter, messages, args.moderator)
+
+    skip_rate = result['skipped'] / max(result['answers'], 1)
+    print(f"{result['answers']} answers, {result['skipped']} decided by prefilter (skip rate {skip_rate:.1%})")
+    if result['skipped']:
+        agreement = result['agreed'] / result['skipped']
+        print(f"Agreement with moderator agent{'' if args.moderator else ' (stored decisions)'}: {agreement:.1%}")
+    for answer in result['disagreements']:
+        print(f"Disagreement: '{answer}'")
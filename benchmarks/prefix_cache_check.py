@@ -0,0 +1,83 @@
+"""
+Offline check of how much of each agent's prompt OpenAI's automatic prompt caching could reuse:
+the length of the byte-identical prefix of the messages built by `LLMAgent.construct_query`
+across sessions of an interview, with and without `cache_friendly_prompts` (see `parameters.py`).
+OpenAI caches identical prefixes of at least 1024 tokens (in increments of 128 tokens).
+Sessions are synthetic, at different topics and with different answers. No requests are sent.
+Run from the repository root, e.g.:
+    python benchmarks/prefix_cache_check.py --interview_id STOCK_MARKET --sessions 20
+"""
+from argparse import ArgumentParser
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from parameters import INTERVIEW_PARAMETERS
+from core.agent import LLMAgent
+from core.context import InterviewContext
+from core.templates import InterviewTemplate
+from core.tokens import count_tokens
+
+WORDS = "money risk savings bank fees trust family time retirement market crash news friends debt job house".split()
+
+# OpenAI's minimum cacheable prefix (tokens)
+MIN_CACHED_TOKENS = 1024
+
+def synthetic_session(parameters:dict, seed:int) -> list:
+    """ Return history of a session at a random point of the interview, with random answers. """
+    rng = random.Random(seed)
+    num_topics = len(parameters['interview_plan'])
+    num_messages = 2 * rng.randint(1, 20) + 1
+    history = []
+    for order in range(1, num_messages + 1):
+        message_type = 'question' if order % 2 else 'answer'
+        history.append({
+            'order': order,
+            'session_id': f"session-{seed}",
+            'topic_idx': 1 + (order - 1) * num_topics // 41,
+            'summary': [],
+            'type': message_type,
+            'content': f"{message_type} {order}: " + " ".join(rng.choices(WORDS, k=rng.randint(5, 60)))
+        })
+    return history
+
+def serialize(messages:list) -> str:
+    """ Return messages in the order the model reads them. """
+    return "".join(f"<{message['role']}>\n{message['content']}\n" for message in messages)
+
+def check(parameters:dict, num_sessions:int) -> dict:
+    """ Return shared prefix (bytes, tokens) and mean prompt length (bytes) of each task. """
+    template = InterviewTemplate(parameters)
+    agent = LLMAgent(api_key="offline")
+    contexts = [InterviewContext(synthetic_session(parameters, seed)) for seed in range(num_sessions)]
+    result = {}
+    for task in template.prompts:
+        prompts = [
+            serialize(agent.construct_query(template, [task], context, "my answer")[task]['messages'])
+                for context in contexts
+        ]
+        prefix = os.path.commonprefix(prompts)
+        model = template.prompts[task].settings['model']
+        result[task] = {
+            'bytes': len(prefix.encode()),
+            'tokens': count_tokens(prefix, model),
+            'prompt': sum(len(prompt.encode()) for prompt in prompts) / len(prompts)
+        }
+    return result
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('--interview_id', type=str, default='STOCK_MARKET', help="Key of interview parameters")
+    parser.add_argument('--sessions', type=int, default=20, help="Number of synthetic sessions")
+    args = parser.parse_args()
+    parameters = INTERVIEW_PARAMETERS[args.interview_id]
+    print(f"Byte-identical prefix of prompts across {args.sessions} sessions:")
+    print(f"{'task':>12}{'layout':>16}{'prefix bytes':>14}{'tokens':>8}{'mean prompt bytes':>19}")
+    for cache_friendly in [False, True]:
+        result = check({**parameters, 'cache_friendly_prompts': cache_friendly}, args.sessions)
+        for task, lengths in result.items():
+            layout = 'cache-friendly' if cache_friendly else 'inline'
+            cached = " (cacheable)" if lengths['tokens'] >= MIN_CACHED_TOKENS else ""
+            print(f"{task:>12}{layout:>16}{lengths['bytes']:>14}{lengths['tokens']:>8}{lengths['prompt']:>19.0f}{cached}")
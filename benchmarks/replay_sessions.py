@@ -0,0 +1,73 @@
+"""
+Deterministic benchmark of the whole `next_question` pipeline: the answers of stored interviews
+are given again, in new sessions, with the OpenAI requests recorded to or replayed from a
+cassette (see `app/core/cassette.py`). Record once (against OpenAI or `mock_openai.py`), then
+replay with the original latencies or none, e.g. to compare changes to the workflow by its
+overhead alone. Summaries are generated before responding rather than in the background,
+such that each replay sends the same requests. Sessions are loaded as by `prefilter_eval.py`,
+from the configured database or a CSV export of `aws_retrieve.py`. Run from the repository root:
+    python benchmarks/replay_sessions.py --cassette sessions.jsonl.gz --record
+    python benchmarks/replay_sessions.py --cassette sessions.jsonl.gz --zero_latency
+"""
+from argparse import ArgumentParser
+from itertools import groupby
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from prefilter_eval import load_messages
+from core.usage import percentiles
+
+POINTS = (50, 95, 99)
+
+REPLAY_PREFIX = "replay-"
+
+def stored_interviews(messages:list, default_interview_id:str, max_sessions:int=None) -> list:
+    """ Return (session ID, interview ID, answers) of stored sessions, except earlier replays. """
+    interviews = []
+    for session_id, session in groupby(messages, key=lambda message: message['session_id']):
+        if session_id.startswith(REPLAY_PREFIX):
+            continue
+        history = list(session)
+        answers = [message['content'] for message in history if message['type'] == 'answer']
+        interview_id = next((message['interview_id'] for message in history if message.get('interview_id')), default_interview_id)
+        if answers:
+            interviews.append((session_id, interview_id, answers))
+    return interviews[:max_sessions]
+
+def replay(interviews:list) -> dict:
+    """ Return seconds of each turn, answering questions with the stored answers until they or the interview end. """
+    from core import logic
+    logic.schedule_summary = logic.summarize_session
+    turns = []
+    for session_id, interview_id, answers in interviews:
+        replay_id = REPLAY_PREFIX + session_id
+        logic.delete_interview_session(replay_id)
+        for answer in [None] + answers:
+            start = time.monotonic()
+            response = logic.next_question(replay_id, interview_id, answer)
+            turns.append(time.monotonic() - start)
+            if '---END---' in response['message']:
+                break
+    return {'turns': len(turns), 'duration': sum(turns), 'turn_ms': percentiles([round(1000 * seconds) for seconds in turns], POINTS)}
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('--cassette', type=str, required=True, help="File of recorded OpenAI requests")
+    parser.add_argument('--record', action='store_true', help="Record requests (sent to OpenAI or `OPENAI_BASE_URL`) instead of replaying them")
+    parser.add_argument('--zero_latency', action='store_true', help="Replay responses without their original latency")
+    parser.add_argument('--interview_id', type=str, default='STOCK_MARKET', help="Key of interview parameters of sessions stored without it")
+    parser.add_argument('--csv', type=str, default=None, help="CSV export of interviews, instead of the configured database")
+    parser.add_argument('--sessions', type=int, default=None, help="Maximum number of sessions")
+    args = parser.parse_args()
+    # Configure the agent's cassette before it is instantiated (see `core.logic`)
+    os.environ["LLM_CASSETTE"] = args.cassette
+    os.environ["LLM_CASSETTE_MODE"] = 'record' if args.record else 'replay'
+    os.environ["LLM_CASSETTE_LATENCY"] = 'zero' if args.zero_latency else 'original'
+    interviews = stored_interviews(load_messages(args.csv), args.interview_id, args.sessions)
+    result = replay(interviews)
+    print(f"{len(interviews)} sessions, {result['turns']} turns in {result['duration']:.1f} seconds")
+    print("".join(f"{f'p{point} (ms)':>12}" for point in POINTS))
+    print("".join(f"{result['turn_ms'].get(f'p{point}', float('nan')):>12}" for point in POINTS))
@@ -0,0 +1,66 @@
+"""
+Peak memory of transcribing a recording with the Lambda handler (`app/lambda.py`): sent as
+base64 in a JSON body (`json`), or as the raw body, which API Gateway passes on base64-encoded
+(`raw`). Each is measured in a fresh process, as the rise of its peak resident set size (Linux)
+from the received event to the response. Recordings are random bytes of the size of Opus audio
+at the given bitrate. Use with the offline OpenAI stand-in (`mock_openai.py`), e.g.:
+    python benchmarks/mock_openai.py --port 8001 --transcription_latency 0.1 &
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=mock python benchmarks/transcribe_memory.py --minutes 5
+"""
+from argparse import ArgumentParser
+from base64 import b64encode
+import importlib
+import json
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+MODES = ['json', 'raw']
+
+def resident_memory(field:str) -> int:
+    """ Return current (`VmRSS`) or peak (`VmHWM`) resident set size of this process (bytes). """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field):
+                return int(line.split()[1]) * 1024
+
+def reset_peak_memory():
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+def measure(mode:str, size:int) -> dict:
+    """ Return size of recording, and resident memory before and at most while it is transcribed (bytes). """
+    handler = importlib.import_module('lambda').handler
+    recording = os.urandom(size)
+    if mode == 'json':
+        event = {'body': json.dumps({'route': 'transcribe', 'payload': {'audio': b64encode(recording).decode()}})}
+    else:
+        event = {'body': b64encode(recording).decode(), 'isBase64Encoded': True, 'queryStringParameters': {'route': 'transcribe'}}
+    del recording
+    reset_peak_memory()
+    before = resident_memory("VmRSS")
+    response = handler(event, None)
+    assert response['statusCode'] == 200, response
+    return {'size': size, 'before': before, 'peak': resident_memory("VmHWM")}
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('--minutes', type=float, default=5, help="Length of the recording")
+    parser.add_argument('--kbps', type=float, default=128, help="Bitrate of the recording")
+    parser.add_argument('--mode', type=str, choices=MODES, default=None, help="Measure in this process (otherwise each in its own)")
+    args = parser.parse_args()
+    size = int(args.minutes * 60 * args.kbps * 1000 / 8)
+    if args.mode:
+        print(json.dumps(measure(args.mode, size)))
+        sys.exit()
+    print(f"Recording of {args.minutes:g} minutes at {args.kbps:g} kbps: {size / 2**20:.1f} MiB")
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, __file__, '--minutes', str(args.minutes), '--kbps', str(args.kbps), '--mode', mode],
+            capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:>6}: {result['before'] / 2**20:.1f} MiB before, peak {result['peak'] / 2**20:.1f} MiB (+{(result['peak'] - result['before']) / 2**20:.1f} MiB)")